@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+
+"""
+Local stand-in for root servers, answers over UDP and TCP from signed zone.
+
+Answers follow rfc8198.Authoritative: tables decide between answer,
+referral, NODATA and NXDOMAIN and which NSEC covers a nonexistent name,
+records (including RRSIG and NSEC for DO queries) come from the zone file.
+Negative answers carry SOA with negative TTL used by the simulator.
+
+Responses are kept as wire format in LRU cache of cache_size items keyed
+by (qname, qtype, class, EDNS, DO). For a cached response only ID, RD bit
+and question (to keep case of query name) are copied from the query, so
+repeated queries cost a dict lookup. Sections are rendered with dnspython
+once per shape (referral, NSEC proof or answer RRset) and question length,
+so a new random name below a known TLD does not build a message.
+
+Received queries are counted per transport, totals printed on exit can be
+compared with auth.queries of the simulator:
+    authserver.py -z root.zone.signed --port 5353
+"""
+
+import argparse
+import asyncio
+import bisect
+import collections
+import signal
+import struct
+import sys
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+import dns.zone
+
+import canonical
+import rfc8198
+import zoneindex
+
+PAYLOAD = 1232  # advertised EDNS buffer size
+_QUESTION_TAIL = struct.Struct('>HH')
+_OPT = struct.Struct('>BHHBBH')  # root owner, type, payload, ext. rcode, version, flags
+
+
+def _placeholder(length):
+    """
+    Name of wire length made of labels no zone name has.
+    """
+    labels = []
+    remaining = length - 1
+    while remaining:
+        size = min(remaining, 64)
+        if remaining - size == 1:
+            size -= 1
+        labels.append(b'\xff' * (size - 1))
+        remaining -= size
+    return dns.name.Name(labels + [b''])
+
+
+class Server(object):
+    def __init__(self, zonefile, cache_size=1 << 16):
+        """
+        zonefile must be zone file, snapshots do not contain records
+        """
+        self.zone = dns.zone.from_file(zonefile, origin=dns.name.root, relativize=False)
+        self.auth = rfc8198.Authoritative(zoneindex.ZoneIndex.from_zone(self.zone))
+        self.cuts = set(self.auth.zone.ns) - {dns.name.root}
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # key -> response wire
+        self.shapes = collections.OrderedDict()  # shape key -> response to placeholder
+        self.queries = 0
+        self.udp = 0
+        self.tcp = 0
+        self.truncated = 0
+        self.dropped = 0  # not a query or too short to answer
+
+    def _rrsets(self, section, name, rdtype, do, ttl=None):
+        """
+        Append RRset (and its RRSIG if do) from zone to message section.
+        """
+        node = self.zone.get_node(name)
+        if node is None:
+            return
+        rdataset = node.get_rdataset(dns.rdataclass.IN, rdtype)
+        if rdataset is None:
+            return
+        section.append(dns.rrset.from_rdata_list(name, rdataset.ttl if ttl is None else ttl,
+                                                 list(rdataset)))
+        if do:
+            sigs = node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.RRSIG, rdtype)
+            if sigs is not None:
+                section.append(dns.rrset.from_rdata_list(name, sigs.ttl if ttl is None else ttl,
+                                                         list(sigs)))
+
+    def _covering(self, name):
+        """
+        Owner of NSEC covering name, same choice as rfc8198.Authoritative.
+        """
+        idx = bisect.bisect_right(self.auth.nsecs, canonical.key(name)) - 1
+        return self.auth.zone.nsecs[idx]
+
+    def _cut(self, name):
+        for depth in range(2, len(name) + 1):
+            ancestor = name.split(depth)[1]
+            if ancestor in self.cuts:
+                return ancestor
+        return None
+
+    def _negative(self, response, do):
+        response.flags |= dns.flags.AA
+        self._rrsets(response.authority, dns.name.root, dns.rdatatype.SOA, do, self.auth.neg_ttl)
+
+    def _shape(self, name, rdtype, do):
+        """
+        Key of response sections, the same for names with the same referral,
+        covering NSEC or NODATA proof.
+        """
+        nodes = self.auth.zone.nodes
+        cut = self._cut(name)
+        if cut is not None and (name != cut or rdtype != dns.rdatatype.DS):
+            return ('referral', cut)
+        node = nodes.get(name)
+        if node is None:
+            if not do:
+                return ('nxdomain',)
+            encloser = name.parent()
+            while encloser not in nodes:
+                encloser = encloser.parent()
+            owners = {self._covering(name), self._covering(dns.name.from_text('*', encloser))}
+            return ('nxdomain',) + tuple(sorted(owners))
+        if rdtype in node:
+            return ('answer', name, rdtype)
+        return ('nodata', name if do else None)
+
+    def _fill(self, response, shape, do):
+        nodes = self.auth.zone.nodes
+        kind = shape[0]
+        if kind == 'referral':
+            cut = shape[1]
+            self._rrsets(response.authority, cut, dns.rdatatype.NS, False)
+            if do:
+                if dns.rdatatype.DS in nodes[cut]:
+                    self._rrsets(response.authority, cut, dns.rdatatype.DS, True)
+                else:  # insecure delegation
+                    self._rrsets(response.authority, cut, dns.rdatatype.NSEC, True)
+            for target in self.auth.zone.ns[cut]:
+                for glue in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                    self._rrsets(response.additional, target, glue, False)
+        elif kind == 'nxdomain':
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            self._negative(response, do)
+            for owner in shape[1:]:
+                self._rrsets(response.authority, owner, dns.rdatatype.NSEC, True)
+        elif kind == 'answer':
+            response.flags |= dns.flags.AA
+            self._rrsets(response.answer, shape[1], shape[2], do)
+        else:
+            self._negative(response, do)
+            if do:
+                self._rrsets(response.authority, shape[1], dns.rdatatype.NSEC, True)
+
+    def _render(self, response, question, shape, do):
+        """
+        Render sections of shape with placeholder question of the same
+        length, so no name points into it and the real one can be put in.
+        """
+        key = (shape, len(question.name.to_wire()), question.rdtype,
+               response.edns, do, response.opcode())
+        wire = self.shapes.get(key)
+        if wire is None:
+            response.question = [dns.rrset.RRset(_placeholder(key[1]), question.rdclass,
+                                                 question.rdtype)]
+            self._fill(response, shape, do)
+            wire = self.shapes[key] = response.to_wire(max_size=65535)
+            if len(self.shapes) > self.cache_size:
+                self.shapes.popitem(last=False)
+        else:
+            self.shapes.move_to_end(key)
+        qwire = question.name.to_wire() + _QUESTION_TAIL.pack(question.rdtype, question.rdclass)
+        flags = (wire[2] & 0xfe) | (response.flags >> 8 & 0x01)  # RD of this query
+        return struct.pack('>H', response.id) + bytes([flags]) + wire[3:12] + qwire + \
+            wire[12 + len(qwire):]
+
+    def _build(self, wire):
+        """
+        Response to query in wire format using dnspython, None if not a query.
+        """
+        try:
+            query = dns.message.from_wire(wire)
+        except dns.exception.DNSException:
+            if len(wire) < 12:
+                return None
+            # echo ID and opcode only
+            return wire[:2] + bytes([0x80 | (wire[2] & 0x78), dns.rcode.FORMERR]) + bytes(8)
+        if query.flags & dns.flags.QR:
+            return None
+        response = dns.message.make_response(query, our_payload=PAYLOAD)
+        if query.opcode() != dns.opcode.QUERY:
+            response.set_rcode(dns.rcode.NOTIMP)
+        elif len(query.question) != 1:
+            response.set_rcode(dns.rcode.FORMERR)
+        elif query.question[0].rdclass != dns.rdataclass.IN:
+            response.set_rcode(dns.rcode.REFUSED)
+        else:
+            do = bool(query.ednsflags & dns.flags.DO)
+            if do:
+                response.want_dnssec()
+            question = query.question[0]
+            return self._render(response, question, self._shape(question.name, question.rdtype, do), do)
+        return response.to_wire(max_size=65535)
+
+    def answer(self, wire, limit=None):
+        """
+        Response to query in wire format or None if it should be dropped.
+        limit is maximum UDP response size, None for TCP.
+        """
+        self.queries += 1
+        # fast path: one question, no or only OPT additional record
+        if len(wire) < 17 or wire[2] & 0xf8 or wire[4:6] != b'\x00\x01':
+            return self._slow(wire)
+        pos = 12
+        try:
+            length = wire[pos]
+            while length:
+                if length & 0xc0:
+                    return self._slow(wire)
+                pos += length + 1
+                length = wire[pos]
+        except IndexError:
+            return self._slow(wire)
+        end = pos + 5
+        if end > len(wire):
+            return self._slow(wire)
+        qtype, qclass = _QUESTION_TAIL.unpack_from(wire, pos + 1)
+        edns = do = False
+        payload = 512
+        if wire[10:12] != b'\x00\x00':
+            if len(wire) < end + 11 or wire[10:12] != b'\x00\x01':
+                return self._slow(wire)
+            owner, rdtype, payload, _, _, flags = _OPT.unpack_from(wire, end)
+            if owner or rdtype != dns.rdatatype.OPT:
+                return self._slow(wire)
+            edns = True
+            do = bool(flags & dns.flags.DO)
+            payload = max(payload, 512)
+
+        key = (wire[12:pos + 1].lower(), qtype, qclass, edns, do)
+        cache = self.cache
+        response = cache.get(key)
+        if response is None:
+            response = self._build(wire)
+            if response is None or response[4:6] != b'\x00\x01':  # not answerable
+                if response is None:
+                    self.dropped += 1
+                return response
+            cache[key] = response
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+
+        flags = (response[2] & 0xfe) | (wire[2] & 0x01)  # copy RD
+        if limit is not None and len(response) > min(limit, payload):
+            self.truncated += 1
+            header = wire[:2] + bytes([flags | 0x02, response[3]])
+            if edns:
+                opt = _OPT.pack(0, dns.rdatatype.OPT, PAYLOAD, 0, 0, dns.flags.DO if do else 0)
+                return header + b'\x00\x01\x00\x00\x00\x00\x00\x01' + wire[12:end] + opt + b'\x00\x00'
+            return header + b'\x00\x01\x00\x00\x00\x00\x00\x00' + wire[12:end]
+        return wire[:2] + bytes([flags]) + response[3:12] + wire[12:end] + response[end:]
+
+    def _slow(self, wire):
+        response = self._build(wire)
+        if response is None:
+            self.dropped += 1
+        return response
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server, limit):
+        self.server = server
+        self.limit = limit
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server.udp += 1
+        response = self.server.answer(data, self.limit)
+        if response is not None:
+            self.transport.sendto(response, addr)
+
+
+async def _tcp_client(server, reader, writer):
+    try:
+        while True:
+            length, = struct.unpack('>H', await reader.readexactly(2))
+            wire = await reader.readexactly(length)
+            server.tcp += 1
+            response = server.answer(wire)
+            if response is None:
+                break
+            writer.write(struct.pack('>H', len(response)) + response)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start(server, host='127.0.0.1', port=5353, udp_limit=65535):
+    """
+    Listen on UDP and TCP, port 0 picks free port (the same for both).
+    Returns (UDP transport, asyncio.Server for TCP, port).
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _UdpProtocol(server, udp_limit), local_addr=(host, port))
+    port = transport.get_extra_info('sockname')[1]
+    tcp = await asyncio.start_server(lambda reader, writer: _tcp_client(server, reader, writer),
+                                     host, port)
+    return transport, tcp, port
+
+
+async def _serve(server, host, port):
+    transport, tcp, port = await start(server, host, port)
+    print('listening on {} port {}'.format(host, port), file=sys.stderr)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    await stop.wait()
+    transport.close()
+    tcp.close()
+    await tcp.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve zone over UDP and TCP on localhost.')
+    parser.add_argument('-z', '--zone', default='root.zone', help='signed zone file (default: %(default)s)')
+    parser.add_argument('--address', default='127.0.0.1', help='listen address (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=5353, help='UDP and TCP port (default: %(default)s)')
+    parser.add_argument('--cache-size', type=int, default=1 << 16,
+                        help='number of cached responses (default: %(default)s)')
+    args = parser.parse_args()
+
+    server = Server(args.zone, args.cache_size)
+    asyncio.run(_serve(server, args.address, args.port))
+    print('queries,udp,tcp,truncated,dropped', file=sys.stderr)
+    print(','.join(str(value) for value in (server.queries, server.udp, server.tcp,
+                                            server.truncated, server.dropped)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/python3
+
+"""
+Benchmarks of replay stages with machine-readable results.
+
+Every case measures one stage and runs in a fresh process, so its peak
+RSS does not include memory of earlier cases:
+- parse.slow, parse.fast: read_queries() and read_queries_fast() of query log
+- zone.<zone>.<module>: Authoritative.__init__ from zone file
+- lookup.<zone>.<module>: Resolver.lookup() including set_reltime()
+
+Zones are the bundled root zone and synthetic root zones with given number
+of delegations (synth<N>). Query logs are generated from names of each zone:
+existing and nonexistent TLDs, QPS queries per second of log time.
+
+Each case reports best time of --repeat runs, operations (queries, zone
+loads) per second, memory blocks and bytes retained per operation, peak
+of bytes allocated per operation (bytes are traced by tracemalloc in an
+extra run), peak RSS of the process and growth of peak RSS during the
+first run over its level after setup (i.e. zone tables for lookups are
+left out), both in kB. Results are stored as JSON and can be compared
+with an earlier run:
+    benchmark.py -o base.json
+    benchmark.py -o new.json --compare base.json --threshold 0.1
+Comparison exits with status 1 if operations per second dropped or growth
+of peak RSS (peak RSS for results without it) rose by more than the
+threshold; RSS changes are relative to at least MIN_RSS_KB so that a few
+pages over tiny baseline do not count.
+"""
+
+import argparse
+import datetime
+import gc
+import importlib
+import json
+import multiprocessing
+import os.path
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import dns.name
+import dns.rdatatype
+
+import canonical
+import qlog2cache
+import zoneindex
+
+MODULES = ('rfc2308', 'rfc4035', 'rfc8198')
+STAGES = ('parse', 'zone', 'lookup')
+QPS = 100  # queries per second of log time in generated logs
+QTYPES = ('A', 'AAAA', 'NS', 'DS', 'MX', 'TXT')
+EXISTING = 0.6
+START = datetime.datetime(2017, 9, 8)
+MIN_RSS_KB = 1024  # RSS differences are relative to at least this, pages make small cases noisy
+
+
+def synthetic_zone(path, count, seed=0):
+    """
+    Write root zone with count signed delegations and NSEC chain.
+    Each TLD has two NS with glue, half of them have DS.
+    """
+    rand = random.Random(seed)
+    tlds = set()
+    while len(tlds) < count:
+        tlds.add(dns.name.from_text(_label(rand)))
+    owners = sorted(tlds | {dns.name.root})
+    with open(path, 'w') as f:
+        f.write('. 86400 IN SOA a.root-servers.net. nstld. 1 1800 900 604800 86400\n')
+        f.write('. 518400 IN NS a.root-servers.net.\n')
+        for idx, owner in enumerate(owners):
+            nxt = owners[(idx + 1) % len(owners)]
+            if owner == dns.name.root:
+                f.write('. 86400 IN NSEC {} NS SOA RRSIG NSEC\n'.format(nxt))
+                continue
+            types = 'NS RRSIG NSEC'
+            for server in ('ns1', 'ns2'):
+                f.write('{0} 172800 IN NS {1}.nic.{0}\n'.format(owner, server))
+                f.write('{1}.nic.{0} 172800 IN A 192.0.2.{2}\n'.format(owner, server, idx % 250 + 1))
+            if idx % 2:
+                f.write('{} 86400 IN DS 1 8 2 {}\n'.format(owner, '%064x' % idx))
+                types = 'NS DS RRSIG NSEC'
+            f.write('{} 86400 IN NSEC {} {}\n'.format(owner, nxt, types))
+
+
+def _label(rand):
+    return ''.join(rand.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rand.randint(3, 12)))
+
+
+def query_log(path, zone, count, seed=0):
+    """
+    Write query log of count queries for TLDs, like logs of the root
+    server the simulator reads, fraction EXISTING of them exists in zone.
+    """
+    rand = random.Random(seed)
+    tlds = sorted(name for name in zone.ns if name != dns.name.root)
+    with open(path, 'w') as f:
+        for idx in range(count):
+            if rand.random() < EXISTING:
+                name = rand.choice(tlds).to_text()
+            else:
+                name = _label(rand) + '.'
+            now = START + datetime.timedelta(seconds=idx / QPS)
+            f.write("{}+02:00 '{}' type '{}'\n".format(now.isoformat(timespec='microseconds'),
+                                                      name, rand.choice(QTYPES)))
+
+
+def _parse(logfile, fast):
+    def run():
+        if fast:
+            with open(logfile, 'rb') as f:
+                return sum(1 for _ in qlog2cache.read_queries_fast(f))
+        with open(logfile) as f:
+            return sum(1 for _ in qlog2cache.read_queries(f))
+    return run
+
+
+def _zone(zonefile, module):
+    module = importlib.import_module(module)
+
+    def run():
+        module.Authoritative(zonefile)
+        return 1
+    return run
+
+
+def _lookup(zonefile, module, logfile):
+    module = importlib.import_module(module)
+    with open(logfile, 'rb') as f:
+        queries = list(qlog2cache.read_queries_fast(f))
+    res = module.Resolver(module.Authoritative(zonefile))
+    canonical._labels_to_key.cache_clear()  # every run starts cold like a replay
+
+    def run():
+        for now, qname, rrtype in queries:
+            res.set_reltime(now)
+            res.lookup(qname, rrtype)
+        return len(queries)
+    return run
+
+
+SETUP = {'parse': _parse, 'zone': _zone, 'lookup': _lookup}
+
+
+def peak_rss():
+    """
+    Peak RSS of this process in kB. ru_maxrss survives exec, so on Linux
+    VmHWM is used to leave out memory of the parent process.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset_peak_rss():
+    """
+    Lower VmHWM to current RSS where the kernel allows it, returns
+    peak_rss() after that.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+    return peak_rss()
+
+
+def measure(stage, params, repeat=3):
+    """
+    Run one case in this process, setup of stage is not measured.
+    """
+    best = None
+    growth = None
+    rss = 0
+    for _ in range(repeat):
+        run = SETUP[stage](*params)
+        gc.collect()  # garbage of earlier runs would be freed during this one
+        rss = max(rss, peak_rss())
+        base = reset_peak_rss()  # setup (e.g. parsing of zone file) can peak above its result
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        ops = run()
+        seconds = time.perf_counter() - start
+        blocks = sys.getallocatedblocks() - blocks
+        rss = max(rss, peak_rss())
+        if growth is None:  # without reset later runs stay below peak of the first one
+            growth = peak_rss() - base
+        if best is None or seconds < best[1]:
+            best = (ops, seconds, blocks)
+        del run
+    ops, seconds, blocks = best  # rss is taken before tracing which has memory overhead
+
+    run = SETUP[stage](*params)
+    gc.collect()
+    tracemalloc.start()
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'ops': ops,
+        'seconds': round(seconds, 6),
+        'ops_per_s': round(ops / seconds, 1),
+        'alloc_blocks_per_op': round(blocks / ops, 3),
+        'alloc_bytes_per_op': round((current - traced) / ops, 1),
+        'peak_alloc_bytes_per_op': round((peak - traced) / ops, 1),
+        'peak_rss_kb': rss,
+        'rss_growth_kb': growth,
+    }
+
+
+def _child(stage, params, repeat, queue):
+    result = None  # failure, traceback is printed by multiprocessing
+    try:
+        result = measure(stage, params, repeat)
+    finally:
+        queue.put(result)
+
+
+def run_isolated(stage, params, repeat=3):
+    """
+    measure() in a new process.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(stage, params, repeat, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    if result is None:
+        raise RuntimeError('benchmark of stage {} {} failed'.format(stage, params))
+    return result
+
+
+def cases(zones, logs, stages, modules):
+    """
+    List of (case name, stage, params) for zones {name: zone file}
+    and logs {zone name: query log}.
+    """
+    result = []
+    if 'parse' in stages:
+        result.append(('parse.slow', 'parse', (logs['root'], False)))
+        result.append(('parse.fast', 'parse', (logs['root'], True)))
+    for stage in ('zone', 'lookup'):
+        if stage not in stages:
+            continue
+        for zone, zonefile in zones.items():
+            for module in modules:
+                params = (zonefile, module, logs[zone]) if stage == 'lookup' else (zonefile, module)
+                result.append(('{}.{}.{}'.format(stage, zone, module), stage, params))
+    return result
+
+
+def compare(base, new, threshold):
+    """
+    (line, regression) for cases present in both results, regression is
+    True if ops/s dropped or RSS growth (peak RSS in older results) rose
+    by more than threshold (fraction) of the old value or of MIN_RSS_KB.
+    """
+    lines = []
+    for case, result in new['results'].items():
+        old = base['results'].get(case)
+        if old is None:
+            continue
+        field = 'rss_growth_kb' if 'rss_growth_kb' in old and 'rss_growth_kb' in result else 'peak_rss_kb'
+        speed = result['ops_per_s'] / old['ops_per_s'] - 1
+        rss = (result[field] - old[field]) / max(old[field], MIN_RSS_KB)
+        regression = speed < -threshold or rss > threshold
+        lines.append(('{:<28} {:>12.1f} {:>+7.1%} {:>9d} kB {:>+7.1%}{}'.format(
+            case, result['ops_per_s'], speed, result[field], rss,
+            '  REGRESSION' if regression else ''), regression))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parser, zone loading and lookups.')
+    parser.add_argument('-z', '--zone', default='root.zone', help='zone file (default: %(default)s)')
+    parser.add_argument('--scale', type=int, action='append', metavar='N',
+                        help='add synthetic zone with N delegations; can be repeated '
+                             '(default: 1000 and 10000)')
+    parser.add_argument('-n', '--queries', type=int, default=100000,
+                        help='queries in generated logs (default: %(default)s)')
+    parser.add_argument('-m', '--module', action='append', choices=MODULES,
+                        help='resolver module to measure; can be repeated (default: all)')
+    parser.add_argument('--stage', action='append', choices=STAGES,
+                        help='stage to measure; can be repeated (default: all)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each case, the fastest counts (default: %(default)s)')
+    parser.add_argument('-o', '--output', default='benchmark.json',
+                        help='JSON results (default: %(default)s)')
+    parser.add_argument('--compare', metavar='FILE', help='results of earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed relative drop of ops/s and growth of peak RSS '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+    if args.queries <= 0 or args.repeat <= 0:
+        parser.error('--queries and --repeat must be positive')
+    base = None
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        zones = {'root': args.zone}
+        for count in args.scale or [1000, 10000]:
+            zones['synth{}'.format(count)] = os.path.join(tmpdir, 'synth{}.zone'.format(count))
+            synthetic_zone(zones['synth{}'.format(count)], count)
+        logs = {}
+        for name, zonefile in zones.items():
+            logs[name] = os.path.join(tmpdir, '{}.log'.format(name))
+            query_log(logs[name], zoneindex.load(zonefile), args.queries)
+
+        results = {}
+        for case, stage, params in cases(zones, logs, args.stage or STAGES, args.module or MODULES):
+            results[case] = run_isolated(stage, params, args.repeat)
+            print('{:<28} {:>12.1f} ops/s {:>8.1f} blocks/op {:>10.1f} peak B/op {:>9d} kB '
+                  '{:>+9d} kB'.format(
+                      case, results[case]['ops_per_s'], results[case]['alloc_blocks_per_op'],
+                      results[case]['peak_alloc_bytes_per_op'], results[case]['peak_rss_kb'],
+                      results[case]['rss_growth_kb']), file=sys.stderr)
+
+    new = {
+        'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                 'python': platform.python_version(), 'platform': platform.platform(),
+                 'zone': args.zone, 'queries': args.queries, 'repeat': args.repeat},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(new, f, indent=1, sort_keys=True)
+    if base is not None:
+        lines = compare(base, new, args.threshold)
+        for line, _ in lines:
+            print(line)
+        if any(regression for _, regression in lines):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Canonical sort keys for DNS names.
+
+Comparing dns.name.Name objects walks labels in Python, so names used
+in ordered structures are converted to bytes which compare natively
+in DNSSEC canonical order (RFC 4034 section 6.1): labels from the right,
+lowercased, each terminated by 00 00. Octet 00 inside label is escaped
+as 00 01 so that shorter label still sorts first.
+
+Keys are memoized by label tuple, i.e. computed once per name.
+"""
+
+import functools
+
+import dns.name
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _labels_to_key(labels):
+    return b''.join(label.lower().replace(b'\x00', b'\x00\x01') + b'\x00\x00'
+                    for label in reversed(labels[:-1]))
+
+
+def key(name):
+    """
+    Canonical sort key of absolute name.
+    """
+    assert name.is_absolute()
+    return _labels_to_key(name.labels)
+
+
+def labels(key):
+    """
+    Lowercase labels of name with given key, root label included.
+    """
+    parts = key.split(b'\x00\x00')[:-1]
+    return tuple(label.replace(b'\x00\x01', b'\x00') for label in reversed(parts)) + (b'',)
+
+
+def to_name(key):
+    return dns.name.Name(labels(key))
+
+
+def wire_length(key):
+    return sum(len(label) + 1 for label in labels(key))
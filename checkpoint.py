@@ -0,0 +1,108 @@
+"""
+Checkpoint of replay state so long runs can be resumed or forked.
+
+Checkpoint file is MAGIC followed by pickle (highest protocol) of State:
+resolvers with their caches (storage, NSEC ordering, expiry heap, eviction
+policy, NSEC3 hash memo), cache and auth counters, current reltime, report
+state and number of input queries consumed. Zone tables shared by
+Authoritatives are not stored, they are loaded again from the zone file or
+snapshot on resume. Tables Authoritatives derive from them (NSEC owner
+keys, NSEC3 chain, child zones of hierarchy) are left out as well and
+built again when unpickled, checkpoint size depends on cache content.
+
+Files are written to temporary name and renamed, interrupted write never
+leaves broken checkpoint behind.
+
+Resumed replay skips queries consumed before the checkpoint and gives
+the same counters as uninterrupted one. Warm start (fork) feeds new input
+to resolvers from checkpoint, times of the new input are shifted to
+continue after the checkpoint.
+"""
+
+import io
+import os
+import pickle
+
+import rfc2308
+
+MAGIC = b'DNSCKPT1'
+
+
+class State(object):
+    def __init__(self, resolvers, consumed=0, now=0, prevtime=0, prev=None, shift=0):
+        """
+        resolvers: OrderedDict policy name -> Resolver
+        consumed: number of input queries fed to resolvers
+        now: reltime of the last query
+        prevtime, prev: time of the last report row and counters written in it
+        shift: seconds added to reltime of input, non-zero after warm start
+        """
+        self.resolvers = resolvers
+        self.consumed = consumed
+        self.now = now
+        self.prevtime = prevtime
+        self.prev = prev
+        self.shift = shift
+        self.zone_id = None  # sizes of zone tables, guards against loading with other zone
+
+
+def _zone_id(zone):
+    return (len(zone.nodes), len(zone.nsec), len(zone.nsec3), zone.nsec3param, zone.neg_ttl)
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, zone):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.zone = zone
+
+    def persistent_id(self, obj):
+        return 'zone' if obj is self.zone else None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, zone):
+        super().__init__(file)
+        self.zone = zone
+
+    def persistent_load(self, pid):
+        if pid != 'zone':
+            raise pickle.UnpicklingError('unknown persistent id {!r}'.format(pid))
+        return self.zone
+
+
+def save(path, state):
+    """
+    Write state atomically, zone tables of its Authoritatives are left out.
+    """
+    zone = next(iter(state.resolvers.values())).auth.zone
+    state.zone_id = _zone_id(zone)
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        _Pickler(f, zone).dump(state)
+    os.replace(tmp, path)
+
+
+def warm(state):
+    """
+    Prepare loaded state for new input which starts at time 0.
+    """
+    state.shift = state.now
+    state.consumed = 0
+    return state
+
+
+def load(path, zonedb):
+    """
+    Read State, zonedb is zone file, snapshot or result of rfc2308.load_zone()
+    and must be the zone checkpoint was made with.
+    """
+    zone = rfc2308.load_zone(zonedb)
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError('{} is not a checkpoint'.format(path))
+    state = _Unpickler(io.BytesIO(memoryview(data)[len(MAGIC):]), zone).load()
+    if state.zone_id != _zone_id(zone):
+        raise ValueError('checkpoint {} was made with different zone'.format(path))
+    return state
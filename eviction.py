@@ -0,0 +1,206 @@
+"""
+Eviction policies for capacity-bounded caches.
+
+Policy tracks resident keys and their weights (1 per entry or estimated
+size in bytes) and decides which key goes away when cache is over limit.
+Cache calls:
+- insert(key, weight) when a new key becomes resident
+- access(key) when resident key is used again
+- remove(key) when cache drops the key on its own (e.g. expiry)
+- evict() to pick a victim, policy forgets the victim and returns its key
+"""
+
+from collections import OrderedDict
+
+
+class LRU(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.keys = OrderedDict()
+
+    def insert(self, key, weight):
+        self.keys[key] = weight
+
+    def access(self, key):
+        self.keys.move_to_end(key)
+
+    def remove(self, key):
+        del self.keys[key]
+
+    def evict(self):
+        return self.keys.popitem(last=False)[0]
+
+
+class LFU(object):
+    """
+    Least frequently used, ties broken by LRU order.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.freq = {}  # key -> use count
+        self.buckets = {}  # use count -> OrderedDict of keys
+        self.min_freq = 0
+
+    def _unlink(self, key):
+        freq = self.freq.pop(key)
+        bucket = self.buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[freq]
+        return freq
+
+    def _link(self, key, freq):
+        self.freq[key] = freq
+        self.buckets.setdefault(freq, OrderedDict())[key] = None
+
+    def insert(self, key, weight):
+        self._link(key, 1)
+        self.min_freq = 1
+
+    def access(self, key):
+        freq = self._unlink(key)
+        if freq == self.min_freq and freq not in self.buckets:
+            self.min_freq = freq + 1
+        self._link(key, freq + 1)
+
+    def remove(self, key):
+        self._unlink(key)
+
+    def evict(self):
+        if self.min_freq not in self.buckets:  # min bucket was removed
+            self.min_freq = min(self.buckets)
+        key = next(iter(self.buckets[self.min_freq]))
+        self._unlink(key)
+        return key
+
+
+class ARC(object):
+    """
+    Adaptive Replacement Cache (Megiddo & Modha), weighted variant.
+
+    T1/T2 hold resident keys seen once/more than once,
+    B1/B2 are ghost lists of keys recently evicted from T1/T2.
+    Target size p of T1 adapts on ghost hits.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.p = 0
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+        self.size = {'t1': 0, 't2': 0, 'b1': 0, 'b2': 0}
+        self.from_b2 = False
+
+    def _push(self, lst, key, weight):
+        getattr(self, lst)[key] = weight
+        self.size[lst] += weight
+
+    def _pop(self, lst, key=None):
+        od = getattr(self, lst)
+        if key is None:
+            key, weight = od.popitem(last=False)
+        else:
+            weight = od.pop(key)
+        self.size[lst] -= weight
+        return key, weight
+
+    def _trim_ghosts(self):
+        size = self.size
+        while self.b1 and size['t1'] + size['b1'] > self.capacity:
+            self._pop('b1')
+        while (self.b1 or self.b2) and sum(size.values()) > 2 * self.capacity:
+            self._pop('b2' if self.b2 else 'b1')
+
+    def insert(self, key, weight):
+        size = self.size
+        if key in self.b1:
+            ratio = max(size['b2'] / size['b1'], 1)
+            self.p = min(self.capacity, self.p + ratio * weight)
+            self._pop('b1', key)
+            self._push('t2', key, weight)
+            self.from_b2 = False
+        elif key in self.b2:
+            ratio = max(size['b1'] / size['b2'], 1)
+            self.p = max(0, self.p - ratio * weight)
+            self._pop('b2', key)
+            self._push('t2', key, weight)
+            self.from_b2 = True
+        else:
+            self._push('t1', key, weight)
+            self.from_b2 = False
+        self._trim_ghosts()
+
+    def access(self, key):
+        if key in self.t1:
+            self._push('t2', *self._pop('t1', key))
+        else:
+            self.t2.move_to_end(key)
+
+    def remove(self, key):
+        self._pop('t1' if key in self.t1 else 't2', key)
+
+    def evict(self):
+        t1 = self.size['t1']
+        if self.t1 and (not self.t2 or t1 > self.p or (self.from_b2 and t1 == self.p)):
+            key, weight = self._pop('t1')
+            self._push('b1', key, weight)
+        else:
+            key, weight = self._pop('t2')
+            self._push('b2', key, weight)
+        self._trim_ghosts()
+        return key
+
+
+class TwoQ(object):
+    """
+    Full 2Q (Johnson & Shasha): new keys go to FIFO A1in, keys evicted from
+    A1in are remembered in ghost FIFO A1out, and keys re-inserted while
+    in A1out are promoted to LRU list Am.
+    """
+    def __init__(self, capacity, kin=0.25, kout=0.5):
+        self.capacity = capacity
+        self.kin = kin * capacity
+        self.kout = kout * capacity
+        self.a1in = OrderedDict()
+        self.a1out = OrderedDict()
+        self.am = OrderedDict()
+        self.a1in_size = 0
+        self.a1out_size = 0
+
+    def insert(self, key, weight):
+        if key in self.a1out:
+            self.a1out_size -= self.a1out.pop(key)
+            self.am[key] = weight
+        else:
+            self.a1in[key] = weight
+            self.a1in_size += weight
+
+    def access(self, key):
+        if key in self.am:
+            self.am.move_to_end(key)
+
+    def remove(self, key):
+        if key in self.am:
+            del self.am[key]
+        else:
+            self.a1in_size -= self.a1in.pop(key)
+
+    def evict(self):
+        if self.a1in and (self.a1in_size > self.kin or not self.am):
+            key, weight = self.a1in.popitem(last=False)
+            self.a1in_size -= weight
+            self.a1out[key] = weight
+            self.a1out_size += weight
+            while self.a1out_size > self.kout:
+                self.a1out_size -= self.a1out.popitem(last=False)[1]
+            return key
+        return self.am.popitem(last=False)[0]
+
+
+POLICIES = {
+    'lru': LRU,
+    'lfu': LFU,
+    'arc': ARC,
+    '2q': TwoQ,
+}
@@ -0,0 +1,157 @@
+"""
+Fleet of resolver instances behind a load balancer.
+
+Every instance has its own cache, all of them ask one shared Authoritative,
+so upstream queries of the fleet grow with cache fragmentation. Balancer
+policies:
+- random: uniformly random instance
+- round-robin: instances in turn
+- client-hash: consistent hashing of client address, queries without
+  client address are hashed by qname and counted in clientless
+- qname-hash: consistent hashing of lowercase qname, each name is cached
+  by one instance only
+
+Consistent hashing places VNODES points per instance on a 64-bit ring,
+a key goes to the instance owning the first point at or after its hash.
+
+Report has per-instance and aggregate queries, hit ratio and upstream
+queries for each balancer policy:
+    <policy>.all.queries,<policy>.all.hit_ratio,<policy>.all.auth,<policy>.0.queries,...
+"""
+
+import bisect
+import hashlib
+import importlib
+import random
+
+import rfc2308
+
+POLICIES = ('random', 'round-robin', 'client-hash', 'qname-hash')
+VNODES = 64
+FIELDS = ['queries', 'hit_ratio', 'auth']
+
+
+def _hash(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+class Ring(object):
+    """
+    Consistent hash ring of instances 0 .. size-1.
+    """
+    def __init__(self, size, vnodes=VNODES):
+        points = sorted((_hash('{}-{}'.format(idx, vnode).encode('ascii')), idx)
+                        for idx in range(size) for vnode in range(vnodes))
+        self.points = [point for point, _ in points]
+        self.owners = [idx for _, idx in points]
+
+    def get(self, data):
+        pos = bisect.bisect_left(self.points, _hash(data))
+        return self.owners[pos % len(self.owners)]
+
+
+class Fleet(object):
+    def __init__(self, resolvers, policy='round-robin', seed=0):
+        """
+        resolvers share one Authoritative, policy is one of POLICIES
+        """
+        assert policy in POLICIES
+        assert len({id(res.auth) for res in resolvers}) == 1, 'instances must share auth'
+        self.resolvers = resolvers
+        self.auth = resolvers[0].auth
+        self.policy = policy
+        self.random = random.Random(seed)
+        self.ring = Ring(len(resolvers))
+        self.next = 0  # round-robin position
+        self.now = None
+        self.queries = [0] * len(resolvers)
+        self.upstream = [0] * len(resolvers)  # auth queries made by each instance
+        self.clientless = 0  # client-hash queries balanced by qname
+
+    def pick(self, name, client):
+        """
+        Index of instance which gets the query.
+        """
+        if self.policy == 'client-hash':
+            if client is not None:
+                return self.ring.get(client)
+            self.clientless += 1
+        if self.policy in ('qname-hash', 'client-hash'):
+            return self.ring.get(name.canonicalize().to_digestable())
+        if self.policy == 'random':
+            return self.random.randrange(len(self.resolvers))
+        idx = self.next
+        self.next = (idx + 1) % len(self.resolvers)
+        return idx
+
+    def set_reltime(self, reltime):
+        if reltime != self.now:
+            self.now = reltime
+            for res in self.resolvers:
+                res.set_reltime(reltime)
+
+    def lookup(self, name, rrtype, client=None):
+        idx = self.pick(name, client)
+        queries = self.auth.queries
+        outcome = self.resolvers[idx].lookup(name, rrtype)
+        self.queries[idx] += 1
+        self.upstream[idx] += self.auth.queries - queries
+        return outcome
+
+    def counters(self):
+        """
+        (queries, hits, auth queries) of whole fleet followed by each instance.
+        """
+        rows = [(queries, res.cache.hit, upstream)
+                for queries, res, upstream in zip(self.queries, self.resolvers, self.upstream)]
+        return [tuple(sum(values) for values in zip(*rows))] + rows
+
+
+def load_fleet(name, zonefile, size, policy, bounds=None, reclaim=False, options=None, seed=0,
+               auth_options=None):
+    """
+    Fleet of size instances of policy module name, bounds apply to each cache,
+    auth_options are keyword arguments of shared Authoritative.
+    """
+    module = importlib.import_module(name)
+    auth = module.Authoritative(rfc2308.load_zone(zonefile), **(auth_options or {}))
+    resolvers = []
+    for _ in range(size):
+        if bounds:
+            cache = module.BoundedCache(reclaim=reclaim, **bounds)
+        else:
+            cache = module.Cache(reclaim=reclaim)
+        resolvers.append(module.Resolver(auth, cache, None, **(options or {})))
+    return Fleet(resolvers, policy, seed)
+
+
+def _write(out, now, fleets):
+    row = [now]
+    for fleet in fleets:
+        for queries, hits, upstream in fleet.counters():
+            row.extend([queries, '{:.4f}'.format(hits / queries) if queries else '', upstream])
+    out.write(','.join(str(value) for value in row) + '\n')
+
+
+def replay(queries, fleets, out):
+    """
+    Feed each query to all fleets and write combined CSV roughly hourly.
+
+    queries are (reltime, name, rrtype) or (reltime, name, rrtype, client).
+    """
+    columns = ['time']
+    for fleet in fleets:
+        for instance in ['all'] + [str(idx) for idx in range(len(fleet.resolvers))]:
+            columns.extend('{}.{}.{}'.format(fleet.policy, instance, field) for field in FIELDS)
+    out.write(','.join(columns) + '\n')
+    prevtime = 0
+    for query in queries:
+        now, qname, rrtype = query[:3]
+        client = query[3] if len(query) > 3 else None
+        for fleet in fleets:
+            fleet.set_reltime(now)
+            fleet.lookup(qname, rrtype, client)
+
+        if now - prevtime >= 3600:
+            prevtime = int(now / 3600) * 3600
+            _write(out, now, fleets)
@@ -0,0 +1,300 @@
+"""
+Simulate resolution through the delegation hierarchy below the root.
+
+Root zone answers come from zone tables as in rfc4035, but names below
+a delegation get a referral (NS + DS of the zone cut) instead of NXDOMAIN.
+Child zones are created lazily on the first query sent to them: loaded
+from <zonedir>/<origin>zone if such file exists, synthesized otherwise.
+Only max_zones child zones are kept, the least recently queried ones are
+evicted and created again when needed (synthesized zones are deterministic).
+
+SyntheticZone at level < LEVELS delegates every existing name directly
+below its origin, zones at level LEVELS are leaves. Existence of names
+and RR types is decided by hash of the name, so all runs see the same
+namespace.
+
+Resolver caches referrals as NS and DS entries and starts resolution at
+the closest cut with valid NS in cache. Authoritative counts queries per
+zone level in by_level (0 = root, 1 = TLD, ...), levels deeper than
+LEVELS are counted in the last item. Caching is exact match as in rfc4035.
+"""
+
+import collections
+import os.path
+import zlib
+
+import dns.name
+import dns.rcode
+import dns.rdatatype
+
+import rfc2308
+import rfc4035
+import zoneindex
+
+LEVELS = 2  # synthesized TLD and SLD zones
+LEVEL_NAMES = ('root', 'tld', 'sld')
+MAX_ZONES = 4096
+
+# synthesized zones
+NXDOMAIN_RATIO = 0.2
+NODATA_RATIO = 0.3
+SIGNED_RATIO = 0.1  # delegations with DS
+NS_TTL = 172800
+DS_TTL = 86400
+TTL = 3600
+NEG_TTL = 900
+APEX_TYPES = (dns.rdatatype.SOA, dns.rdatatype.NS, dns.rdatatype.DNSKEY)
+
+REFERRAL = -1  # result of zone find() besides rfc2308 outcomes
+
+_HASH_RANGE = 1 << 32
+
+
+class Cache(rfc4035.Cache):
+    pass
+
+
+class BoundedCache(rfc4035.BoundedCache):
+    pass
+
+
+def _hash(name, salt=b''):
+    return zlib.crc32(name.to_digestable() + salt)
+
+
+def _below(name, origin):
+    """
+    Name directly below origin on the way to name.
+    """
+    return name.split(len(origin) + 1)[1]
+
+
+class SyntheticZone(object):
+    def __init__(self, origin):
+        self.origin = origin
+        self.level = len(origin) - 1
+        self.neg_ttl = NEG_TTL
+
+    def _exists(self, name):
+        return _hash(name) >= NXDOMAIN_RATIO * _HASH_RANGE
+
+    def _has_type(self, name, rrtype):
+        if name == self.origin:
+            return rrtype in APEX_TYPES
+        return _hash(name, rrtype.to_bytes(2, 'big')) >= NODATA_RATIO * _HASH_RANGE
+
+    def find(self, name, rrtype):
+        """
+        Returns (REFERRAL, cut) or (outcome, name) with outcome one of
+        rfc2308 POSITIVE, NXDOMAIN, NODATA.
+        """
+        if name != self.origin:
+            child = _below(name, self.origin)
+            if not self._exists(child):
+                return (rfc2308.NXDOMAIN, name)
+            if self.level < LEVELS:
+                if name != child or rrtype != dns.rdatatype.DS:
+                    return (REFERRAL, child)
+                return (rfc2308.POSITIVE if self.signed(child) else rfc2308.NODATA, name)
+            if name != child and not self._exists(name):
+                return (rfc2308.NXDOMAIN, name)
+        return (rfc2308.POSITIVE if self._has_type(name, rrtype) else rfc2308.NODATA, name)
+
+    def signed(self, cut):
+        return _hash(cut, b'DS') < SIGNED_RATIO * _HASH_RANGE
+
+    def ttl(self, name, rrtype):
+        """
+        TTL of existing RRset, NS and DS of delegations included.
+        """
+        if name != self.origin and self.level < LEVELS:
+            if rrtype == dns.rdatatype.DS:
+                return DS_TTL if self.signed(name) else None
+            return NS_TTL
+        return TTL
+
+
+class ZoneTables(object):
+    """
+    Zone loaded into zoneindex.ZoneIndex, delegations are its NS owners
+    other than apex.
+    """
+    def __init__(self, origin, index):
+        self.origin = origin
+        self.index = index
+        self.neg_ttl = index.neg_ttl
+        self.cuts = set(index.ns) - {origin}
+
+    def _cut(self, name):
+        """
+        Topmost delegation on the way from origin to name or None.
+        """
+        if not self.cuts:
+            return None
+        for depth in range(len(self.origin) + 1, len(name) + 1):
+            ancestor = name.split(depth)[1]
+            if ancestor in self.cuts:
+                return ancestor
+        return None
+
+    def find(self, name, rrtype):
+        cut = self._cut(name)
+        if cut is not None and (name != cut or rrtype != dns.rdatatype.DS):
+            return (REFERRAL, cut)
+        node = self.index.nodes.get(name)
+        if node is None:
+            return (rfc2308.NXDOMAIN, name)
+        return (rfc2308.POSITIVE if rrtype in node else rfc2308.NODATA, name)
+
+    def ttl(self, name, rrtype):
+        return self.index.nodes[name].get(rrtype)
+
+
+class Authoritative(object):
+    def __init__(self, rootdb, zonedir=None, iterations=0, salt=b'', max_zones=MAX_ZONES):
+        """
+        rootdb is path to zone file, snapshot or result of rfc2308.load_zone(),
+        zonedir is directory with child zone files (default: all synthesized),
+        iterations and salt are ignored, see rfc2308.Authoritative
+        """
+        self.queries = 0
+        self.zone = zoneindex.load(rootdb)
+        self.neg_ttl = self.zone.neg_ttl
+        self.root = ZoneTables(dns.name.root, self.zone)
+        self.zonedir = zonedir
+        self.max_zones = max_zones
+        self.zones = collections.OrderedDict()  # origin -> zone, LRU order
+        self.created = 0
+        self.evictions = 0
+        self.by_level = [0] * (LEVELS + 1)
+        self.version = self.zone.version  # root zone diffs seen by this instance
+
+    def __getstate__(self):
+        # child zones are created again on unpickling, checkpoint keeps their origins
+        state = self.__dict__.copy()
+        del state['root']
+        state['zones'] = list(self.zones)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.root = ZoneTables(dns.name.root, self.zone)
+        self.zones = collections.OrderedDict((origin, self._create(origin)) for origin in state['zones'])
+
+    def set_reltime(self, reltime):
+        """
+        Switch to version of root zone active at reltime, see rfc2308.Authoritative.
+        """
+        if self.zone.diffs:
+            for diff in self.zone.advance(reltime, self.version):
+                self.neg_ttl = self.root.neg_ttl = self.zone.neg_ttl
+                self.root.cuts.difference_update(diff.deleted['ns'])
+                self.root.cuts.update(diff.added['ns'])
+                self.root.cuts.discard(dns.name.root)
+            self.version = self.zone.version
+
+    def _create(self, origin):
+        if self.zonedir:
+            path = os.path.join(self.zonedir, origin.to_text() + 'zone')
+            if os.path.exists(path):
+                return ZoneTables(origin, zoneindex.load(path, origin))
+        return SyntheticZone(origin)
+
+    def _zone(self, origin, counted=True):
+        """
+        Zone of origin kept in LRU, counted=False leaves out created
+        and evictions counters (lookups outside of query()).
+        """
+        if origin == dns.name.root:
+            return self.root
+        zone = self.zones.get(origin)
+        if zone is not None:
+            self.zones.move_to_end(origin)
+            return zone
+        zone = self.zones[origin] = self._create(origin)
+        self.created += counted
+        if len(self.zones) > self.max_zones:
+            self.zones.popitem(last=False)
+            self.evictions += counted
+        return zone
+
+    def query(self, name, rrtype, origin=dns.name.root):
+        """
+        Ask server of zone origin.
+
+        Returns: (rcode, {(name, rrtype): ttl}, cut), cut is None unless
+        the answer is referral to child zone
+
+        NXDOMAIN == rrtype ANY + TTL
+        """
+        assert name.is_absolute()
+        self.queries += 1
+        self.by_level[min(len(origin) - 1, LEVELS)] += 1
+        zone = self._zone(origin)
+        result, owner = zone.find(name, rrtype)
+        if result == rfc2308.NXDOMAIN:
+            return (dns.rcode.NXDOMAIN, {(name, dns.rdatatype.ANY): {"ttl": zone.neg_ttl}}, None)
+        if result == rfc2308.NODATA:
+            return (dns.rcode.NOERROR, {(name, rrtype): {"ttl": zone.neg_ttl}}, None)
+        if result == rfc2308.POSITIVE:
+            return (dns.rcode.NOERROR, {(name, rrtype): {"ttl": zone.ttl(name, rrtype)}}, None)
+        answers = {(owner, dns.rdatatype.NS): {"ttl": zone.ttl(owner, dns.rdatatype.NS)}}
+        ds_ttl = zone.ttl(owner, dns.rdatatype.DS)
+        if ds_ttl is not None:
+            answers[(owner, dns.rdatatype.DS)] = {"ttl": ds_ttl}
+        return (dns.rcode.NOERROR, answers, owner)
+
+    def outcome(self, name, rrtype):
+        """
+        Kind of final answer (rfc2308 POSITIVE, NXDOMAIN or NODATA),
+        queries are not counted, zones it needs are kept in LRU like in
+        query() so a hit does not parse evicted child zone again.
+        """
+        zone = self.root
+        while True:
+            result, owner = zone.find(name, rrtype)
+            if result != REFERRAL:
+                return result
+            zone = self._zone(owner, counted=False)
+
+
+class Resolver(rfc4035.Resolver):
+    def __init__(self, auth, cache=None, latency=None, **options):
+        super().__init__(auth, cache if cache is not None else Cache(), latency, **options)
+
+    def partition(self, name):
+        """
+        Cached referrals are shared by names under one TLD.
+        """
+        if len(name) > 2:
+            name = name.split(2)[1]
+        return zlib.crc32(name.to_digestable())
+
+    def closest_cut(self, name, rrtype):
+        """
+        Deepest ancestor of name with valid NS in cache, DS belongs to parent.
+        """
+        if rrtype == dns.rdatatype.DS and name != dns.name.root:
+            name = name.parent()
+        while name != dns.name.root:
+            if self.cache.peek(name, dns.rdatatype.NS):
+                return name
+            name = name.parent()
+        return name
+
+    def _resolve(self, name, rrtype):
+        """
+        Follow referrals from the closest cached cut down to the answer.
+        """
+        origin = self.closest_cut(name, rrtype)
+        while True:
+            rcode, answers, origin = self.auth.query(name, rrtype, origin)
+            if rcode == dns.rcode.NXDOMAIN:
+                self._store_nxdomain(answers)
+                return
+            self._store_noerror(answers)
+            if origin is None:
+                return
+
+    def _outcome(self, name, rrtype, outcome):
+        return self.auth.outcome(name, rrtype)
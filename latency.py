@@ -0,0 +1,164 @@
+"""
+Client-facing latency of simulated resolver.
+
+Model is plugged into Resolver: answer from cache costs constant hit time,
+a miss additionally costs RTT to one authoritative server. Servers are
+the NS set of the zone apex (root servers for root zone), each with its own
+RTT distribution. Server is selected as in BIND: lowest smoothed RTT wins,
+SRTT of the others decays on every query so that they get probed again.
+
+Latencies are in milliseconds and are summarized by Sketch, a mergeable
+quantile sketch with bounded relative error (DDSketch).
+"""
+
+import math
+import random
+
+import dns.name
+
+SRTT_WEIGHT = 0.3  # weight of new RTT sample
+SRTT_DECAY = 0.98  # applied to servers not selected
+
+
+def _const(value):
+    return lambda rng: value
+
+
+def _uniform(low, high):
+    return lambda rng: rng.uniform(low, high)
+
+
+def _lognormal(median, sigma):
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+def _exp(mean):
+    return lambda rng: rng.expovariate(1 / mean)
+
+
+DISTRIBUTIONS = {
+    'const': _const,
+    'uniform': _uniform,
+    'lognormal': _lognormal,  # median, sigma
+    'exp': _exp,  # mean
+}
+
+
+def parse_distribution(text):
+    """
+    Parse 'kind:param,param' e.g. 'lognormal:25,0.5' into function of random.Random.
+    """
+    kind, _, params = text.partition(':')
+    if kind not in DISTRIBUTIONS:
+        raise ValueError('unknown distribution {!r}, use one of {}'.format(
+            kind, ', '.join(sorted(DISTRIBUTIONS))))
+    try:
+        return DISTRIBUTIONS[kind](*[float(param) for param in params.split(',') if param])
+    except TypeError:
+        raise ValueError('wrong number of parameters for {!r}'.format(text))
+
+
+def apex_servers(zone):
+    """
+    NS targets of zone apex from zoneindex.ZoneIndex.
+    """
+    return zone.ns[dns.name.root]
+
+
+class Model(object):
+    def __init__(self, servers, hit=1.0, rtt='lognormal:25,0.5', server_rtt=None, seed=0):
+        """
+        hit: cost of cache lookup in ms
+        rtt: default RTT distribution spec
+        server_rtt: dict server name -> distribution spec
+        """
+        assert servers
+        self.rng = random.Random(seed)
+        self.hit_cost = hit
+        default = parse_distribution(rtt)
+        server_rtt = server_rtt or {}
+        self.rtt = {server: parse_distribution(server_rtt[server]) if server in server_rtt else default
+                    for server in servers}
+        # BIND starts with small random SRTT so that all servers get tried
+        self.srtt = {server: self.rng.uniform(1, 32) for server in servers}
+        self.selected = dict.fromkeys(servers, 0)
+
+    def hit(self):
+        return self.hit_cost
+
+    def miss(self):
+        srtt = self.srtt
+        server = min(srtt, key=srtt.get)
+        rtt = self.rtt[server](self.rng)
+        for other in srtt:
+            if other is not server:
+                srtt[other] *= SRTT_DECAY
+        srtt[server] = (1 - SRTT_WEIGHT) * srtt[server] + SRTT_WEIGHT * rtt
+        self.selected[server] += 1
+        return self.hit_cost + rtt
+
+
+class Sketch(object):
+    """
+    Values are counted in buckets (gamma^(i-1), gamma^i], so quantiles have
+    relative error at most alpha. If there are more than max_buckets,
+    the lowest ones are collapsed, which affects only the lowest quantiles.
+    """
+    MIN_VALUE = 1e-9
+
+    def __init__(self, alpha=0.01, max_buckets=2048):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.zero = 0  # values <= MIN_VALUE
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= self.MIN_VALUE:
+            self.zero += 1
+            return
+        idx = math.ceil(math.log(value) / self.log_gamma)
+        buckets = self.buckets
+        buckets[idx] = buckets.get(idx, 0) + 1
+        if len(buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        lowest = sorted(self.buckets)[:len(self.buckets) - self.max_buckets + 1]
+        target = lowest[-1]
+        for idx in lowest[:-1]:
+            self.buckets[target] += self.buckets.pop(idx)
+
+    def merge(self, other):
+        assert other.gamma == self.gamma, 'sketches must have the same accuracy'
+        for idx, count in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def clear(self):
+        self.buckets.clear()
+        self.zero = 0
+        self.count = 0
+
+    def quantile(self, q):
+        """
+        Returns value at quantile q (0 <= q <= 1) or None if sketch is empty.
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if seen > rank:
+            return 0.0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen > rank:
+                return 2 * self.gamma ** idx / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
@@ -0,0 +1,162 @@
+"""
+Windowed simulation metrics.
+
+Time is split into windows [start, end) of fixed length. For each window
+and policy replay reports number of queries by outcome of Resolver.lookup()
+(miss, or hit answered by positive, NXDOMAIN, NODATA or NXDOMAIN synthesized
+from covering NSEC/NSEC3), authoritative queries in the window and cache entries at its end.
+Windows without queries are reported as well, so boundaries are exact.
+
+Counts can be broken down by TLD, rows for TLDs without queries are skipped.
+Per-query cost is constant: counters are preallocated flat lists indexed
+by TLD index * len(OUTCOMES) + outcome.
+
+If resolvers have latency model, policy rows also contain latency quantiles
+in ms from latency.Sketch of the window.
+
+Rows are written as CSV or JSON lines and flushed after each window.
+"""
+
+import json
+
+import dns.name
+
+import latency
+from rfc2308 import OUTCOMES
+
+FIELDS = ['start', 'end', 'policy', 'tld', 'queries', 'hit'] + list(OUTCOMES) + ['auth', 'entries']
+QUANTILES = [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999)]
+ROOT = 0
+OTHER = 1  # names under nonexistent TLDs
+
+
+class TldIndex(object):
+    """
+    Maps query names to index of their TLD in the zone.
+    """
+    def __init__(self, zone):
+        labels = sorted({name.labels[0].lower() for name in zone.nodes if len(name.labels) == 2})
+        self.names = ['.', 'other'] + [dns.name.Name((label, b'')).to_text() for label in labels]
+        self.ids = {label: idx for idx, label in enumerate(labels, 2)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def index(self, name):
+        labels = name.labels
+        if len(labels) < 2:
+            return ROOT
+        return self.ids.get(labels[-2].lower(), OTHER)
+
+
+class CsvSink(object):
+    def __init__(self, out):
+        self.out = out
+        self.header = False
+
+    def write(self, record):
+        if not self.header:
+            self.out.write(','.join(record) + '\n')
+            self.header = True
+        self.out.write(','.join('' if value is None else str(value) for value in record.values()) + '\n')
+
+    def flush(self):
+        self.out.flush()
+
+
+class JsonSink(object):
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, record):
+        self.out.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        self.out.flush()
+
+
+SINKS = {'csv': CsvSink, 'json': JsonSink}
+
+
+class Metrics(object):
+    """
+    Replays queries through resolvers and writes one row per window and policy
+    (tld column empty) plus optional per-TLD rows.
+    """
+    def __init__(self, resolvers, sink, window=3600, tlds=None):
+        assert window > 0
+        self.names = list(resolvers)
+        self.resolvers = list(resolvers.values())
+        self.sink = sink
+        self.window = window
+        self.tlds = tlds
+        self.width = len(OUTCOMES) * (len(tlds) if tlds else 1)
+        self.counts = [[0] * self.width for _ in self.resolvers]
+        self.zeros = [0] * self.width
+        self.auth = [res.auth.queries for res in self.resolvers]
+        self.sketches = None
+        if any(res.latency for res in self.resolvers):
+            self.sketches = [latency.Sketch() for _ in self.resolvers]
+        self.start = 0
+        self.end = window
+
+    def lookup(self, now, qname, rrtype):
+        while now >= self.end:
+            self.flush()
+        offset = self.tlds.index(qname) * len(OUTCOMES) if self.tlds else 0
+        for res, counts in zip(self.resolvers, self.counts):
+            res.set_reltime(now)
+            counts[offset + res.lookup(qname, rrtype)] += 1
+        if self.sketches:
+            for res, sketch in zip(self.resolvers, self.sketches):
+                sketch.add(res.elapsed)
+
+    def _record(self, policy, tld, counts, auth=None, entries=None, sketch=None):
+        record = {'start': self.start, 'end': self.end, 'policy': policy, 'tld': tld,
+                  'queries': sum(counts), 'hit': sum(counts) - counts[0]}
+        record.update(zip(OUTCOMES, counts))
+        record['auth'] = auth
+        record['entries'] = entries
+        if self.sketches:
+            for field, q in QUANTILES:
+                value = sketch.quantile(q) if sketch else None
+                record[field] = None if value is None else round(value, 3)
+        self.sink.write(record)
+
+    def flush(self):
+        """
+        Write rows of current window and move to the next one.
+        """
+        nout = len(OUTCOMES)
+        for idx, (name, res, counts) in enumerate(zip(self.names, self.resolvers, self.counts)):
+            res.set_reltime(self.end)  # entries at the end of window
+            auth = res.auth.queries
+            totals = [sum(counts[outcome::nout]) for outcome in range(nout)]
+            sketch = self.sketches[idx] if self.sketches else None
+            self._record(name, None, totals, auth - self.auth[idx], res.cache.entries, sketch)
+            if sketch:
+                sketch.clear()
+            self.auth[idx] = auth
+            if self.tlds:
+                for tld, tld_name in enumerate(self.tlds.names):
+                    block = counts[tld * nout:(tld + 1) * nout]
+                    if any(block):
+                        self._record(name, tld_name, block)
+            counts[:] = self.zeros
+        self.sink.flush()
+        self.start = self.end
+        self.end += self.window
+
+
+def replay(queries, resolvers, sink, window=3600, by_tld=False):
+    """
+    Feed queries to all resolvers and write metrics of each window,
+    including the last incomplete one.
+    """
+    tlds = None
+    if by_tld:
+        tlds = TldIndex(next(iter(resolvers.values())).auth.zone)
+    metrics = Metrics(resolvers, sink, window, tlds)
+    for now, qname, rrtype in queries:
+        metrics.lookup(now, qname, rrtype)
+    metrics.flush()
@@ -0,0 +1,155 @@
+"""
+Miss ratio curves of LRU-bounded caches from one replay.
+
+StackDistance plugs into BoundedCache as an eviction policy with unlimited
+capacity, so it sees every use of a cache entry in the order LRU would:
+stores on misses and the entry which answered each hit, including NSEC
+records synthesizing answers in rfc8198. For each hit it computes the LRU
+stack distance of the answering entry: total weight (entries or bytes)
+of distinct entries used since its previous use, itself included.
+LRU cache of capacity C holds exactly the entries with distance <= C.
+
+The curve assumes that a query is a hit in bounded cache iff it is a hit in
+unbounded cache and its distance fits. This ignores that a bounded cache
+refreshes evicted entries at different times, so TTL windows may shift.
+
+Distances are counted in a Fenwick tree indexed by time of last use,
+O(log n) per use.
+"""
+
+import collections
+import sys
+
+import qlog2cache
+
+
+class _Fenwick(object):
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def add(self, pos, delta):
+        tree = self.tree
+        size = self.size
+        pos += 1
+        while pos <= size:
+            tree[pos] += delta
+            pos += pos & -pos
+
+    def prefix(self, pos):
+        """
+        Sum of items at positions < pos.
+        """
+        tree = self.tree
+        total = 0
+        while pos:
+            total += tree[pos]
+            pos &= pos - 1
+        return total
+
+
+class StackDistance(object):
+    """
+    Eviction policy interface which never evicts and records
+    stack distance of each access in self.last.
+    """
+    def __init__(self, capacity, size=1 << 16):
+        self.capacity = capacity
+        self.pos = {}  # key -> position of last use
+        self.weights = [0] * size  # position -> weight of key used there
+        self.total = 0  # weight of all keys
+        self.clock = 0  # next free position
+        self.tree = _Fenwick(size)
+        self.last = None
+
+    def _touch(self, key, weight):
+        clock = self.clock
+        self.pos[key] = clock
+        self.weights[clock] = weight
+        self.tree.add(clock, weight)
+        self.clock = clock + 1
+
+    def _compact(self):
+        """
+        Renumber positions of live keys from 0, preserving their order.
+        """
+        order = sorted(self.pos.items(), key=lambda item: item[1])
+        size = max(2 * len(order), 1 << 16)
+        weights = [0] * size
+        self.tree = _Fenwick(size)
+        for idx, (key, pos) in enumerate(order):
+            self.pos[key] = idx
+            weights[idx] = self.weights[pos]
+            self.tree.add(idx, weights[idx])
+        self.weights = weights
+        self.clock = len(order)
+
+    def insert(self, key, weight):
+        if self.clock == self.tree.size:
+            self._compact()
+        self.total += weight
+        self.last = None
+        self._touch(key, weight)
+
+    def access(self, key):
+        if self.clock == self.tree.size:
+            self._compact()
+        pos = self.pos[key]
+        weight = self.weights[pos]
+        self.last = self.total - self.tree.prefix(pos + 1) + weight
+        self.tree.add(pos, -weight)
+        self._touch(key, weight)
+
+    def remove(self, key):
+        pos = self.pos.pop(key)
+        self.tree.add(pos, -self.weights[pos])
+        self.total -= self.weights[pos]
+
+    def evict(self):
+        raise AssertionError('stack distance analysis never evicts')
+
+
+def load_policies(names, zonefile, by_bytes=False):
+    """
+    Resolvers with caches measuring stack distances.
+    """
+    limit = 'max_bytes' if by_bytes else 'max_entries'
+    return qlog2cache.load_policies(names, zonefile, {limit: sys.maxsize, 'policy': StackDistance})
+
+
+def distances(queries, resolvers):
+    """
+    Replay queries and return (number of queries, [Counter of hit distances per resolver]).
+    """
+    resolvers = list(resolvers.values())
+    histograms = [collections.Counter() for _ in resolvers]
+    count = 0
+    for now, qname, rrtype in queries:
+        count += 1
+        for res, histogram in zip(resolvers, histograms):
+            res.set_reltime(now)
+            hits = res.cache.hit
+            res.lookup(qname, rrtype)
+            if res.cache.hit > hits:
+                histogram[res.cache.policy.last] += 1
+    return count, histograms
+
+
+def write_curve(out, names, count, histograms):
+    """
+    CSV with hit ratio and auth queries for each capacity where any curve changes.
+    """
+    columns = ['capacity']
+    for name in names:
+        columns.extend(['{}.hit_ratio'.format(name), '{}.auth'.format(name)])
+    out.write(','.join(columns) + '\n')
+    if not count:
+        return
+    capacities = sorted(set().union(*histograms))
+    hits = [0] * len(histograms)
+    for capacity in capacities:
+        row = [capacity]
+        for idx, histogram in enumerate(histograms):
+            hits[idx] += histogram.get(capacity, 0)
+            row.extend(['{:.6f}'.format(hits[idx] / count), count - hits[idx]])
+        out.write(','.join(str(value) for value in row) + '\n')
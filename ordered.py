@@ -0,0 +1,123 @@
+"""
+Ordered container with logarithmic insert, delete, predecessor and successor.
+
+Items are kept in a list of sorted blocks of bounded length plus a list of
+maximum of each block. Lookups bisect the list of maximums and then
+one block, updates touch one block only.
+"""
+
+import bisect
+
+
+class SortedList(object):
+    def __init__(self, iterable=(), load=512):
+        self._load = load
+        self._blocks = []
+        self._maxes = []
+        self._len = 0
+        for item in sorted(iterable):
+            self.add(item)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def __repr__(self):
+        return 'SortedList({!r})'.format(list(self))
+
+    def __contains__(self, item):
+        idx = bisect.bisect_left(self._maxes, item)
+        if idx == len(self._maxes):
+            return False
+        block = self._blocks[idx]
+        pos = bisect.bisect_left(block, item)
+        return block[pos] == item
+
+    def add(self, item):
+        maxes = self._maxes
+        if not maxes:
+            self._blocks.append([item])
+            maxes.append(item)
+            self._len = 1
+            return
+        idx = bisect.bisect_right(maxes, item)
+        if idx == len(maxes):  # new maximum
+            idx -= 1
+            self._blocks[idx].append(item)
+            maxes[idx] = item
+        else:
+            bisect.insort_right(self._blocks[idx], item)
+        self._len += 1
+
+        block = self._blocks[idx]
+        if len(block) > 2 * self._load:  # split
+            half = block[self._load:]
+            del block[self._load:]
+            maxes[idx] = block[-1]
+            self._blocks.insert(idx + 1, half)
+            maxes.insert(idx + 1, half[-1])
+
+    def remove(self, item):
+        """
+        Raises: ValueError if item is not present.
+        """
+        maxes = self._maxes
+        idx = bisect.bisect_left(maxes, item)
+        if idx == len(maxes):
+            raise ValueError('{!r} not in list'.format(item))
+        block = self._blocks[idx]
+        pos = bisect.bisect_left(block, item)
+        if block[pos] != item:
+            raise ValueError('{!r} not in list'.format(item))
+        del block[pos]
+        self._len -= 1
+
+        if not block:
+            del self._blocks[idx]
+            del maxes[idx]
+            return
+        maxes[idx] = block[-1]
+        if len(block) < self._load // 2 and idx + 1 < len(maxes):  # merge with next
+            block.extend(self._blocks.pop(idx + 1))
+            del maxes[idx]
+            maxes[idx] = block[-1]
+
+    def floor(self, item):
+        """
+        Returns the largest item <= given item.
+
+        Raises: IndexError if there is no such item.
+        """
+        maxes = self._maxes
+        idx = bisect.bisect_left(maxes, item)
+        if idx < len(maxes):
+            block = self._blocks[idx]
+            pos = bisect.bisect_right(block, item)
+            if pos:
+                return block[pos - 1]
+        if idx == 0:
+            raise IndexError('no item <= {!r}'.format(item))
+        return self._blocks[idx - 1][-1]
+
+    def last(self):
+        """
+        Returns the largest item.
+
+        Raises: IndexError if list is empty.
+        """
+        return self._maxes[-1]
+
+    def higher(self, item):
+        """
+        Returns the smallest item > given item.
+
+        Raises: IndexError if there is no such item.
+        """
+        idx = bisect.bisect_right(self._maxes, item)
+        if idx == len(self._maxes):
+            raise IndexError('no item > {!r}'.format(item))
+        block = self._blocks[idx]
+        return block[bisect.bisect_right(block, item)]
@@ -0,0 +1,157 @@
+"""
+Replay query log in several processes.
+
+Namespace is split using Resolver.partition(): queries for names in one
+partition touch only cache entries belonging to the same partition,
+so each worker process can simulate its share of partitions independently.
+
+Parent process parses the log, assigns every query to a worker and sends
+a tick to all workers whenever serial replay would write a row. Workers
+snapshot their counters at each tick and parent sums them up, so the output
+is identical to serial replay.
+"""
+
+import multiprocessing
+import queue
+
+import qlog2cache
+
+POLL = 1  # seconds between checks that workers are still alive
+
+
+def _worker(names, zonefile, reclaim, options, auth_options, inq, outq):
+    resolvers = list(qlog2cache.load_policies(names, zonefile, reclaim=reclaim,
+                                              options=options, auth_options=auth_options).values())
+    fields = qlog2cache.report_fields(resolvers)
+    snapshots = []  # cumulative counters at each output row
+
+    for batch in iter(inq.get, None):
+        for now, qname, rrtype, mask in batch:
+            if qname is None:  # output row, move time in all resolvers
+                for res in resolvers:
+                    res.set_reltime(now)
+                snapshots.append([qlog2cache.counters(res, fields) for res in resolvers])
+                continue
+            for idx, res in enumerate(resolvers):
+                if mask & (1 << idx):
+                    res.set_reltime(now)
+                    res.lookup(qname, rrtype)
+    outq.put(snapshots)
+
+
+def _check(workers):
+    """
+    Raise RuntimeError if a worker died, so parent does not wait forever.
+    """
+    for worker in workers:
+        if worker.exitcode not in (None, 0):
+            raise RuntimeError('worker process {} exited with code {}'.format(
+                worker.pid, worker.exitcode))
+
+
+def _put(inq, item, workers):
+    while True:
+        try:
+            inq.put(item, timeout=POLL)
+            return
+        except queue.Full:
+            _check(workers)
+
+
+def _collect(outq, workers):
+    """
+    Get snapshots of all workers.
+    """
+    results = []
+    finished = False
+    while len(results) < len(workers):
+        try:
+            results.append(outq.get(timeout=POLL))
+        except queue.Empty:
+            _check(workers)
+            if finished:  # all exited and nothing arrived since
+                raise RuntimeError('worker processes exited without results')
+            finished = not any(worker.is_alive() for worker in workers)
+    return results
+
+
+def _feed(queries, resolvers, inqs, workers, batch_size):
+    """
+    Send queries to workers in batches, return reltime of each output row.
+    """
+    jobs = len(inqs)
+    batches = [[] for _ in range(jobs)]
+    events = []  # reltime of each output row
+    prevtime = 0
+    for now, qname, rrtype in queries:
+        masks = [0] * jobs
+        for idx, res in enumerate(resolvers):
+            masks[res.partition(qname) % jobs] |= 1 << idx
+        for widx, mask in enumerate(masks):
+            if mask:
+                batch = batches[widx]
+                batch.append((now, qname, rrtype, mask))
+                if len(batch) >= batch_size:
+                    _put(inqs[widx], batch, workers)
+                    batches[widx] = []
+
+        if now - prevtime >= 3600:
+            prevtime = int(now / 3600) * 3600
+            events.append(now)
+            for batch in batches:
+                batch.append((now, None, None, 0))
+
+    for inq, batch in zip(inqs, batches):
+        if batch:
+            _put(inq, batch, workers)
+        _put(inq, None, workers)
+    return events
+
+
+def _merge(events, results):
+    """
+    Sum counters from all workers for each output row.
+    """
+    rows = []
+    for now, snapshots in zip(events, zip(*results)):
+        rows.append((now, [tuple(sum(values) for values in zip(*policy))
+                           for policy in zip(*snapshots)]))
+    return rows
+
+
+def replay(queries, names, zonefile, jobs, out, batch_size=10000, reclaim=False, options=None,
+           auth_options=None):
+    """
+    Parallel equivalent of qlog2cache.replay().
+
+    names is list of policy modules, jobs is number of worker processes.
+    Raises RuntimeError if a worker process dies.
+    """
+    # parent needs resolvers only to compute partitions
+    resolvers = list(qlog2cache.load_policies(names, zonefile, reclaim=reclaim,
+                                              options=options, auth_options=auth_options).values())
+    outq = multiprocessing.Queue()
+    inqs = [multiprocessing.Queue(maxsize=16) for _ in range(jobs)]
+    workers = [multiprocessing.Process(target=_worker,
+                                       args=(names, zonefile, reclaim, options, auth_options, inq, outq))
+               for inq in inqs]
+    for worker in workers:
+        worker.start()
+
+    try:
+        events = _feed(queries, resolvers, inqs, workers, batch_size)
+        results = _collect(outq, workers)
+    except BaseException:
+        # do not wait on exit to flush batches nobody reads
+        for inq in inqs:
+            inq.cancel_join_thread()
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        raise
+    for worker in workers:
+        worker.join()
+
+    report = qlog2cache.Report(out, names, qlog2cache.report_fields(resolvers))
+    for now, counters in _merge(events, results):
+        report.write(now, counters)
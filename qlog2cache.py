@@ -1,15 +1,29 @@
 #!/usr/bin/python3
 
+import argparse
+import calendar
+import collections
 from datetime import datetime
-import io
+import functools
+import importlib
+import itertools
 import re
 import sys
 
+import dns.name
 import dns.rdatatype
 
+import checkpoint
+import eviction
+import fleet
+import hierarchy
+import rfc2308
 import rfc8198 as rfc
+import zoneindex
 
-logregex = r'^([0-9T:.-]+)\+[0-9]{2}:[0-9]{2} \'([^.]*\.)\' type \'([^\']+)\''
+# optional client address follows the type: ... type 'A' client 192.0.2.1
+logregex = r'^([0-9T:.-]+)\+[0-9]{2}:[0-9]{2} \'([^.]*\.)\' type \'([^\']+)\'(?: client ([^ ]+))?'
+logregex_bin = re.compile(logregex.encode('ascii'))
 
 def read_queries(infile):
 # 2017-09-08T15:42:22.186207+02:00 'prod-t.singular.net.' type 'A'
@@ -38,16 +52,528 @@ def read_queries(infile):
         print('failed line no. {}'.format(lineno))
         raise
 
-auth = rfc.Authoritative('root.zone')
-res = rfc.Resolver(auth)
 
-intext = io.TextIOWrapper(sys.stdin.buffer, encoding='ascii')
-prevtime = 0
-print('time,hit,miss')
-for now, qname, rrtype in read_queries(intext):
-    res.set_reltime(now)
-    res.lookup(qname, rrtype)
+def _parse_seconds(prefix):
+    """
+    Convert b'YYYY-mm-ddTHH:MM:SS' to seconds since epoch (TZ is ignored).
+    """
+    dt = datetime.strptime(prefix.decode('ascii'), '%Y-%m-%dT%H:%M:%S')
+    return calendar.timegm(dt.timetuple())
 
-    if now - prevtime >= 3600:
-        prevtime = int(now / 3600) * 3600
-        print('{},{},{}'.format(now, res.cache.hit, res.cache.miss))
+
+def read_queries_fast(infile, chunk_size=1 << 20, intern_size=1 << 16, clients=False):
+    """
+    Streaming variant of read_queries() for large logs.
+
+    infile must be a binary file object. It is read in chunk_size blocks,
+    timestamps are converted to datetime only when the seconds prefix changes,
+    and qnames + RR types are interned through bounded LRU caches so a popular
+    name becomes a single dns.name.Name object.
+
+    Yields the same (reltime, name, rrtype) tuples as read_queries(),
+    with clients=True (reltime, name, rrtype, client) where client is
+    address from the log as bytes or None.
+    """
+    to_name = functools.lru_cache(maxsize=intern_size)(dns.name.from_text)
+    to_rrtype = functools.lru_cache(maxsize=256)(dns.rdatatype.from_text)
+    match = logregex_bin.match
+
+    lineno = 0
+    start_us = None
+    last_prefix = None
+    last_sec = None
+    rest = b''
+    try:
+        while True:
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                lines = [rest] if rest else []
+            else:
+                lines = (rest + chunk).split(b'\n')
+                rest = lines.pop()
+            for line in lines:
+                lineno += 1
+                m = match(line)
+                if not m:
+                    continue
+
+                prefix, _, frac = m.group(1).partition(b'.')
+                if prefix != last_prefix:
+                    last_sec = _parse_seconds(prefix)
+                    last_prefix = prefix
+                # same semantics as %f: 1-6 digits, padded on the right
+                assert 0 < len(frac) <= 6, 'unsupported fraction: line "%s"' % line
+                now_us = last_sec * 1000000 + int(frac.ljust(6, b'0'))
+                if start_us is None:
+                    start_us = now_us
+                delta_us = now_us - start_us
+                # truncate towards zero like int(timedelta.total_seconds())
+                reltime = delta_us // 1000000 if delta_us >= 0 else -(-delta_us // 1000000)
+                assert reltime >= 0, 'cannot go back %s seconds in time: line "%s"' % (reltime, line)
+
+                if clients:
+                    yield (reltime, to_name(m.group(2)), to_rrtype(m.group(3).decode('ascii')),
+                           m.group(4))
+                else:
+                    yield (reltime, to_name(m.group(2)), to_rrtype(m.group(3).decode('ascii')))
+            if not chunk:
+                break
+    except:
+        print('failed line no. {}'.format(lineno))
+        raise
+
+
+def load_policies(names, zonefile, bounds=None, reclaim=False, latency=None, options=None,
+                  auth_options=None):
+    """
+    Create one resolver per policy module (e.g. 'rfc2308').
+
+    Each module must provide Resolver and Authoritative classes.
+    The zone file is parsed only once and shared by all Authoritatives.
+    If bounds dict is given, resolvers use module.BoundedCache(**bounds).
+    latency is optional function of zone returning latency.Model for each resolver.
+    options are keyword arguments of Resolver (prefetch, prefetch_hits, stale, stale_timer).
+    auth_options are keyword arguments of Authoritative (zonedir, iterations, salt).
+    """
+    zone = rfc2308.load_zone(zonefile)
+    resolvers = collections.OrderedDict()
+    for name in names:
+        module = importlib.import_module(name)
+        if bounds:
+            cache = module.BoundedCache(reclaim=reclaim, **bounds)
+        else:
+            cache = module.Cache(reclaim=reclaim)
+        model = latency(zone) if latency else None
+        resolvers[name] = module.Resolver(module.Authoritative(zone, **(auth_options or {})), cache,
+                                          model, **(options or {}))
+    return resolvers
+
+
+def report_fields(resolvers):
+    """
+    Names of counters reported for given resolvers.
+    """
+    fields = ['hit', 'miss', 'auth']
+    caches = [res.cache for res in resolvers]
+    if any(hasattr(cache, 'evictions') for cache in caches):
+        fields.append('evicted')
+    if any(cache.reclaim for cache in caches):
+        fields.append('live')
+    if any(res.prefetch for res in resolvers):
+        fields.append('prefetch')
+    if any(cache.stale for cache in caches):
+        fields.append('stale')
+    if any(hasattr(res.auth, 'by_level') for res in resolvers):
+        fields.extend('auth.' + name for name in hierarchy.LEVEL_NAMES)
+    if any(getattr(cache, 'hasher', None) is not None for cache in caches):
+        fields.extend(['nsec3.hashes', 'nsec3.memo', 'nsec3.us'])
+    if any(res.auth.zone.diffs for res in resolvers):
+        fields.extend(['zone.version', 'inconsistent'])
+    return fields
+
+
+def _level_queries(auth, level):
+    """
+    Queries sent to zones at given level, flat models ask only the root.
+    """
+    by_level = getattr(auth, 'by_level', None)
+    if by_level is None:
+        return auth.queries if level == 0 else 0
+    return by_level[level]
+
+
+def _hashing(cache, field):
+    """
+    NSEC3 hashes computed by cache, memo hits and microseconds spent hashing.
+    """
+    hasher = getattr(cache, 'hasher', None)
+    if hasher is None:
+        return 0
+    if field == 'hashes':
+        return hasher.computed
+    if field == 'memo':
+        return hasher.lookups - hasher.computed
+    return int(hasher.seconds * 1e6)
+
+
+def counters(res, fields):
+    """
+    Cumulative counters (gauge for live entries) of one resolver.
+    """
+    values = {
+        'hit': lambda: res.cache.hit,
+        'miss': lambda: res.cache.miss,
+        'auth': lambda: res.auth.queries,
+        'evicted': lambda: res.cache.evictions,
+        'live': lambda: res.cache.entries,
+        'prefetch': lambda: res.prefetched,
+        'stale': lambda: res.stale_answers,
+        'zone.version': lambda: res.auth.version,
+        'inconsistent': lambda: res.inconsistent,
+    }
+    for level, name in enumerate(hierarchy.LEVEL_NAMES):
+        values['auth.' + name] = functools.partial(_level_queries, res.auth, level)
+    for name in ('hashes', 'memo', 'us'):
+        values['nsec3.' + name] = functools.partial(_hashing, res.cache, name)
+    return tuple(values[field]() for field in fields)
+
+
+class Report(object):
+    """
+    Combined CSV with columns <policy>.<field> for each policy.
+    Evictions are reported for the last interval, other counters are cumulative.
+    """
+    def __init__(self, out, names, fields):
+        self.out = out
+        self.fields = fields
+        self.prev = [None] * len(names)
+        columns = ['time']
+        for name in names:
+            columns.extend('{}.{}'.format(name, field) for field in fields)
+        out.write(','.join(columns) + '\n')
+
+    def write(self, now, counters):
+        """
+        counters is sequence of tuples from counters(), one per policy
+        """
+        row = [now]
+        for idx, values in enumerate(counters):
+            prev = self.prev[idx] or (0,) * len(values)
+            for field, value, prev_value in zip(self.fields, values, prev):
+                row.append(value - prev_value if field == 'evicted' else value)
+            self.prev[idx] = values
+        self.out.write(','.join(str(value) for value in row) + '\n')
+
+
+def replay(queries, resolvers, out, start=None, save=None):
+    """
+    Feed each query to all resolvers and write combined CSV roughly hourly.
+
+    start: checkpoint.State to continue from, resolvers must be its resolvers
+    and queries must not contain queries it consumed
+    save: optional function called with checkpoint.State after each row
+    """
+    prevtime = 0
+    consumed = 0
+    shift = 0
+    fields = report_fields(resolvers.values())
+    report = Report(out, resolvers, fields)
+    if start is not None:
+        prevtime, consumed, shift, report.prev = start.prevtime, start.consumed, start.shift, start.prev
+    for now, qname, rrtype in queries:
+        consumed += 1
+        for res in resolvers.values():
+            res.set_reltime(now)
+            res.lookup(qname, rrtype)
+
+        if now - prevtime >= 3600:
+            prevtime = int(now / 3600) * 3600
+            report.write(now, [counters(res, fields) for res in resolvers.values()])
+            if save is not None:
+                save(checkpoint.State(resolvers, consumed, now, prevtime, report.prev, shift))
+
+
+def _saver(args):
+    """
+    Function saving checkpoint.State to --checkpoint file at most once per --checkpoint-every.
+    """
+    if not args.checkpoint:
+        return None
+    last = [None]
+
+    def save(state):
+        if last[0] is None or state.now - last[0] >= args.checkpoint_every:
+            checkpoint.save(args.checkpoint, state)
+            last[0] = state.now
+    return save
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay query log through simulated cache.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='query log, pcap, pcapng or dnstap file, optionally compressed '
+                             'with gzip, xz or zstd, or trace directory (default: stdin)')
+    parser.add_argument('--format', choices=['qlog', 'pcap', 'pcapng', 'dnstap', 'trace'],
+                        help='input format (default: autodetect)')
+    parser.add_argument('-z', '--zone', default='root.zone', help='zone file (default: %(default)s)')
+    parser.add_argument('--zone-version', action='append', default=[], metavar='SECONDS=ZONE',
+                        help='switch to zone file or snapshot ZONE at SECONDS of log time; '
+                             'can be repeated, -z is the version at start; output then has '
+                             'zone version and hits inconsistent with current version')
+    parser.add_argument('-p', '--policy', action='append',
+                        help='resolver module to compare, e.g. rfc2308, rfc4035, rfc8198, rfc5155, '
+                             'hierarchy; can be repeated, output then has hit/miss/auth columns per policy')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='replay in JOBS processes, each simulating part of namespace '
+                             '(implies -p rfc8198 if no policy is given)')
+    limit = parser.add_mutually_exclusive_group()
+    limit.add_argument('--max-entries', type=int, help='limit cache size to number of entries')
+    limit.add_argument('--max-bytes', type=int, help='limit estimated wire size of cache content')
+    parser.add_argument('--eviction', choices=sorted(eviction.POLICIES), default='lru',
+                        help='eviction policy for bounded cache (default: %(default)s)')
+    parser.add_argument('--reclaim', action='store_true',
+                        help='drop expired entries from cache and report live entries')
+    parser.add_argument('--prefetch', type=float, default=0.0, metavar='FRACTION',
+                        help='on hit refresh entry if less than FRACTION of its TTL remains, '
+                             'e.g. 0.1; auth queries made by prefetch are reported separately')
+    parser.add_argument('--prefetch-hits', type=int, default=0, metavar='N',
+                        help='prefetch only entries with at least N hits since they were fetched')
+    parser.add_argument('--serve-stale', type=int, default=0, metavar='SECONDS',
+                        help='answer from entries expired at most SECONDS ago and refresh them '
+                             '(RFC 8767), refresh queries are reported as prefetch; with --latency '
+                             'only if modelled resolution exceeds --stale-timer, otherwise '
+                             'every such entry is served stale as if resolution were always slow')
+    parser.add_argument('--stale-timer', type=float, default=1800.0, metavar='MS',
+                        help='client response timer of --serve-stale with --latency '
+                             '(default: %(default)s)')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='use numpy batch engine, only for unbounded rfc2308 and rfc4035 '
+                             '(implies -p rfc2308 if no policy is given)')
+    parser.add_argument('--mrc', choices=['entries', 'bytes'],
+                        help='instead of time series print hit ratio and auth queries of LRU cache '
+                             'for all capacities in entries or bytes '
+                             '(implies -p rfc2308 -p rfc8198 if no policy is given)')
+    parser.add_argument('--sample', type=float, metavar='RATE',
+                        help='simulate only fraction RATE of namespace and report estimated counters, '
+                             'hit ratio and its 95%% confidence interval; capacity limit is scaled '
+                             'by RATE (implies -p rfc8198 if no policy is given)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='hash seed for --sample and random seed for --balance random '
+                             '(default: %(default)s)')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='save state of resolvers to FILE after output rows, see --resume '
+                             '(implies -p rfc8198 if no policy is given)')
+    parser.add_argument('--checkpoint-every', type=int, default=3600, metavar='SECONDS',
+                        help='save checkpoint at most once per SECONDS of log time '
+                             '(default: %(default)s, i.e. every row)')
+    resume = parser.add_mutually_exclusive_group()
+    resume.add_argument('--resume', metavar='FILE',
+                        help='continue replay from checkpoint, queries it consumed are skipped; '
+                             'policies and cache settings come from the checkpoint')
+    resume.add_argument('--warm', metavar='FILE',
+                        help='replay input from its beginning with resolvers from checkpoint, '
+                             'e.g. to fork one warmed-up cache into several what-if runs')
+    parser.add_argument('--fleet', type=int, metavar='N',
+                        help='simulate N instances of the policy behind load balancer, all asking '
+                             'one auth; output has per-instance and aggregate hit ratio and auth '
+                             'queries (implies -p rfc8198 if no policy is given)')
+    parser.add_argument('--balance', action='append', metavar='POLICY',
+                        help='load balancer policy for --fleet: {}; can be repeated to compare '
+                             'policies (default: round-robin)'.format(', '.join(fleet.POLICIES)))
+    parser.add_argument('--metrics', choices=['csv', 'json'],
+                        help='write per-window counts of queries by outcome, auth queries and cache '
+                             'entries as CSV or JSON lines (implies -p rfc8198 if no policy is given)')
+    parser.add_argument('--window', type=int, default=3600,
+                        help='window length in seconds for --metrics (default: %(default)s)')
+    parser.add_argument('--by-tld', action='store_true', help='break --metrics down by TLD')
+    parser.add_argument('--child-zones', metavar='DIR',
+                        help='zone files <origin>zone used by -p hierarchy instead of '
+                             'synthesized child zones')
+    parser.add_argument('--nsec3-iterations', type=int, default=0, metavar='N',
+                        help='additional hash iterations used by -p rfc5155 for zone signed '
+                             'with NSEC (default: %(default)s)')
+    parser.add_argument('--nsec3-salt', default='', metavar='HEX',
+                        help='NSEC3 salt used by -p rfc5155 for zone signed with NSEC')
+    parser.add_argument('--latency', action='store_true',
+                        help='add p50/p90/p99/p999 response time in ms to --metrics '
+                             '(implies --metrics csv)')
+    parser.add_argument('--hit-latency', type=float, default=1.0, metavar='MS',
+                        help='response time of answer from cache (default: %(default)s)')
+    parser.add_argument('--rtt', action='append', default=[], metavar='[SERVER=]DIST',
+                        help='RTT distribution of all or one apex NS server, e.g. lognormal:25,0.5 '
+                             '(median, sigma), exp:MEAN, uniform:LOW,HIGH or const:MS; '
+                             'can be repeated')
+    args = parser.parse_args()
+
+    if (args.checkpoint or args.resume or args.warm) and (
+            args.jobs or args.sample or args.metrics or args.latency or args.vectorized or args.mrc
+            or args.fleet is not None):
+        parser.error('--checkpoint, --resume and --warm cannot be used with --jobs, --sample, '
+                     '--metrics, --latency, --vectorized, --mrc or --fleet')
+    if args.zone_version:
+        if (args.jobs or args.sample or args.vectorized or args.mrc or args.checkpoint
+                or args.resume or args.warm):
+            parser.error('--zone-version cannot be used with --jobs, --sample, --vectorized, --mrc, '
+                         '--checkpoint, --resume or --warm')
+        later = []
+        for spec in args.zone_version:
+            activation, sep, path = spec.partition('=')
+            if not sep or not activation.isdigit():
+                parser.error('--zone-version must be SECONDS=ZONE')
+            later.append((int(activation), path))
+        try:
+            args.zone = zoneindex.versions(args.zone, sorted(later))
+        except ValueError as ex:
+            parser.error('--zone-version: {}'.format(ex))
+    try:
+        salt = bytes.fromhex(args.nsec3_salt)
+    except ValueError:
+        parser.error('--nsec3-salt must be hexadecimal')
+    if not 0 <= args.prefetch < 1:
+        parser.error('--prefetch must be in [0, 1)')
+    if args.stale_timer <= 0:
+        parser.error('--stale-timer must be positive')
+    options = {'prefetch': args.prefetch, 'prefetch_hits': args.prefetch_hits,
+               'stale': args.serve_stale, 'stale_timer': args.stale_timer}
+    auth_options = {'zonedir': args.child_zones, 'iterations': args.nsec3_iterations, 'salt': salt}
+    bounds = None
+    if args.max_entries or args.max_bytes:
+        bounds = {'max_entries': args.max_entries, 'max_bytes': args.max_bytes,
+                  'policy': args.eviction}
+        if args.jobs:
+            parser.error('capacity limit is shared by whole namespace, it cannot be used with --jobs')
+    import readers
+    import tracefile
+    policies = args.policy
+    if args.fleet is not None:
+        if args.fleet <= 0:
+            parser.error('--fleet must be positive')
+        if args.jobs or args.vectorized or args.mrc or args.sample or args.metrics:
+            parser.error('--fleet cannot be used with --jobs, --vectorized, --mrc, --sample '
+                         'or --metrics')
+        policies = policies or ['rfc8198']
+        if len(policies) > 1:
+            parser.error('--fleet simulates one policy')
+        balance = args.balance or ['round-robin']
+        unknown = set(balance) - set(fleet.POLICIES)
+        if unknown:
+            parser.error('--balance: unknown policy {}'.format(', '.join(sorted(unknown))))
+        try:
+            queries = readers.open_queries(args.input, args.format, clients='client-hash' in balance)
+        except ValueError as ex:
+            parser.error(str(ex))
+        zone = rfc2308.load_zone(args.zone)
+        fleets = [fleet.load_fleet(policies[0], zone, args.fleet, policy, bounds, args.reclaim,
+                                   options, args.seed, auth_options)
+                  for policy in balance]
+        fleet.replay(queries, fleets, sys.stdout)
+        for instances in fleets:
+            if instances.clientless:
+                print('client-hash: {} queries without client address were balanced by qname hash'
+                      .format(instances.clientless), file=sys.stderr)
+        return
+    if args.balance:
+        parser.error('--balance requires --fleet')
+    if args.vectorized:
+        import vectorized
+        if args.jobs or bounds or args.reclaim or args.prefetch or args.serve_stale:
+            parser.error('--vectorized cannot be used with --jobs, capacity limit, --reclaim, '
+                         '--prefetch or --serve-stale')
+        policies = policies or ['rfc2308']
+        if not set(policies) <= set(vectorized.POLICIES):
+            parser.error('--vectorized supports only policies {}'.format(', '.join(vectorized.POLICIES)))
+        if args.input != '-' and (args.format == 'trace' or tracefile.is_trace(args.input)):
+            columns = vectorized.load(args.input)
+        else:
+            columns = vectorized.columns(readers.open_queries(args.input, args.format))
+        vectorized.replay(policies, args.zone, *columns, out=sys.stdout)
+        return
+    if args.mrc:
+        import mrc
+        if args.jobs or bounds or args.reclaim or args.prefetch or args.serve_stale:
+            parser.error('--mrc cannot be used with --jobs, capacity limit, --reclaim, '
+                         '--prefetch or --serve-stale')
+        policies = policies or ['rfc2308', 'rfc8198']
+        count, histograms = mrc.distances(readers.open_queries(args.input, args.format),
+                                          mrc.load_policies(policies, args.zone, args.mrc == 'bytes'))
+        mrc.write_curve(sys.stdout, policies, count, histograms)
+        return
+    if args.latency and not args.metrics:
+        args.metrics = 'csv'
+    if not policies and (args.jobs or bounds or args.reclaim or args.sample or args.metrics
+                         or args.prefetch or args.serve_stale or args.checkpoint):
+        policies = ['rfc8198']
+    if (args.jobs or args.sample) and 'rfc5155' in policies:
+        # every NSEC3 proof depends on the whole chain, Resolver.partition() is constant
+        parser.error('--jobs and --sample cannot be used with -p rfc5155, '
+                     'its namespace cannot be partitioned')
+    if args.metrics:
+        import metrics
+        if args.jobs or args.sample:
+            parser.error('--metrics cannot be used with --jobs or --sample')
+        if args.window <= 0:
+            parser.error('--window must be positive')
+        model = None
+        if args.latency:
+            import latency
+            rtt = 'lognormal:25,0.5'
+            server_rtt = {}
+            for spec in args.rtt:
+                server, sep, dist = spec.rpartition('=')
+                try:
+                    latency.parse_distribution(dist)
+                except ValueError as ex:
+                    parser.error('--rtt: {}'.format(ex))
+                if sep:
+                    server_rtt[dns.name.from_text(server)] = dist
+                else:
+                    rtt = dist
+
+            def model(zone):
+                servers = latency.apex_servers(zone)
+                unknown = set(server_rtt) - set(servers)
+                if unknown:
+                    parser.error('--rtt: {} not in apex NS set'.format(
+                        ', '.join(str(server) for server in unknown)))
+                return latency.Model(servers, args.hit_latency, rtt, server_rtt)
+        metrics.replay(readers.open_queries(args.input, args.format),
+                       load_policies(policies, args.zone, bounds, args.reclaim, model, options,
+                                     auth_options),
+                       metrics.SINKS[args.metrics](sys.stdout), args.window, args.by_tld)
+        return
+    if args.sample:
+        import sampling
+        if not 0 < args.sample <= 1:
+            parser.error('--sample must be in (0, 1]')
+        if args.jobs or args.reclaim:
+            parser.error('--sample cannot be used with --jobs or --reclaim')
+        if bounds:
+            bounds = sampling.scale_bounds(bounds, args.sample)
+        samplers = sampling.wrap(load_policies(policies, args.zone, bounds, options=options,
+                                               auth_options=auth_options),
+                                 args.sample, args.seed)
+        sampling.replay(readers.open_queries(args.input, args.format), samplers, sys.stdout)
+        return
+
+    queries = readers.open_queries(args.input, args.format)
+    if args.resume or args.warm:
+        if args.policy or bounds or args.reclaim or args.prefetch or args.serve_stale:
+            parser.error('policies and cache settings of resumed replay come from the checkpoint')
+        try:
+            start = checkpoint.load(args.resume or args.warm, args.zone)
+        except (OSError, ValueError) as ex:
+            parser.error(str(ex))
+        if args.warm:
+            checkpoint.warm(start)
+        queries = itertools.islice(queries, start.consumed, None)
+        if start.shift:
+            queries = ((now + start.shift, qname, rrtype) for now, qname, rrtype in queries)
+        replay(queries, start.resolvers, sys.stdout, start, _saver(args))
+        return
+    if args.jobs:
+        import parallel
+        parallel.replay(queries, policies, args.zone, args.jobs, sys.stdout, reclaim=args.reclaim,
+                        options=options, auth_options=auth_options)
+        return
+    if policies:
+        replay(queries, load_policies(policies, args.zone, bounds, args.reclaim, options=options,
+                                      auth_options=auth_options),
+               sys.stdout, save=_saver(args))
+        return
+
+    auth = rfc.Authoritative(args.zone)
+    res = rfc.Resolver(auth)
+
+    prevtime = 0
+    print('time,hit,miss')
+    for now, qname, rrtype in queries:
+        res.set_reltime(now)
+        res.lookup(qname, rrtype)
+
+        if now - prevtime >= 3600:
+            prevtime = int(now / 3600) * 3600
+            print('{},{},{}'.format(now, res.cache.hit, res.cache.miss))
+
+
+if __name__ == '__main__':
+    main()
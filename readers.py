@@ -0,0 +1,451 @@
+"""
+Query stream readers.
+
+open_queries(path) detects compression and input format and returns
+iterator of (reltime, name, rrtype) tuples, same as qlog2cache.read_queries().
+Supported inputs:
+- qlog2cache text logs
+- pcap and pcapng captures of DNS queries to port 53 over UDP or TCP,
+  IPv4 or IPv6, Ethernet, Linux cooked or raw IP link layer
+- dnstap Frame Streams files
+- trace directories written by tracefile module (not compressed)
+Any of the files can be compressed with gzip, xz or zstd (needs zstandard module).
+
+Everything is streamed, memory use does not depend on input size.
+TCP segments are not reassembled, DNS messages split across segments are skipped.
+
+With clients=True every reader except trace adds client address as bytes
+in text form (e.g. b'192.0.2.1') or None: source address of the packet
+or dnstap query_address, address from client field of query logs.
+"""
+
+import functools
+import gzip
+import io
+import lzma
+import socket
+import struct
+import sys
+
+import dns.name
+
+import qlog2cache
+import tracefile
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1000000),  # little endian, microseconds
+    b'\xa1\xb2\xc3\xd4': ('>', 1000000),
+    b'\x4d\x3c\xb2\xa1': ('<', 1000000000),  # nanoseconds
+    b'\xa1\xb2\x3c\x4d': ('>', 1000000000),
+}
+FSTRM_MAGIC = b'\x00\x00\x00\x00'  # Frame Streams files start with control frame
+
+DNS_PORT = 53
+
+# link layer types
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+# dnstap Message.type values
+DNSTAP_CLIENT_QUERY = 5
+
+
+def open_stream(path):
+    """
+    Open file ('-' is stdin) for binary reading, decompress if needed.
+    Returned stream supports peek().
+    """
+    if path == '-':
+        raw = sys.stdin.buffer
+    else:
+        raw = open(path, 'rb')
+    if not hasattr(raw, 'peek'):
+        raw = io.BufferedReader(raw)
+    magic = raw.peek(6)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=raw)
+    if magic.startswith(XZ_MAGIC):
+        return lzma.LZMAFile(raw)
+    if magic.startswith(ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError('reading zstd input requires zstandard module')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw))
+    return raw
+
+
+def detect_format(stream):
+    magic = stream.peek(4)[:4]
+    if magic in PCAP_MAGICS:
+        return 'pcap'
+    if magic == PCAPNG_MAGIC:
+        return 'pcapng'
+    if magic == FSTRM_MAGIC:
+        return 'dnstap'
+    return 'qlog'
+
+
+def open_queries(path, fmt=None, clients=False):
+    """
+    Returns iterator of (reltime, name, rrtype) from given file.
+
+    fmt is one of FORMATS keys or 'trace', autodetected if None.
+    clients=True yields (reltime, name, rrtype, client), trace directories
+    have no client addresses and raise ValueError.
+    """
+    if fmt == 'trace' or (fmt is None and path != '-' and tracefile.is_trace(path)):
+        fmt = 'trace'
+    else:
+        stream = open_stream(path)
+        if fmt is None:
+            fmt = detect_format(stream)
+    if fmt == 'trace':
+        if clients:
+            raise ValueError('trace directories do not have client addresses')
+        return tracefile.read_trace(path)
+    if clients:
+        return FORMATS[fmt](stream, clients=True)
+    return FORMATS[fmt](stream)
+
+
+def _relative(events):
+    """
+    Convert (microseconds, name, rrtype[, client]) to (reltime, name, rrtype[, client])
+    with the same semantics as read_queries().
+    """
+    start = None
+    for event in events:
+        now_us = event[0]
+        if start is None:
+            start = now_us
+        delta_us = now_us - start
+        reltime = delta_us // 1000000 if delta_us >= 0 else -(-delta_us // 1000000)
+        assert reltime >= 0, 'cannot go back %s seconds in time' % reltime
+        yield (reltime,) + event[1:]
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _address(packed):
+    """
+    Text form of IPv4 or IPv6 address as bytes, None if packed has other length.
+    """
+    if len(packed) == 4:
+        return socket.inet_ntop(socket.AF_INET, packed).encode('ascii')
+    if len(packed) == 16:
+        return socket.inet_ntop(socket.AF_INET6, packed).encode('ascii')
+    return None
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _name_from_wire(wire):
+    labels = []
+    pos = 0
+    while True:
+        length = wire[pos]
+        labels.append(wire[pos + 1:pos + 1 + length])
+        pos += 1 + length
+        if not length:
+            return dns.name.Name(labels)
+
+
+def parse_query(msg):
+    """
+    Returns (name, rrtype) from the first question of DNS query in wire format,
+    or None if msg is not a query or cannot be parsed.
+    """
+    if len(msg) < 17:
+        return None
+    flags, qdcount = struct.unpack_from('>HH', msg, 2)
+    if flags & 0x8000 or not qdcount:  # response or no question
+        return None
+    pos = 12
+    end = len(msg)
+    while True:
+        if pos >= end:
+            return None
+        length = msg[pos]
+        if length & 0xc0:  # compression is not expected in the first question
+            return None
+        pos += 1 + length
+        if not length:
+            break
+    if pos + 4 > end or pos - 12 > 255:
+        return None
+    rrtype, = struct.unpack_from('>H', msg, pos)
+    return (_name_from_wire(bytes(msg[12:pos])), rrtype)
+
+
+def _dns_payloads(frame, linktype):
+    """
+    Yield (packed source address, DNS message) sent to port 53 from link layer frame.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return
+        ethertype, = struct.unpack_from('>H', frame, 12)
+        pos = 14
+        while ethertype in (0x8100, 0x88a8) and len(frame) >= pos + 4:  # VLAN tags
+            ethertype, = struct.unpack_from('>H', frame, pos + 2)
+            pos += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return
+        ethertype, = struct.unpack_from('>H', frame, 14)
+        pos = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if len(frame) < 20:
+            return
+        ethertype, = struct.unpack_from('>H', frame, 0)
+        pos = 20
+    elif linktype == LINKTYPE_NULL:
+        if len(frame) < 4:
+            return
+        family = struct.unpack_from('<I', frame, 0)[0]
+        if family > 0xffff:  # written by big endian host
+            family = struct.unpack_from('>I', frame, 0)[0]
+        ethertype = 0x0800 if family == 2 else 0x86dd
+        pos = 4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if not frame:
+            return
+        ethertype = 0x0800 if frame[0] >> 4 == 4 else 0x86dd
+        pos = 0
+    else:
+        return
+
+    if ethertype == 0x0800:
+        if len(frame) < pos + 20:
+            return
+        ihl = (frame[pos] & 0x0f) * 4
+        total, frag, proto = struct.unpack_from('>H2xHxB', frame, pos + 2)
+        if frag & 0x3fff:  # fragment
+            return
+        source = frame[pos + 12:pos + 16]
+        end = min(len(frame), pos + total)
+        pos += ihl
+    elif ethertype == 0x86dd:
+        if len(frame) < pos + 40:
+            return
+        payload_len, proto = struct.unpack_from('>HB', frame, pos + 4)
+        source = frame[pos + 8:pos + 24]
+        end = min(len(frame), pos + 40 + payload_len)
+        pos += 40
+        while proto in (0, 43, 60):  # hop-by-hop, routing, destination options
+            if end < pos + 8:
+                return
+            proto = frame[pos]
+            pos += (frame[pos + 1] + 1) * 8
+        if proto == 44:  # fragment
+            return
+    else:
+        return
+
+    if proto == 17:
+        if end < pos + 8:
+            return
+        dport, = struct.unpack_from('>H', frame, pos + 2)
+        if dport == DNS_PORT:
+            yield source, frame[pos + 8:end]
+    elif proto == 6:
+        if end < pos + 20:
+            return
+        dport, = struct.unpack_from('>H', frame, pos + 2)
+        if dport != DNS_PORT:
+            return
+        pos += (frame[pos + 12] >> 4) * 4
+        while pos + 2 <= end:  # length-prefixed messages
+            length, = struct.unpack_from('>H', frame, pos)
+            if pos + 2 + length > end:  # continues in next segment
+                return
+            yield source, frame[pos + 2:pos + 2 + length]
+            pos += 2 + length
+
+
+def _queries_from_frame(frame, linktype, clients=False):
+    for source, msg in _dns_payloads(frame, linktype):
+        query = parse_query(msg)
+        if query:
+            yield query + (_address(bytes(source)),) if clients else query
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    return data
+
+
+def read_pcap(stream, clients=False):
+    header = _read_exact(stream, 24)
+    endian, resolution = PCAP_MAGICS[header[:4]]
+    linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0fffffff
+    record = struct.Struct(endian + 'IIII')
+
+    def events():
+        while True:
+            rec = _read_exact(stream, record.size)
+            if rec is None:
+                return
+            sec, frac, caplen, _ = record.unpack(rec)
+            frame = _read_exact(stream, caplen)
+            if frame is None:
+                return
+            now_us = sec * 1000000 + frac * 1000000 // resolution
+            for query in _queries_from_frame(frame, linktype, clients):
+                yield (now_us,) + query
+
+    return _relative(events())
+
+
+def read_pcapng(stream, clients=False):
+    def events():
+        endian = '<'
+        interfaces = []  # (linktype, ticks per second)
+        while True:
+            head = _read_exact(stream, 8)
+            if head is None:
+                return
+            if head[:4] == PCAPNG_MAGIC:  # section header block, new byte order
+                bom = _read_exact(stream, 4)
+                endian = '<' if bom == b'\x4d\x3c\x2b\x1a' else '>'
+                length, = struct.unpack(endian + 'I', head[4:])
+                _read_exact(stream, length - 12)
+                interfaces = []
+                continue
+            btype, length = struct.unpack(endian + 'II', head)
+            body = _read_exact(stream, length - 8)
+            if body is None:
+                return
+            if btype == 1:  # interface description
+                linktype, = struct.unpack_from(endian + 'H', body, 0)
+                interfaces.append((linktype, _pcapng_tsresol(body, endian)))
+            elif btype == 6:  # enhanced packet
+                ifid, ts_high, ts_low, caplen = struct.unpack_from(endian + 'IIII', body, 0)
+                linktype, ticks = interfaces[ifid]
+                now_us = ((ts_high << 32) | ts_low) * 1000000 // ticks
+                for query in _queries_from_frame(body[20:20 + caplen], linktype, clients):
+                    yield (now_us,) + query
+
+    return _relative(events())
+
+
+def _pcapng_tsresol(body, endian):
+    """
+    Ticks per second from if_tsresol option of interface description block.
+    """
+    pos = 8
+    while pos + 4 <= len(body) - 4:
+        code, length = struct.unpack_from(endian + 'HH', body, pos)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = body[pos + 4]
+            if value & 0x80:
+                return 2 ** (value & 0x7f)
+            return 10 ** value
+        pos += 4 + (length + 3) // 4 * 4
+    return 1000000
+
+
+def _protobuf_fields(buf):
+    """
+    Yield (field number, value) from protobuf message,
+    value is int for varint and fixed fields, bytes for length-delimited.
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        tag, pos = _varint(buf, pos)
+        field, wiretype = tag >> 3, tag & 7
+        if wiretype == 0:
+            value, pos = _varint(buf, pos)
+        elif wiretype == 1:
+            value, = struct.unpack_from('<Q', buf, pos)
+            pos += 8
+        elif wiretype == 2:
+            length, pos = _varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wiretype == 5:
+            value, = struct.unpack_from('<I', buf, pos)
+            pos += 4
+        else:
+            raise ValueError('unsupported protobuf wire type %d' % wiretype)
+        yield field, value
+
+
+def _varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_dnstap(stream, message_types=(DNSTAP_CLIENT_QUERY,), clients=False):
+    """
+    Read queries from dnstap Frame Streams file.
+    Only messages of given dnstap Message.type values are used.
+    """
+    def events():
+        while True:
+            head = _read_exact(stream, 4)
+            if head is None:
+                return
+            length, = struct.unpack('>I', head)
+            if length == 0:  # control frame
+                clen, = struct.unpack('>I', _read_exact(stream, 4))
+                _read_exact(stream, clen)
+                continue
+            frame = _read_exact(stream, length)
+            if frame is None:
+                return
+            message = None
+            for field, value in _protobuf_fields(frame):
+                if field == 14:
+                    message = value
+            if message is None:
+                continue
+            mtype = sec = nsec = wire = address = None
+            for field, value in _protobuf_fields(message):
+                if field == 1:
+                    mtype = value
+                elif field == 4:
+                    address = value
+                elif field == 8:
+                    sec = value
+                elif field == 9:
+                    nsec = value
+                elif field == 10:
+                    wire = value
+            if mtype not in message_types or wire is None or sec is None:
+                continue
+            query = parse_query(wire)
+            if query:
+                if clients:
+                    query += (_address(bytes(address)) if address is not None else None,)
+                yield (sec * 1000000 + (nsec or 0) // 1000,) + query
+
+    return _relative(events())
+
+
+FORMATS = {
+    'qlog': qlog2cache.read_queries_fast,
+    'pcap': read_pcap,
+    'pcapng': read_pcapng,
+    'dnstap': read_dnstap,
+}
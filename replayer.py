@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+
+"""
+Replay query trace against a running resolver.
+
+Queries from readers.open_queries() are sent over a pool of UDP sockets,
+responses are matched by socket, message ID and question. Trace has
+1 second resolution, queries of one second are spread evenly over it and
+sent at (reltime + offset) / speed seconds after start. Speed 0 sends
+open-loop as fast as possible.
+
+Results are aggregated into windows of trace time, same as metrics.Metrics,
+so rows line up with per-window simulator output: queries, answered,
+timeouts, rcodes and latency quantiles in ms from latency.Sketch.
+Optional per-query log has sequence number, reltime, name, type, rcode
+and latency.
+    replayer.py --server 127.0.0.1:53 --speed 10 trace.log > windows.csv
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import struct
+import sys
+
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+
+import latency
+import metrics
+
+FIELDS = ['start', 'end', 'policy', 'tld', 'queries', 'answered', 'timeout',
+          'noerror', 'nxdomain', 'servfail', 'other']
+BURST = 16  # queries sent without reading responses when behind schedule
+_HEADER = struct.Struct('>HHHHHH')
+_RD = 0x0100
+_OPT = struct.Struct('>BHHBBHH').pack(0, dns.rdatatype.OPT, 1232, 0, 0, 0, 0)
+_OPT_DO = struct.Struct('>BHHBBHH').pack(0, dns.rdatatype.OPT, 1232, 0, 0, 0x8000, 0)
+_RCODE_FIELDS = {dns.rcode.NOERROR: 'noerror', dns.rcode.NXDOMAIN: 'nxdomain',
+                 dns.rcode.SERVFAIL: 'servfail'}
+
+
+def make_query(qid, name, rrtype, edns=True, dnssec=False):
+    """
+    Query with RD set in wire format, returns (wire, question bytes).
+    """
+    question = name.to_wire() + struct.pack('>HH', rrtype, dns.rdataclass.IN)
+    header = _HEADER.pack(qid, _RD, 1, 0, 0, 1 if edns else 0)
+    if not edns:
+        return header + question, question
+    return header + question + (_OPT_DO if dnssec else _OPT), question
+
+
+class Window(object):
+    __slots__ = ('queries', 'outstanding', 'counts', 'sketch')
+
+    def __init__(self):
+        self.queries = 0
+        self.outstanding = 0
+        self.counts = dict.fromkeys(FIELDS[5:], 0)
+        self.sketch = latency.Sketch()
+
+
+class _Socket(asyncio.DatagramProtocol):
+    """
+    One UDP socket with its outstanding queries: id -> (sent, question, query)
+    in order of sending.
+    """
+    def __init__(self, replayer):
+        self.replayer = replayer
+        self.transport = None
+        self.outstanding = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            self.replayer.unexpected += 1
+            return
+        qid, = struct.unpack_from('>H', data)
+        pending = self.outstanding.get(qid)
+        if pending is None or data[12:12 + len(pending[1])].lower() != pending[1].lower():
+            self.replayer.unexpected += 1
+            return
+        del self.outstanding[qid]
+        self.replayer.complete(pending[2], data[3] & 0x0f, self.replayer.loop.time() - pending[0])
+
+    def expire(self, deadline):
+        """
+        Drop queries sent before deadline, they are the oldest ones.
+        """
+        outstanding = self.outstanding
+        while outstanding:
+            qid = next(iter(outstanding))
+            sent, _, query = outstanding[qid]
+            if sent >= deadline:
+                break
+            del outstanding[qid]
+            self.replayer.complete(query, None, None)
+
+
+class Replayer(object):
+    def __init__(self, server, sink, sockets=16, speed=1.0, timeout=2.0, window=3600,
+                 log=None, edns=True, dnssec=False):
+        """
+        server: (address, port) of resolver
+        sink: metrics.CsvSink or JsonSink for window rows
+        log: optional text file for per-query CSV
+        """
+        assert window > 0 and speed >= 0
+        self.server = server
+        self.sink = sink
+        self.nsockets = sockets
+        self.speed = speed
+        self.timeout = timeout
+        self.window = window
+        self.log = log
+        self.edns = edns
+        self.dnssec = dnssec
+        self.loop = None
+        self.sockets = []
+        self.windows = {}  # window index -> Window
+        self.flushed = 0  # index of first window not written yet
+        self.sending = 0  # index of window being sent, later ones are not complete
+        self.sent = 0
+        self.answered = 0
+        self.timeouts = 0
+        self.unexpected = 0  # responses not matching any query
+        self._done = None
+
+    def complete(self, query, rcode, elapsed):
+        """
+        Record response (rcode, elapsed seconds) or timeout (None, None).
+        """
+        seq, reltime, name, rrtype = query
+        window = self.windows[reltime // self.window]
+        window.outstanding -= 1
+        if rcode is None:
+            self.timeouts += 1
+            window.counts['timeout'] += 1
+        else:
+            self.answered += 1
+            window.counts['answered'] += 1
+            window.counts[_RCODE_FIELDS.get(rcode, 'other')] += 1
+            window.sketch.add(elapsed * 1000)
+        if self.log:
+            self.log.write('{},{},{},{},{},{}\n'.format(
+                seq, reltime, name, dns.rdatatype.to_text(rrtype),
+                'timeout' if rcode is None else dns.rcode.to_text(rcode),
+                '' if elapsed is None else '{:.3f}'.format(elapsed * 1000)))
+        if not window.outstanding:
+            self._flush()
+        if self._done is not None and self.answered + self.timeouts == self.sent:
+            self._done.set()
+
+    def _flush(self, final=False):
+        """
+        Write windows in order while they are complete.
+        """
+        written = False
+        while self.flushed < self.sending or final:
+            window = self.windows.get(self.flushed)
+            if window is None:
+                if final and self.flushed > max(self.windows, default=-1):
+                    break
+                window = Window()
+            elif window.outstanding:
+                break
+            record = {'start': self.flushed * self.window, 'end': (self.flushed + 1) * self.window,
+                      'policy': 'replay', 'tld': None, 'queries': window.queries}
+            record.update(window.counts)
+            for field, q in metrics.QUANTILES:
+                value = window.sketch.quantile(q)
+                record[field] = None if value is None else round(value, 3)
+            self.sink.write(record)
+            self.windows.pop(self.flushed, None)
+            self.flushed += 1
+            written = True
+        if written:
+            self.sink.flush()
+
+    def _send(self, query):
+        seq, reltime, name, rrtype = query
+        sock = self.sockets[seq % len(self.sockets)]
+        qid = random.getrandbits(16)
+        while qid in sock.outstanding:
+            qid = random.getrandbits(16)
+        wire, question = make_query(qid, name, rrtype, self.edns, self.dnssec)
+        idx = reltime // self.window
+        window = self.windows.get(idx)
+        if window is None:
+            window = self.windows[idx] = Window()
+        window.queries += 1
+        window.outstanding += 1
+        if idx > self.sending:
+            self.sending = idx
+            self._flush()
+        sock.outstanding[qid] = (self.loop.time(), question, query)
+        sock.transport.sendto(wire)
+        self.sent += 1
+
+    async def _expire(self):
+        while True:
+            await asyncio.sleep(min(0.05, self.timeout / 4))
+            deadline = self.loop.time() - self.timeout
+            for sock in self.sockets:
+                sock.expire(deadline)
+
+    async def _paced(self, queries):
+        """
+        Send queries grouped by second, spread evenly over the second.
+        """
+        start = self.loop.time()
+        seq = itertools.count()
+        for reltime, group in itertools.groupby(queries, key=lambda query: query[0]):
+            group = list(group)
+            for idx, (_, name, rrtype) in enumerate(group):
+                due = start + (reltime + idx / len(group)) / self.speed
+                delay = due - self.loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif not idx % BURST:
+                    await asyncio.sleep(0)  # behind schedule, still let responses in
+                self._send((next(seq), reltime, name, rrtype))
+
+    async def _open_loop(self, queries):
+        for seq, (reltime, name, rrtype) in enumerate(queries):
+            self._send((seq, reltime, name, rrtype))
+            if seq % BURST == BURST - 1:
+                await asyncio.sleep(0)  # let responses in
+
+    async def run(self, queries):
+        """
+        Replay all queries and wait for their responses or timeouts.
+        """
+        self.loop = asyncio.get_running_loop()
+        for _ in range(self.nsockets):
+            _, sock = await self.loop.create_datagram_endpoint(
+                lambda: _Socket(self), remote_addr=self.server)
+            self.sockets.append(sock)
+        expire = asyncio.ensure_future(self._expire())
+        try:
+            if self.speed:
+                await self._paced(queries)
+            else:
+                await self._open_loop(queries)
+            if self.answered + self.timeouts < self.sent:
+                self._done = asyncio.Event()
+                await self._done.wait()
+        finally:
+            expire.cancel()
+            for sock in self.sockets:
+                sock.transport.close()
+        self._flush(final=True)
+
+
+def parse_server(text):
+    address, _, port = text.rpartition(':')
+    if not address:
+        return (text, 53)
+    return (address.strip('[]'), int(port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay query trace against a resolver.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='query log, capture or trace, see readers (default: stdin)')
+    parser.add_argument('--format', choices=['qlog', 'pcap', 'pcapng', 'dnstap', 'trace'],
+                        help='input format (default: autodetect)')
+    parser.add_argument('-s', '--server', default='127.0.0.1:53',
+                        help='resolver address:port (default: %(default)s)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='speed-up factor, 0 sends as fast as possible (default: %(default)s)')
+    parser.add_argument('--sockets', type=int, default=16,
+                        help='number of UDP sockets (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=2.0,
+                        help='seconds to wait for response (default: %(default)s)')
+    parser.add_argument('--window', type=int, default=3600,
+                        help='window length in seconds of trace time (default: %(default)s)')
+    parser.add_argument('--metrics', choices=['csv', 'json'], default='csv',
+                        help='format of window rows (default: %(default)s)')
+    parser.add_argument('--log', metavar='FILE', help='write per-query results as CSV')
+    parser.add_argument('--no-edns', action='store_true', help='send queries without EDNS')
+    parser.add_argument('--dnssec', action='store_true', help='set DO bit')
+    args = parser.parse_args()
+    if args.speed < 0 or args.window <= 0 or args.sockets <= 0:
+        parser.error('--speed must not be negative, --window and --sockets must be positive')
+
+    import readers
+    log = None
+    if args.log:
+        log = open(args.log, 'w')
+        log.write('seq,reltime,qname,qtype,rcode,latency\n')
+    replayer = Replayer(parse_server(args.server), metrics.SINKS[args.metrics](sys.stdout),
+                        args.sockets, args.speed, args.timeout, args.window, log,
+                        not args.no_edns, args.dnssec)
+    try:
+        asyncio.run(replayer.run(readers.open_queries(args.input, args.format)))
+    finally:
+        if log:
+            log.close()
+    print('sent {}, answered {}, timeouts {}, unexpected responses {}'.format(
+        replayer.sent, replayer.answered, replayer.timeouts, replayer.unexpected), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,35 +4,188 @@ Simulate RFC 2308 cache, resolver, and auth.
 Cache exact match + negative caching.
 """
 
+import heapq
+import itertools
 from pprint import pformat
+import sys
 import time
+import zlib
 
+import dns.name
+import dns.rdatatype
 import dns.resolver
-import dns.zone
+
+import canonical
+import eviction
+import zoneindex
+
+# rough RDATA sizes used to estimate wire format size of cached RRsets
+RDATA_SIZE = {
+    dns.rdatatype.A: 4,
+    dns.rdatatype.AAAA: 16,
+    dns.rdatatype.NS: 20,
+    dns.rdatatype.DS: 36,
+    dns.rdatatype.SOA: 64,  # negative answers carry SOA
+    dns.rdatatype.DNSKEY: 260,
+}
+RDATA_SIZE_DEFAULT = 32
+
+# outcome of Resolver.lookup(), index into OUTCOMES
+MISS = 0
+POSITIVE = 1
+NXDOMAIN = 2
+NODATA = 3
+SYNTHESIZED = 4  # NXDOMAIN from covering NSEC/NSEC3, RFC 8198
+OUTCOMES = ('miss', 'positive', 'nxdomain', 'nodata', 'synthesized')
+
+
+def _deep_sizeof(obj, seen):
+    if id(obj) in seen or isinstance(obj, dns.name.Name):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(key, seen) + _deep_sizeof(value, seen)
+                    for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(_deep_sizeof(getattr(obj, slot), seen)
+                    for slot in obj.__slots__ if hasattr(obj, slot))
+    return size
+
+
+def estimate_size(name, rrtype, rdata_size=None):
+    """
+    Estimate wire format size of RR: owner + type, class, TTL, RDLENGTH + RDATA
+
+    name is dns.name.Name or its canonical key
+    """
+    if rdata_size is None:
+        rdata_size = RDATA_SIZE.get(rrtype, RDATA_SIZE_DEFAULT)
+    if isinstance(name, bytes):
+        owner_size = canonical.wire_length(name)
+    else:
+        owner_size = len(name.to_digestable())
+    return owner_size + 10 + rdata_size
+
+
+def contradicts(node, rrtype, outcome):
+    """
+    True if cached answer of kind outcome (POSITIVE, NXDOMAIN or NODATA)
+    disagrees with node of current zone version, None for nonexistent name.
+    """
+    if outcome == NXDOMAIN:
+        return node is not None
+    if node is None:
+        return True
+    return (rrtype in node) != (outcome == POSITIVE)
 
 
 class Cache(object):
-    def __init__(self):
+    def __init__(self, reclaim=False):
+        """
+        reclaim: drop expired entries from storage when time moves
+        """
+        self.stale = 0  # serve-stale window in seconds, RFC 8767
+        self.served_stale = False  # last hit was answered from stale entry
+        self.stale_gate = None  # optional function, False if stale entry must not be served
+        self.ttls = None  # entry -> [original TTL, hits] if tracked for prefetch
+        self.nodata = None  # NODATA entries if tracked for changing zone, see Resolver._outcome()
         self.storage = {}
         self.hit = 0
         self.miss = 0
         self.start = int(time.monotonic())
         self.now = self.start
+        self.entries = 0  # number of (name, rrtype) entries in storage
+        self.reclaim = reclaim
+        self.expiry = []  # heap of (expires, seq, name, rrtype)
+        self.expired = 0  # number of reclaimed entries
+        self._seq = itertools.count()
 
     def __str__(self):
         return pformat({'hit': self.hit, 'miss': self.miss})
 
+    def __getstate__(self):
+        # pickling of itertools.count is deprecated, keep its next value
+        state = self.__dict__.copy()
+        state['_seq'] = next(self._seq)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._seq = itertools.count(state['_seq'])
+
+    def footprint(self):
+        """
+        Approximate memory used by cache data structures in bytes.
+        Names are not counted, they are shared with parser and auth.
+        """
+        return _deep_sizeof(self.storage, set())
+
     def set_reltime(self, reltime):
         """
         move relative time
         """
         self.now = self.start + reltime
+        if self.reclaim:
+            self._reclaim()
+
+    def _schedule(self, name, rrtype, expires):
+        if self.reclaim:
+            heapq.heappush(self.expiry, (expires, next(self._seq), name, rrtype))
+
+    def _expires(self, name, rrtype):
+        """
+        Returns expiration time of cached entry or None.
+        """
+        node = self.storage.get(name)
+        if isinstance(node, int):
+            return node if rrtype == dns.rdatatype.ANY else None
+        elif node is None:
+            return None
+        return node.get(rrtype)
+
+    def _reclaim(self):
+        """
+        Drop entries which expired before now, O(log n) per entry.
+        Heap items of entries refreshed in the meantime are skipped.
+        """
+        heap = self.expiry
+        while heap and heap[0][0] + self.stale < self.now:
+            expires, _, name, rrtype = heapq.heappop(heap)
+            if self._expires(name, rrtype) == expires:
+                self.remove(name, rrtype)
+                self.expired += 1
+
+    def _track(self, name, rrtype, ttl):
+        if self.ttls is not None:
+            self.ttls[(name, rrtype)] = [ttl, 0]
+
+    def _usable(self, expires):
+        """
+        True if expired entry can still be served stale, remembers that it was.
+        """
+        if expires + self.stale < self.now:
+            return False
+        if self.stale_gate is not None and not self.stale_gate():
+            return False
+        self.served_stale = True
+        return True
 
     def put_name(self, name, ttl):
         """
         cache information for whole name
         """
+        node = self.storage.get(name)
+        if isinstance(node, dict):  # name was removed from changing zone
+            for rrtype in list(node):
+                self.remove(name, rrtype)
+        if name not in self.storage:
+            self.entries += 1
         self.storage[name] = self.now + ttl
+        self._schedule(name, dns.rdatatype.ANY, self.now + ttl)
+        self._track(name, dns.rdatatype.ANY, ttl)
 
     def get_name(self, name):
         """
@@ -45,7 +198,7 @@ class Cache(object):
         if isinstance(node, int):
             # NXDOMAIN, check if it is still valid
             expires = node
-            if expires < self.now:
+            if expires < self.now and not self._usable(expires):
                 raise KeyError('expired')
             else:
                 raise dns.resolver.NXDOMAIN()
@@ -56,14 +209,20 @@ class Cache(object):
         """
         cache information for one RR type
         """
-        assert (name not in self.storage) or (isinstance(self.storage[name], dict)), 'unsupported put operation'
-        self.storage.setdefault(name, {})[rrtype] = self.now + ttl
+        if isinstance(self.storage.get(name), int):  # name was added to changing zone
+            self.remove(name, dns.rdatatype.ANY)
+        node = self.storage.setdefault(name, {})
+        if rrtype not in node:
+            self.entries += 1
+        node[rrtype] = self.now + ttl
+        self._schedule(name, rrtype, self.now + ttl)
+        self._track(name, rrtype, ttl)
 
     def get_rrtype(self, name, rrtype):
         try:
             node = self.get_name(name)
             expires = node[rrtype]  # verify RRtype is in cache
-            if expires < self.now:
+            if expires < self.now and not self._usable(expires):
                 raise KeyError('expired')
         except KeyError:  # not in cache
             self.miss += 1
@@ -72,29 +231,251 @@ class Cache(object):
             pass
         self.hit += 1
 
+    def peek(self, name, rrtype):
+        """
+        True if valid entry is in cache, hit and miss are not counted
+        """
+        expires = self._expires(name, rrtype)
+        return expires is not None and expires >= self.now
+
+    def entry(self, name, rrtype):
+        """
+        Key of entry which answers (name, rrtype) after a hit,
+        (name, ANY) for cached NXDOMAIN.
+        """
+        if isinstance(self.storage[name], int):
+            return (name, dns.rdatatype.ANY)
+        return (name, rrtype)
+
+    def remove(self, name, rrtype):
+        """
+        drop one entry from cache, RR type ANY drops cached NXDOMAIN
+        """
+        if self.ttls is not None:
+            self.ttls.pop((name, rrtype), None)
+        if self.nodata is not None:
+            self.nodata.discard((name, rrtype))
+        node = self.storage[name]
+        if isinstance(node, int):
+            assert rrtype == dns.rdatatype.ANY
+            del self.storage[name]
+        else:
+            del node[rrtype]
+            if not node:
+                del self.storage[name]
+        self.entries -= 1
+
+
+class BoundedCache(Cache):
+    """
+    Cache limited by number of entries or by estimated size in bytes.
+
+    Entry is (name, rrtype), cached NXDOMAIN is (name, ANY).
+    Policy is a name from eviction.POLICIES or a policy class.
+    """
+    def __init__(self, max_entries=None, max_bytes=None, policy='lru', reclaim=False):
+        super().__init__(reclaim)
+        assert (max_entries is None) != (max_bytes is None), 'exactly one limit is required'
+        self.by_bytes = max_bytes is not None
+        self.limit = max_bytes if self.by_bytes else max_entries
+        if isinstance(policy, str):
+            policy = eviction.POLICIES[policy]
+        self.policy = policy(self.limit)
+        self.sizes = {}  # (name, rrtype) -> weight
+        self.used = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return pformat({'hit': self.hit, 'miss': self.miss, 'evictions': self.evictions})
+
+    def _weight(self, name, rrtype, data):
+        if not self.by_bytes:
+            return 1
+        return estimate_size(name, rrtype)
+
+    def _admit(self, key, data):
+        if key in self.sizes:
+            self.policy.access(key)
+            return
+        weight = self._weight(key[0], key[1], data)
+        self.policy.insert(key, weight)
+        self.sizes[key] = weight
+        self.used += weight
+        while self.used > self.limit:
+            self._drop(self.policy.evict())
+            self.evictions += 1
+
+    def _drop(self, key):
+        super().remove(*key)
+        self.used -= self.sizes.pop(key)
+
+    def put_name(self, name, ttl):
+        super().put_name(name, ttl)
+        self._admit((name, dns.rdatatype.ANY), ttl)
+
+    def put_rrtype(self, name, rrtype, ttl):
+        super().put_rrtype(name, rrtype, ttl)
+        self._admit((name, rrtype), ttl)
+
+    def get_rrtype(self, name, rrtype):
+        super().get_rrtype(name, rrtype)
+        self.policy.access(self.entry(name, rrtype))
+
+    def peek(self, name, rrtype):
+        found = super().peek(name, rrtype)
+        if found:
+            self.policy.access((name, rrtype))
+        return found
+
+    def remove(self, name, rrtype):
+        self.policy.remove((name, rrtype))
+        self._drop((name, rrtype))
+
 
 class Resolver(object):
-    def __init__(self, auth):
-        self.cache = Cache()
+    def __init__(self, auth, cache=None, latency=None, prefetch=0.0, prefetch_hits=0, stale=0,
+                 stale_timer=None):
+        """
+        latency: optional latency.Model, lookup() then sets self.elapsed in ms
+        prefetch: refresh entry on hit if less than this fraction of its TTL remains
+        prefetch_hits: ... and if it had at least this many hits since it was fetched
+        stale: answer from entries expired at most this many seconds ago
+               and refresh them (RFC 8767)
+        stale_timer: client response timer in ms, with latency model stale
+               entry is served only if its refresh takes longer, otherwise
+               refresh is answered as a miss; without the model or timer
+               stale entries are always served
+        """
+        self.cache = cache if cache is not None else Cache()
         self.auth = auth
+        self.latency = latency
+        self.elapsed = None
+        self.prefetch = prefetch
+        self.prefetch_hits = prefetch_hits
+        self.cache.stale = stale
+        self.stale_timer = stale_timer
+        self.refresh = None  # modelled miss latency sampled by _refresh_late() in this lookup
+        if stale and latency is not None and stale_timer is not None:
+            self.cache.stale_gate = self._refresh_late
+        if prefetch:
+            self.cache.ttls = {}
+        self.prefetched = 0  # auth queries made by prefetch and refresh of stale entries
+        self.stale_answers = 0
+        self.inconsistent = 0  # hits contradicting current version of changing zone
+        if auth.zone.diffs:
+            self.cache.nodata = set()  # (name, rrtype) fetched as NODATA
 
     def set_reltime(self, reltime):
+        self.auth.set_reltime(reltime)
         self.cache.set_reltime(reltime)
 
+    def partition(self, name):
+        """
+        Return integer identifying part of namespace which is cached
+        independently on other parts. Exact match cache depends only on name.
+        """
+        return zlib.crc32(name.to_digestable())
+
+    def _key(self, name):
+        """
+        Representation of name in cache.
+        """
+        return name
+
     def lookup(self, name, rrtype):
+        """
+        Returns MISS or kind of answer found in cache (one of OUTCOMES).
+        """
+        cache = self.cache
+        key = self._key(name)
+        cache.served_stale = False
+        self.refresh = None
         try:
-            return self.cache.get_rrtype(name, rrtype)
+            outcome = cache.get_rrtype(key, rrtype)
         except KeyError:
-            rcode, answers = self.auth.query(name, rrtype)
-            if rcode == dns.rcode.NOERROR:
-                self._store_noerror(answers)
-            else:
-                assert rcode == dns.rcode.NXDOMAIN
-                self._store_nxdomain(answers)
+            self._resolve(name, rrtype)
+            if self.latency is not None:
+                self.elapsed = self.latency.miss() if self.refresh is None else self.refresh
+            return MISS
+        if self.latency is not None:
+            self.elapsed = self.latency.hit()
+        if cache.served_stale:
+            if self.refresh is not None:
+                self.elapsed = self.stale_timer  # answered when client response timer fired
+            self.stale_answers += 1
+            self._background(name, rrtype)
+        elif self.prefetch:
+            self._check_prefetch(name, key, rrtype)
+        return self._outcome(name, rrtype, outcome)
+
+    def _refresh_late(self):
+        """
+        Stale entry is used only if resolution does not finish before
+        client response timer (RFC 8767 section 5), one sample per lookup.
+        """
+        if self.refresh is None:
+            self.refresh = self.latency.miss()
+        return self.refresh > self.stale_timer
+
+    def _check_prefetch(self, name, key, rrtype):
+        cache = self.cache
+        entry = cache.entry(key, rrtype)
+        tracked = cache.ttls.get(entry)
+        if tracked is None:
+            return
+        tracked[1] += 1
+        if tracked[1] < self.prefetch_hits:
+            return
+        if cache._expires(*entry) - cache.now < self.prefetch * tracked[0]:
+            self._background(name, rrtype)
+
+    def _background(self, name, rrtype):
+        """
+        Refresh cache without client waiting for it.
+        """
+        queries = self.auth.queries
+        self._resolve(name, rrtype)
+        self.prefetched += self.auth.queries - queries
+
+    def _resolve(self, name, rrtype):
+        """
+        Ask auth and store answer in cache.
+        """
+        rcode, answers = self.auth.query(name, rrtype)
+        if rcode == dns.rcode.NOERROR:
+            self._store_noerror(answers)
+        else:
+            assert rcode == dns.rcode.NXDOMAIN
+            self._store_nxdomain(answers)
+
+    def _outcome(self, name, rrtype, outcome):
+        """
+        Kind of answer for cache hit, outcome is what cache returned.
+        """
+        node = self.auth.zone.nodes.get(name)
+        if isinstance(self.cache.storage[name], int):
+            outcome = NXDOMAIN
+        elif self.auth.zone.diffs:
+            # zone changes, remembered kind of the answer tells what was served
+            outcome = NODATA if (name, rrtype) in self.cache.nodata else POSITIVE
+        else:
+            # exact-match cache does not know whether entry is negative, zone does
+            return POSITIVE if rrtype in node else NODATA
+        if self.auth.zone.diffs and contradicts(node, rrtype, outcome):
+            self.inconsistent += 1
+        return outcome
 
     def _store_noerror(self, answers):
+        nodes = self.auth.zone.nodes if self.auth.zone.diffs else None
         for owner, data in answers.items():
             name, rrtype = owner
+            if nodes is not None:
+                # before put, entry which is not admitted leaves the set in remove()
+                node = nodes.get(name)
+                if node is not None and rrtype not in node:
+                    self.cache.nodata.add(owner)
+                else:
+                    self.cache.nodata.discard(owner)
             self.cache.put_rrtype(name, rrtype, data["ttl"])
 
     def _store_nxdomain(self, answers):
@@ -107,15 +488,62 @@ class Resolver(object):
         self.cache.put_name(name, data["ttl"])
 
 
+def load_zone(rootdb):
+    """
+    Load zone tables so they can be shared by several Authoritative instances.
+
+    rootdb is path to zone file or to snapshot made by zoneindex.py
+    """
+    return zoneindex.load(rootdb)
+
+
 class Authoritative(object):
-    def __init__(self, rootdb):
+    DERIVED = ()  # attributes built by _derive() from zone tables, not pickled
+
+    def __init__(self, rootdb, zonedir=None, iterations=0, salt=b''):
+        """
+        rootdb is path to zone file, snapshot or result of load_zone(),
+        zonedir is used only by hierarchy, iterations and salt only by
+        rfc5155; all policies accept the same arguments so loaders can
+        create any of them
+        """
         self.queries = 0
-        self.rootzone = dns.zone.from_file(rootdb, origin=dns.name.root, relativize=False)
+        self.zone = zoneindex.load(rootdb)
+        self.neg_ttl = self.zone.neg_ttl
+        self.version = self.zone.version  # zone diffs seen by this instance
+        self._derive()
+
+    def __getstate__(self):
+        # checkpoint keeps counters only, zone is stored by reference
+        state = self.__dict__.copy()
+        for name in self.DERIVED:
+            del state[name]
+        return state
 
-        rootnode = self.rootzone[dns.name.root]
-        soa_rrs = rootnode.find_rdataset(dns.rdataclass.IN, dns.rdatatype.SOA)
-        soa = soa_rrs[0]
-        self.neg_ttl = min(soa_rrs.ttl, soa.minimum)  # https://tools.ietf.org/html/rfc2308#section-5
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._derive()
+
+    def _derive(self):
+        """
+        Build tables derived from zone, also after unpickling.
+        """
+
+    def set_reltime(self, reltime):
+        """
+        Switch to version of zone active at reltime, zone tables are
+        shared so other instances may have applied the diffs already.
+        """
+        if self.zone.diffs:
+            for diff in self.zone.advance(reltime, self.version):
+                self._update(diff)
+            self.version = self.zone.version
+
+    def _update(self, diff):
+        """
+        Update tables derived from zone after zoneindex.ZoneDiff was applied.
+        """
+        self.neg_ttl = self.zone.neg_ttl
 
     def _gen_nxdomain(self, name):
         """
@@ -140,14 +568,12 @@ class Authoritative(object):
         """
         assert name.is_absolute()
         self.queries += 1
-        try:
-            node = self.rootzone[name]
-        except KeyError:  # NXDOMAIN
+        node = self.zone.nodes.get(name)
+        if node is None:  # NXDOMAIN
             return self._gen_nxdomain(name)
-        try:
-            rrs = node.find_rdataset(dns.rdataclass.IN, rrtype)
-        except KeyError:  # NODATA
+        ttl = node.get(rrtype)
+        if ttl is None:  # NODATA
             return self._gen_nodata(name, rrtype)
 
         # NOERROR
-        return self._gen_noerror(name, rrtype, rrs.ttl)
+        return self._gen_noerror(name, rrtype, ttl)
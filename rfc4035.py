@@ -14,6 +14,9 @@ is against synthtetising answers from NSEC.
 class Cache(rfc2308.Cache):
     pass
 
+class BoundedCache(rfc2308.BoundedCache):
+    pass
+
 class Resolver(rfc2308.Resolver):
     pass
 
@@ -22,10 +25,7 @@ class Authoritative(rfc2308.Authoritative):
         rcode, answers = super()._gen_noerror(name, rrtype, ttl)
         if rrtype == dns.rdatatype.NS:
             # add DS if it exists
-            node = self.rootzone[name]
-            try:
-                ds_rrs = node.find_rdataset(dns.rdataclass.IN, dns.rdatatype.DS)
-                answers[(name, dns.rdatatype.DS)] = {"ttl": ds_rrs.ttl}
-            except KeyError:
-                pass
+            ds_ttl = self.zone.nodes[name].get(dns.rdatatype.DS)
+            if ds_ttl is not None:
+                answers[(name, dns.rdatatype.DS)] = {"ttl": ds_ttl}
         return (rcode, answers)
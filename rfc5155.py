@@ -0,0 +1,478 @@
+"""
+Simulate aggressive use of NSEC3 (RFC 8198 over RFC 5155) cache, resolver, and auth.
+
+NSEC3 records are cached under their hashed owner names, cached owners
+are kept in hash order. Nonexistence of a name is proven by:
+- NODATA: NSEC3 matching hash of the name
+- NXDOMAIN: closest encloser proof (NSEC3 matching hash of the closest
+  existing ancestor, NSEC3 covering hash of the next closer name) and NSEC3
+  covering hash of wildcard at the closest encloser
+Opt-out is not modeled. A name covered by wildcard is a miss.
+
+Auth uses the NSEC3 chain of the zone. Zones signed with NSEC (e.g. the
+root zone) are hashed when loaded with iterations and salt given to
+Authoritative (ITERATIONS and SALT by default), so the same zone can be
+compared under NSEC and NSEC3.
+
+Every check needs iterated SHA-1 of the qname, its ancestors and wildcard.
+HashMemo keeps bounded LRU memo of name -> hashed owner and counts hashes
+computed, memo hits and time spent hashing.
+"""
+
+import base64
+import bisect
+import collections
+import hashlib
+import time
+
+import dns.name
+import dns.rcode
+import dns.rdatatype
+
+import canonical
+import rfc2308
+import rfc4035
+import rfc8198
+
+ITERATIONS = 0  # RFC 9276 recommends 0 additional iterations and no salt
+SALT = b''
+MEMO_SIZE = 1 << 16
+
+
+def nsec3_hash(wire, iterations, salt):
+    """
+    RFC 5155 section 5 hash of name in canonical wire format.
+    """
+    digest = hashlib.sha1(wire + salt).digest()
+    for _ in range(iterations):
+        digest = hashlib.sha1(digest + salt).digest()
+    return digest
+
+
+def ancestors(key):
+    """
+    Canonical keys of name with given key and of all its ancestors,
+    from the root down to the name.
+
+    Key of a name is key of its parent followed by the leftmost label.
+    """
+    keys = [b'']
+    pos = 0
+    while pos < len(key):
+        pos = key.index(b'\x00\x00', pos) + 2
+        keys.append(key[:pos])
+    return keys
+
+
+def _wildcard(key):
+    return key + b'*\x00\x00'
+
+
+class HashMemo(object):
+    """
+    Bounded memo of name key -> canonical key of its NSEC3 owner name.
+    """
+    def __init__(self, iterations, salt, origin=dns.name.root, size=MEMO_SIZE):
+        self.iterations = iterations
+        self.salt = salt
+        self.origin = canonical.key(origin)
+        self.size = size
+        self.memo = collections.OrderedDict()
+        self.lookups = 0
+        self.computed = 0
+        self.seconds = 0.0
+
+    def compute(self, key):
+        wire = b''.join(bytes((len(label),)) + label for label in canonical.labels(key))
+        digest = nsec3_hash(wire, self.iterations, self.salt)
+        return self.origin + base64.b32hexencode(digest).lower() + b'\x00\x00'
+
+    def owner(self, key):
+        self.lookups += 1
+        memo = self.memo
+        owner = memo.get(key)
+        if owner is not None:
+            memo.move_to_end(key)
+            return owner
+        start = time.perf_counter()
+        owner = memo[key] = self.compute(key)
+        self.seconds += time.perf_counter() - start
+        self.computed += 1
+        if len(memo) > self.size:
+            memo.popitem(last=False)
+        return owner
+
+
+class Cache(rfc8198.Cache):
+    def __init__(self, reclaim=False):
+        super().__init__(reclaim)
+        self.hasher = None  # HashMemo with parameters of the zone, set by Resolver
+        # self.ordering holds only owner keys of cached NSEC3 records
+        self.proof = []  # keys of entries which answered the last hit
+
+    def put_rrtype(self, name, rrtype, data):
+        """
+        cache information for one RR type
+        """
+        expires = self.now + data['ttl']
+        node = self.storage.setdefault(name, {})
+        if rrtype == dns.rdatatype.NSEC3:
+            assert data.keys() == {'ttl', 'next', 'types'}
+            entry = rfc8198.NsecEntry(expires, data['next'], data['types'])
+            if rrtype not in node:
+                self.ordering.add(name)
+        else:
+            assert data.keys() == {'ttl'}
+            entry = expires
+
+        if rrtype not in node:
+            self.entries += 1
+        node[rrtype] = entry
+        self._schedule(name, rrtype, expires)
+        self._track(name, rrtype, data['ttl'])
+
+    def _expires(self, name, rrtype):
+        try:
+            entry = self.storage[name][rrtype]
+        except KeyError:
+            return None
+        return entry.ttl if rrtype == dns.rdatatype.NSEC3 else entry
+
+    def _nsec3(self, owner):
+        """
+        Valid NSEC3 entry with given owner key or None, raises KeyError if expired.
+        """
+        node = self.storage.get(owner)
+        if node is None:
+            return None
+        entry = node.get(dns.rdatatype.NSEC3)
+        if entry is not None and entry.ttl < self.now and not self._usable(entry.ttl):
+            raise KeyError('NSEC3 expired')
+        return entry
+
+    def _covering(self, hashed):
+        """
+        Owner key of cached NSEC3 covering hashed name, raises KeyError if none.
+        """
+        try:
+            owner = self.ordering.floor(hashed)
+        except IndexError:
+            try:
+                owner = self.ordering.last()  # covered by the last NSEC3 in chain
+            except IndexError:
+                raise KeyError('no NSEC3 in cache')
+        entry = self._nsec3(owner)
+        if owner < hashed < entry.next or entry.next <= owner < hashed or hashed < entry.next <= owner:
+            return owner
+        raise KeyError('covering NSEC3 not found')
+
+    def _get_rrtype(self, name, rrtype):
+        node = self.storage.get(name)
+        if node is not None and rrtype in node:
+            expires = self._expires(name, rrtype)
+            if expires < self.now and not self._usable(expires):
+                raise KeyError('expired')
+            self.proof = [(name, rrtype)]
+            self.answered = rfc2308.POSITIVE
+            return rfc2308.POSITIVE
+
+        owner = self.hasher.owner
+        hashed = owner(name)
+        match = self._nsec3(hashed)
+        if match is not None:
+            if match.has_type(rrtype):
+                raise KeyError('RR type not in cache but exists')
+            self.proof = [(hashed, dns.rdatatype.NSEC3)]
+            self.answered = rfc2308.NODATA  # matching NSEC3
+            return rfc2308.NODATA
+
+        # closest encloser proof
+        keys = ancestors(name)
+        for depth in range(len(keys) - 2, -1, -1):
+            encloser = owner(keys[depth])
+            if self._nsec3(encloser) is not None:
+                break
+        else:
+            raise KeyError('closest encloser not found')
+        wildcard = owner(_wildcard(keys[depth]))
+        if self._nsec3(wildcard) is not None:
+            raise KeyError('wildcard exists')
+        self.proof = [(self._covering(owner(keys[depth + 1])), dns.rdatatype.NSEC3),
+                      (encloser, dns.rdatatype.NSEC3),
+                      (self._covering(wildcard), dns.rdatatype.NSEC3)]
+        self.answered = rfc2308.NXDOMAIN
+        return rfc2308.SYNTHESIZED
+
+    def remove(self, name, rrtype):
+        """
+        drop one entry from cache, removed NSEC3 leaves ordering
+        """
+        if self.ttls is not None:
+            self.ttls.pop((name, rrtype), None)
+        node = self.storage[name]
+        del node[rrtype]
+        self.entries -= 1
+        if rrtype == dns.rdatatype.NSEC3:
+            self.ordering.remove(name)
+        if not node:
+            del self.storage[name]
+
+    def entry(self, name, rrtype):
+        """
+        Key of entry which answered the last hit: exact entry, NSEC3
+        matching the name or NSEC3 covering the next closer name.
+        """
+        return self.proof[0]
+
+
+class BoundedCache(rfc8198.BoundedCache, Cache):
+    """
+    Bounded variant of NSEC3 cache, synthesized answer counts as use
+    of all NSEC3 entries in the proof.
+    """
+    def _weight(self, name, rrtype, data):
+        if self.by_bytes and rrtype == dns.rdatatype.NSEC3:
+            # hash algorithm, flags, iterations, salt, next hash and type bitmap
+            rdata_size = 5 + len(self.hasher.salt) + 21 + rfc8198._bitmap_size(data['types'])
+            return rfc2308.estimate_size(name, rrtype, rdata_size)
+        return super()._weight(name, rrtype, data)
+
+    def _get_rrtype(self, name, rrtype):
+        result = Cache._get_rrtype(self, name, rrtype)
+        for key in self.proof:
+            self.policy.access(key)
+        return result
+
+
+class Resolver(rfc8198.Resolver):
+    def __init__(self, auth, cache=None, latency=None, **options):
+        super().__init__(auth, cache if cache is not None else Cache(), latency, **options)
+        # validator learns hash parameters from NSEC3 records of the zone
+        self.cache.hasher = HashMemo(auth.iterations, auth.salt, auth.origin)
+
+    def partition(self, name):
+        """
+        Every NXDOMAIN proof uses NSEC3 of the closest encloser and of
+        the wildcard, so the namespace cannot be split.
+        """
+        return 0
+
+
+class Authoritative(rfc4035.Authoritative):
+    DERIVED = ('hasher', 'hashed', 'chain', 'owners', 'types', 'children')
+
+    def __init__(self, rootdb, zonedir=None, iterations=ITERATIONS, salt=SALT):
+        """
+        iterations and salt are used to hash zone signed with NSEC,
+        NSEC3 zones keep parameters from NSEC3PARAM
+        """
+        self.iterations, self.salt = iterations, salt  # used by _derive()
+        super().__init__(rootdb, zonedir, iterations, salt)
+
+    def _derive(self):
+        zone = self.zone
+        if zone.nsec3:
+            self.iterations, self.salt = zone.nsec3param or (self.iterations, self.salt)
+            self.origin = next(iter(zone.nsec3)).parent()
+        else:
+            self.origin = dns.name.root
+        self.hasher = HashMemo(self.iterations, self.salt, self.origin)
+        if zone.nsec3:
+            self.hashed = self.types = self.children = None
+            self.chain = {canonical.key(owner): (canonical.key(nxt), types)
+                          for owner, (nxt, types) in zone.nsec3.items()}
+        else:
+            self.hashed = {}  # name key -> owner key, names of later zone versions are hashed once
+            self.types = {}  # name -> type mask of names in chain, 0 for empty non-terminals
+            self.children = collections.defaultdict(set)  # zone names and their ancestors
+            for name in zone.nodes:
+                self._link(name)
+            self.chain = self._hash_zone()
+        self.owners = sorted(self.chain)  # owner keys in hash order
+
+    def _update(self, diff):
+        """
+        Update NSEC3 chain from diff of NSEC3 records or, if the zone is
+        hashed by simulator, only at names the diff touches.
+        """
+        super()._update(diff)
+        if self.hashed is not None:
+            self._rehash(diff)
+            return
+        for owner in diff.deleted['nsec3']:
+            owner = canonical.key(owner)
+            del self.chain[owner]
+            del self.owners[bisect.bisect_left(self.owners, owner)]
+        for owner, (nxt, types) in diff.added['nsec3'].items():
+            owner = canonical.key(owner)
+            self.chain[owner] = (canonical.key(nxt), types)
+            bisect.insort(self.owners, owner)
+
+    def _rehash(self, diff):
+        """
+        Patch chain of hashed zone: names deleted or added by diff, their
+        ancestors (empty non-terminals) and names below delegations which
+        appeared or disappeared get their type mask again, owners which
+        enter or leave the chain are hashed and put in order with bisect.
+        """
+        zone = self.zone
+        touched = set()
+        for table in ('nodes', 'ns'):
+            for entries in (diff.deleted[table], diff.added[table]):
+                for name in entries:
+                    touched.update(self._ancestors(name))
+        for name in diff.added['nodes']:
+            self._link(name)
+        for name in diff.deleted['nodes']:
+            self._unlink(name)
+        for cut in set(diff.deleted['ns']).symmetric_difference(diff.added['ns']):
+            stack = [cut]
+            while stack:  # occlusion of everything below changed
+                children = self.children.get(stack.pop(), ())
+                touched.update(children)
+                stack.extend(children)
+
+        cuts = set(zone.ns) - {self.origin}
+        masks = {}  # name -> new mask or None if it leaves the chain
+        for name in sorted(touched, key=len, reverse=True):  # children are decided first
+            node = zone.nodes.get(name)
+            if self._occluded(name, cuts):
+                mask = None
+            elif node is not None:
+                mask = self._mask(node)
+            elif name == self.origin or any(
+                    (masks[child] if child in masks else self.types.get(child)) is not None
+                    for child in self.children.get(name, ())):
+                mask = 0
+            else:
+                mask = None
+            if mask != self.types.get(name):
+                masks[name] = mask
+
+        relink = set()  # owners whose next owner may have changed
+        for name, mask in masks.items():
+            owner = self._hash(canonical.key(name))
+            if mask is None:
+                del self.types[name]
+                del self.chain[owner]
+                idx = bisect.bisect_left(self.owners, owner)
+                del self.owners[idx]
+                relink.add(self.owners[idx - 1])
+            elif name not in self.types:
+                self.types[name] = mask
+                self.chain[owner] = (None, mask)
+                bisect.insort(self.owners, owner)
+                relink.add(owner)
+                relink.add(self.owners[bisect.bisect_left(self.owners, owner) - 1])
+            else:
+                self.types[name] = mask
+                self.chain[owner] = (self.chain[owner][0], mask)
+        owners = self.owners
+        for owner in relink:
+            if owner in self.chain:
+                idx = bisect.bisect_left(owners, owner)
+                self.chain[owner] = (owners[(idx + 1) % len(owners)], self.chain[owner][1])
+
+    def _ancestors(self, name):
+        """
+        name and its ancestors up to origin.
+        """
+        result = [name]
+        while name != self.origin:
+            name = name.parent()
+            result.append(name)
+        return result
+
+    def _link(self, name):
+        while name != self.origin:
+            parent = name.parent()
+            if name in self.children[parent]:
+                return
+            self.children[parent].add(name)
+            name = parent
+
+    def _unlink(self, name):
+        """
+        Forget name deleted from zone and ancestors left without descendants.
+        """
+        while name != self.origin and name not in self.zone.nodes and not self.children.get(name):
+            self.children.pop(name, None)
+            parent = name.parent()
+            self.children[parent].discard(name)
+            name = parent
+
+    @staticmethod
+    def _mask(node):
+        mask = sum(1 << rrtype for rrtype in node if rrtype != dns.rdatatype.NSEC)
+        return mask | 1 << dns.rdatatype.RRSIG
+
+    def _hash_zone(self):
+        """
+        NSEC3 chain of zone tables: owner key -> (next owner key, types).
+        Names below delegations are not hashed, empty non-terminals are.
+        """
+        cuts = set(self.zone.ns) - {self.origin}
+        types = self.types
+        types.clear()
+        for name, node in self.zone.nodes.items():
+            if self._occluded(name, cuts):
+                continue
+            types[name] = self._mask(node)
+            while name != self.origin:
+                name = name.parent()
+                types.setdefault(name, 0)
+        hashed = sorted((self._hash(canonical.key(name)), mask) for name, mask in types.items())
+        return {owner: (hashed[(idx + 1) % len(hashed)][0], mask)
+                for idx, (owner, mask) in enumerate(hashed)}
+
+    def _hash(self, key):
+        owner = self.hashed.get(key)
+        if owner is None:
+            owner = self.hashed[key] = self.hasher.compute(key)
+        return owner
+
+    def _occluded(self, name, cuts):
+        """
+        True if name is below delegation.
+        """
+        while name != self.origin:
+            name = name.parent()
+            if name in cuts:
+                return True
+        return False
+
+    def _record(self, owner):
+        nxt, types = self.chain[owner]
+        return {(canonical.to_name(owner), dns.rdatatype.NSEC3):
+                {"ttl": self.neg_ttl, "next": nxt, "types": types}}
+
+    def _covering(self, hashed):
+        return self.owners[bisect.bisect_right(self.owners, hashed) - 1]  # -1 wraps around
+
+    def _gen_nxdomain(self, name):
+        """
+        Closest encloser proof and NSEC3 covering wildcard.
+        """
+        key = canonical.key(name)
+        hashed = self.hasher.owner(key)
+        if hashed in self.chain:  # empty non-terminal
+            return (dns.rcode.NOERROR, self._record(hashed))
+        keys = ancestors(key)
+        for depth in range(len(keys) - 2, -1, -1):
+            encloser = self.hasher.owner(keys[depth])
+            if encloser in self.chain:
+                break
+        else:  # outside of zone
+            return super()._gen_nxdomain(name)
+        answers = self._record(encloser)
+        answers.update(self._record(self._covering(self.hasher.owner(keys[depth + 1]))))
+        wildcard = self.hasher.owner(_wildcard(keys[depth]))
+        if wildcard not in self.chain:
+            answers.update(self._record(self._covering(wildcard)))
+        return (dns.rcode.NXDOMAIN, answers)
+
+    def _gen_nodata(self, name, rrtype):
+        hashed = self.hasher.owner(canonical.key(name))
+        if hashed not in self.chain:  # occluded name, e.g. glue
+            return super()._gen_nodata(name, rrtype)
+        return (dns.rcode.NOERROR, self._record(hashed))
@@ -2,7 +2,11 @@ import bisect
 
 import dns.rdatatype
 
+import canonical
+from ordered import SortedList
+import rfc2308
 import rfc4035
+import zoneindex
 
 """
 Simulate RFC 8198 cache, resolver, and auth.
@@ -12,11 +16,32 @@ Cache exact match + negative caching.
 Auth now sends relevant NSECs
 """
 
+class NsecEntry(object):
+    """
+    Cached NSEC: expiration time, next owner name, bitmask of RR types
+    """
+    __slots__ = ('ttl', 'next', 'types')
+
+    def __init__(self, ttl, next, types):
+        self.ttl = ttl
+        self.next = next
+        self.types = types
+
+    def has_type(self, rrtype):
+        return (self.types >> rrtype) & 1
+
+
 class Cache(rfc4035.Cache):
-    def __init__(self):
-        super().__init__()
-        self.ordering = []  # ordered list of owner names
-        # self.storage is dict of owner name -> dict of values
+    def __init__(self, reclaim=False):
+        super().__init__(reclaim)
+        # names are represented by canonical.key() so they compare as bytes
+        self.ordering = SortedList()  # owner keys in canonical order
+        self.answered = None  # POSITIVE, NXDOMAIN or NODATA proven by the last hit
+        # self.storage is dict of owner key -> dict rrtype -> expiration time,
+        # NSEC is stored as NsecEntry with next owner as key
+
+    def footprint(self):
+        return super().footprint() + rfc2308._deep_sizeof(self.ordering, set())
 
     def get_name(self, name):
         raise NotImplementedError('use prove_name_nonexistence()')
@@ -28,49 +53,98 @@ class Cache(rfc4035.Cache):
         """
         cache information for one RR type
         """
+        expires = self.now + data['ttl']
         if rrtype == dns.rdatatype.NSEC:
             assert data.keys() == {'ttl', 'next', 'types'}
+            entry = NsecEntry(expires, data['next'], data['types'])
         else:
             assert data.keys() == {'ttl'}
-        data['ttl'] += self.now
+            entry = expires
 
         if name not in self.storage:
-            # add name into ordered sequence
-            ridx = bisect.bisect_right(self.ordering, name)
-            self.ordering.insert(ridx, name)
+            self.ordering.add(name)
 
-        self.storage.setdefault(name, {})[rrtype] = data
+        node = self.storage.setdefault(name, {})
+        if rrtype not in node:
+            self.entries += 1
+        node[rrtype] = entry
+        self._schedule(name, rrtype, expires)
+        self._track(name, rrtype, data['ttl'])
+
+    def _expires(self, name, rrtype):
+        try:
+            entry = self.storage[name][rrtype]
+        except KeyError:
+            return None
+        return entry.ttl if rrtype == dns.rdatatype.NSEC else entry
 
     def get_rrtype(self, name, rrtype):
+        """
+        Returns rfc2308.POSITIVE, NODATA (matching NSEC) or SYNTHESIZED
+        (NXDOMAIN from covering NSEC), raises KeyError on miss.
+        """
         try:
-            self._get_rrtype(name, rrtype)
-            self.hit += 1
+            outcome = self._get_rrtype(name, rrtype)
         except KeyError:
             self.miss += 1
             raise
+        self.hit += 1
+        return outcome
 
     def _get_rrtype(self, name, rrtype):
         if name not in self.storage:
-            return self.prove_name_nonexistence(name)
+            self.prove_name_nonexistence(name)
+            self.answered = rfc2308.NXDOMAIN  # covering NSEC
+            return rfc2308.SYNTHESIZED
 
         node = self.storage[name]
         if rrtype in node:
-            data = node[rrtype]
-            if data['ttl'] < self.now:
+            expires = node[rrtype]
+            if rrtype == dns.rdatatype.NSEC:
+                expires = expires.ttl
+            if expires < self.now and not self._usable(expires):
                 raise KeyError('expired')
-                # we assume static data so we do not need to check NSECs
+                # unexpired data is used even if zone changed meanwhile,
+                # Resolver counts such answers as inconsistent
             else:
-                return True
+                self.answered = rfc2308.POSITIVE
+                return rfc2308.POSITIVE
 
         # RR type not found at node, check NSEC
         assert rrtype != dns.rdatatype.NSEC
         nsec = node[dns.rdatatype.NSEC]
-        if nsec['ttl'] < self.now:
+        if nsec.ttl < self.now and not self._usable(nsec.ttl):
             raise KeyError('NSEC expired')
-        if rrtype in nsec['types']:
+        if nsec.has_type(rrtype):
             raise KeyError('RR type not in cache but exists')
         else:
-            return True  # non-existence was proven, do not query
+            self.answered = rfc2308.NODATA  # matching NSEC
+            return rfc2308.NODATA  # non-existence of type was proven, do not query
+
+    def remove(self, name, rrtype):
+        """
+        drop one entry from cache, name without entries leaves ordering
+        """
+        if self.ttls is not None:
+            self.ttls.pop((name, rrtype), None)
+        node = self.storage[name]
+        del node[rrtype]
+        self.entries -= 1
+        if not node:
+            del self.storage[name]
+            self.ordering.remove(name)
+
+    def entry(self, name, rrtype):
+        """
+        Key of entry which answers (name, rrtype) after a hit:
+        exact entry or NSEC of the name or of its predecessor.
+        """
+        node = self.storage.get(name)
+        if node is None:
+            return (self.prev_name(name), dns.rdatatype.NSEC)
+        if rrtype in node:
+            return (name, rrtype)
+        return (name, dns.rdatatype.NSEC)
 
     def prev_name(self, name):
         """
@@ -79,8 +153,7 @@ class Cache(rfc4035.Cache):
         Raises: IndexError if such name is not present in cache.
         """
         assert name not in self.storage
-        ridx = bisect.bisect_right(self.ordering, name)
-        return self.ordering[ridx - 1]
+        return self.ordering.floor(name)
 
     def prove_name_nonexistence(self, name):
         """
@@ -93,28 +166,64 @@ class Cache(rfc4035.Cache):
             raise KeyError('no predecesor found in cache')
         pnode = self.storage[pname]
         nsec = pnode[dns.rdatatype.NSEC]
-        if nsec['ttl'] < self.now:
+        if nsec.ttl < self.now and not self._usable(nsec.ttl):
             raise KeyError('expired')
-        if nsec['next'] > name:
+        if nsec.next > name:
             assert pname < name
             return True
         else:
             raise KeyError('covering NSEC not found')
 
 
+class BoundedCache(rfc4035.BoundedCache, Cache):
+    """
+    Bounded variant of RFC 8198 cache.
+
+    Entry is (owner, rrtype); hits synthesized from NSEC count as use
+    of the NSEC entry. Evicted owners without entries leave ordering.
+    """
+    def _weight(self, name, rrtype, data):
+        if not self.by_bytes:
+            return 1
+        if rrtype == dns.rdatatype.NSEC:
+            rdata_size = canonical.wire_length(data['next']) + _bitmap_size(data['types'])
+            return rfc2308.estimate_size(name, rrtype, rdata_size)
+        return rfc2308.estimate_size(name, rrtype)
+
+    def get_rrtype(self, name, rrtype):
+        # skip exact-match bookkeeping from rfc2308.BoundedCache
+        return Cache.get_rrtype(self, name, rrtype)
+
+    def _get_rrtype(self, name, rrtype):
+        result = super()._get_rrtype(name, rrtype)
+        self.policy.access(self.entry(name, rrtype))
+        return result
+
+
 class Resolver(rfc4035.Resolver):
-    def __init__(self, auth):
-        super().__init__(auth)
-        self.cache = Cache()
+    def __init__(self, auth, cache=None, latency=None, **options):
+        super().__init__(auth, cache if cache is not None else Cache(), latency, **options)
 
-    def lookup(self, name, rrtype):
+    def partition(self, name):
+        """
+        Names covered by one NSEC interval share cache entries,
+        so the NSEC interval index identifies the partition.
+        """
+        return bisect.bisect_right(self.auth.nsecs, canonical.key(name)) - 1
+
+    def _key(self, name):
         assert name.is_absolute()
-        name = name.canonicalize()
-        try:
-            return self.cache.get_rrtype(name, rrtype)
-        except KeyError:
-            rcode, answers = self.auth.query(name, rrtype)
-            self._store_answers(answers)
+        return canonical.key(name)
+
+    def _resolve(self, name, rrtype):
+        rcode, answers = self.auth.query(name, rrtype)
+        self._store_answers(answers)
+
+    def _outcome(self, name, rrtype, outcome):
+        if self.auth.zone.diffs and rfc2308.contradicts(self.auth.zone.nodes.get(name), rrtype,
+                                                         self.cache.answered):
+            self.inconsistent += 1
+        return outcome
 
     def _store_answers(self, answers):
         for owner, data in answers.items():
@@ -123,69 +232,53 @@ class Resolver(rfc4035.Resolver):
             if rrtype == dns.rdatatype.NSEC:
                 assert 'next' in data
                 assert 'types' in data
-            self.cache.put_rrtype(name, rrtype, data)
+            self.cache.put_rrtype(canonical.key(name), rrtype, data)
 
 
 class Authoritative(rfc4035.Authoritative):
-    def __init__(self, rootdb):
-        super().__init__(rootdb)
-        self.nsecs = [name.canonicalize()
-                      for name, node in self.rootzone.nodes.items()
-                      if node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.NSEC)]
-        self.nsecs.sort()
+    DERIVED = ('nsecs',)
+
+    def _derive(self):
+        # canonical keys of NSEC owners, same order as self.zone.nsecs
+        self.nsecs = [canonical.key(name) for name in self.zone.nsecs]
+
+    def _update(self, diff):
+        super()._update(diff)
+        for owner in diff.deleted['nsec']:
+            del self.nsecs[bisect.bisect_left(self.nsecs, canonical.key(owner))]
+        for owner in diff.added['nsec']:
+            bisect.insort(self.nsecs, canonical.key(owner))
 
     def _gen_nxdomain(self, name):
         """
         Generate answer containing NSEC from owner name "on the left"
         from given name.
         """
-        ridx = bisect.bisect_right(self.nsecs, name)  # right next to wanted name
+        ridx = bisect.bisect_right(self.nsecs, canonical.key(name))  # right next to wanted name
         lidx = ridx - 1  # this is easier than bisect_left + its corner cases
-        lname = self.nsecs[lidx]  # name on the left from the wanted name
-        lnode = self.rootzone[lname]
-        lnsec_rrs = lnode.find_rdataset(dns.rdataclass.IN, dns.rdatatype.NSEC)
-        assert len(lnsec_rrs) == 1
-        lnsec = lnsec_rrs[0]
+        lname = self.zone.nsecs[lidx]  # name on the left from the wanted name
+        nxt, types = self.zone.nsec[lname]
         answers = {(lname, dns.rdatatype.NSEC):
                     {"ttl": self.neg_ttl,
-                     "next": lnsec.next,
-                     "types": _bitmap_to_set(lnsec.windows)}}
+                     "next": canonical.key(nxt),
+                     "types": types}}
         return (dns.rcode.NXDOMAIN, answers)
 
     def _gen_nodata(self, name, rrtype):
-        node = self.rootzone[name]
-        nsec_rrs = node.find_rdataset(dns.rdataclass.IN, dns.rdatatype.NSEC)
-        nsec = nsec_rrs[0]
+        nxt, types = self.zone.nsec[name]
         answers = {}
         answers[(name, dns.rdatatype.NSEC)] = {"ttl": self.neg_ttl,
-                                               "next": nsec.next,
-                                               "types": _bitmap_to_set(nsec.windows)}
+                                               "next": canonical.key(nxt),
+                                               "types": types}
         return (dns.rcode.NOERROR, answers)
 
 
-    def _gen_noerror(self, name, rrtype, ttl):
-        rcode, answers = super()._gen_noerror(name, rrtype, ttl)
-        if rrtype == dns.rdatatype.NS:
-            # add DS if it exists
-            node = self.rootzone[name]
-            try:
-                ds_rrs = node.find_rdataset(dns.rdataclass.IN, dns.rdatatype.DS)
-                answers[(name, dns.rdatatype.DS)] = {'ttl': ds_rrs.ttl}
-            except KeyError:
-                pass
-        return (rcode, answers)
-
-
-def _bitmap_to_set(bitmap_windows):
+def _bitmap_size(types):
     """
-    Convert dnspython's list of NSEC windows to set of RR type numbers.
+    Size of NSEC type bitmap encoding given bitmask of RR types.
     """
-    types = set()
-    for (window, bitmap) in bitmap_windows:
-        bits = []
-        for i in range(0, len(bitmap)):
-            byte = bitmap[i]
-            for j in range(0, 8):
-                if byte & (0x80 >> j):
-                    types.add(window * 256 + i * 8 + j)
-    return types
+    windows = {}
+    for rrtype in zoneindex.mask_to_types(types):
+        window, low = divmod(rrtype, 256)
+        windows[window] = max(windows.get(window, 0), low)
+    return sum(2 + low // 8 + 1 for low in windows.values())
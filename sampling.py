@@ -0,0 +1,152 @@
+"""
+Approximate replay of spatially sampled queries (SHARDS).
+
+Sampler is a prefilter in front of any Resolver: a query is passed on only
+if hash of Resolver.partition() of its name falls under rate * 2^64.
+Partition is the unit of cache independence (name for exact-match caches,
+NSEC interval for rfc8198), so sampled partitions are simulated exactly
+as in full replay. Bounded caches have to be scaled down by the same rate,
+see scale_bounds().
+
+Hit ratio is estimated as sampled hits / sampled queries and counters are
+scaled to all queries seen. Partitions are clusters of queries,
+the 95% confidence interval comes from the variance of ratio estimator
+under Bernoulli cluster sampling:
+    var = (1 - rate) * sum((hits_i - ratio * queries_i)^2) / sampled^2
+The interval is reliable only if no partition carries a large share of
+queries. NSEC intervals are coarse, e.g. random subdomain names often
+fall into one interval, so check rfc8198 estimates with several seeds.
+"""
+
+import math
+
+import qlog2cache
+
+_MASK64 = (1 << 64) - 1
+FIELDS = ['hit', 'miss', 'auth', 'hit_ratio', 'ci95']
+
+
+def _mix(value):
+    """
+    splitmix64 finalizer, spreads consecutive partition numbers uniformly
+    """
+    value = (value + 0x9e3779b97f4a7c15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return value ^ (value >> 31)
+
+
+def scale_bounds(bounds, rate):
+    """
+    Capacity limit for cache which sees only given fraction of partitions.
+    """
+    scaled = dict(bounds)
+    for limit in ('max_entries', 'max_bytes'):
+        if scaled.get(limit) is not None:
+            scaled[limit] = max(1, int(scaled[limit] * rate))
+    return scaled
+
+
+class Sampler(object):
+    def __init__(self, resolver, rate, seed=0):
+        assert 0 < rate <= 1
+        self.resolver = resolver
+        self.rate = rate
+        self.threshold = int(rate * (1 << 64))
+        self.seed = seed
+        self.queries = 0  # all queries seen
+        self.sampled = 0
+        self.hits = 0  # hits among sampled queries
+        self.clusters = {}  # partition -> [queries, hits]
+        # sums over clusters for variance: queries^2, hits*queries, hits^2
+        self.sum_nn = 0
+        self.sum_hn = 0
+        self.sum_hh = 0
+
+    @property
+    def cache(self):
+        return self.resolver.cache
+
+    @property
+    def auth(self):
+        return self.resolver.auth
+
+    def set_reltime(self, reltime):
+        self.resolver.set_reltime(reltime)
+
+    def partition(self, name):
+        return self.resolver.partition(name)
+
+    def is_sampled(self, partition):
+        return _mix((partition ^ self.seed) & _MASK64) < self.threshold
+
+    def lookup(self, name, rrtype):
+        self.queries += 1
+        partition = self.resolver.partition(name)
+        if not self.is_sampled(partition):
+            return
+        cache = self.resolver.cache
+        before = cache.hit
+        self.resolver.lookup(name, rrtype)
+        hit = cache.hit - before
+
+        cluster = self.clusters.get(partition)
+        if cluster is None:
+            cluster = self.clusters[partition] = [0, 0]
+        queries, hits = cluster
+        self.sum_nn += 2 * queries + 1
+        self.sum_hn += hits + hit * (queries + 1)
+        self.sum_hh += hit * (2 * hits + 1)
+        cluster[0] = queries + 1
+        cluster[1] = hits + hit
+        self.sampled += 1
+        self.hits += hit
+
+    def estimate(self):
+        """
+        Returns (hit, miss, auth, hit ratio, half-width of 95% confidence interval)
+        scaled to all queries seen, or None if nothing was sampled yet.
+        """
+        if not self.sampled:
+            return None
+        ratio = self.hits / self.sampled
+        variance = (1 - self.rate) * max(0, self.sum_hh - 2 * ratio * self.sum_hn
+                                         + ratio * ratio * self.sum_nn) / self.sampled ** 2
+        scale = self.queries / self.sampled
+        hit = round(self.hits * scale)
+        return (hit, self.queries - hit, round(self.resolver.auth.queries * scale),
+                ratio, 1.96 * math.sqrt(variance))
+
+
+def wrap(resolvers, rate, seed=0):
+    """
+    Put Sampler in front of each resolver from qlog2cache.load_policies().
+    """
+    for name, res in resolvers.items():
+        resolvers[name] = Sampler(res, rate, seed)
+    return resolvers
+
+
+def _counters(sampler):
+    estimate = sampler.estimate()
+    if estimate is None:
+        return (0, 0, 0, '', '')
+    hit, miss, auth, ratio, ci = estimate
+    return (hit, miss, auth, '{:.6f}'.format(ratio), '{:.6f}'.format(ci))
+
+
+def replay(queries, samplers, out):
+    """
+    Same as qlog2cache.replay() but with estimated counters,
+    hit ratio and its confidence interval.
+    """
+    prevtime = 0
+    report = qlog2cache.Report(out, samplers, FIELDS)
+    for now, qname, rrtype in queries:
+        for sampler in samplers.values():
+            sampler.set_reltime(now)
+            sampler.lookup(qname, rrtype)
+
+        if now - prevtime >= 3600:
+            prevtime = int(now / 3600) * 3600
+            report.write(now, [_counters(sampler) for sampler in samplers.values()])
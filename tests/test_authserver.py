@@ -0,0 +1,117 @@
+import asyncio
+import os.path
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdatatype
+
+import authserver
+import rfc8198
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+N = dns.name.from_text
+
+def ask(server, name, rrtype, limit=None, **kwargs):
+    query = dns.message.make_query(name, rrtype, **kwargs)
+    wire = server.answer(query.to_wire(), limit)
+    response = dns.message.from_wire(wire)
+    assert response.id == query.id
+    assert response.question == query.question
+    return response
+
+def test_answers():
+    """answer, referral, NODATA and NXDOMAIN with DNSSEC records"""
+    server = authserver.Server(ZONE)
+    response = ask(server, '.', 'SOA', want_dnssec=True)
+    assert response.flags & dns.flags.AA
+    assert [rrset.rdtype for rrset in response.answer] == [dns.rdatatype.SOA, dns.rdatatype.RRSIG]
+
+    response = ask(server, 'www.test.', 'A', want_dnssec=True)
+    assert not response.flags & dns.flags.AA
+    assert [(rrset.name, rrset.rdtype) for rrset in response.authority] == [
+        (N('test.'), dns.rdatatype.NS), (N('test.'), dns.rdatatype.DS), (N('test.'), dns.rdatatype.RRSIG)]
+
+    response = ask(server, 'test.', 'DS')
+    assert response.flags & dns.flags.AA and response.answer[0].rdtype == dns.rdatatype.DS
+
+    response = ask(server, '.', 'TXT', want_dnssec=True)
+    assert response.rcode() == dns.rcode.NOERROR and not response.answer
+    assert response.authority[0].ttl == server.auth.neg_ttl
+    assert N('.') in [rrset.name for rrset in response.authority if rrset.rdtype == dns.rdatatype.NSEC]
+
+def test_nsec_matches_simulator():
+    """NXDOMAIN carries the NSEC simulated auth sends"""
+    server = authserver.Server(ZONE)
+    auth = rfc8198.Authoritative(ZONE)
+    for name in ['nonexistent.', 'tesu.', 'zzz.', 'a.', 'x.y.nonexistent.']:
+        response = ask(server, name, 'A', want_dnssec=True)
+        assert response.rcode() == dns.rcode.NXDOMAIN
+        rcode, answers = auth.query(N(name), dns.rdatatype.A)
+        assert rcode == dns.rcode.NXDOMAIN
+        owners = {rrset.name for rrset in response.authority if rrset.rdtype == dns.rdatatype.NSEC}
+        assert {owner for owner, _ in answers} <= owners
+
+def test_cached_response():
+    """cached response keeps ID, RD and case of the query, truncation sets TC"""
+    server = authserver.Server(ZONE)
+    first = ask(server, 'test.', 'NS', want_dnssec=True)
+    response = ask(server, 'TeSt.', 'NS', want_dnssec=True)
+    assert len(server.cache) == 1
+    assert response.question[0].name.labels[0] == b'TeSt'
+    assert response.authority == first.authority
+
+    query = dns.message.make_query('test.', 'NS', want_dnssec=True)
+    query.flags &= ~dns.flags.RD
+    response = dns.message.from_wire(server.answer(query.to_wire()))
+    assert not response.flags & dns.flags.RD
+    assert len(server.cache) == 1
+
+    response = ask(server, 'test.', 'NS', limit=100, want_dnssec=True)
+    assert response.flags & dns.flags.TC and not response.authority
+    assert response.ednsflags & dns.flags.DO
+    assert server.truncated == 1
+    assert server.queries == 4
+
+def test_shapes():
+    """names with the same proof share rendered sections"""
+    server = authserver.Server(ZONE)
+    first = ask(server, 'www.test.', 'A', want_dnssec=True)
+    second = ask(server, 'ftp.test.', 'A', want_dnssec=True)
+    assert first.authority == second.authority and first.additional == second.additional
+    assert len(server.shapes) == 1 and len(server.cache) == 2
+    for name in ['x1.', 'y22.', 'zzzz.']:
+        response = ask(server, name, 'A')
+        assert response.rcode() == dns.rcode.NXDOMAIN and response.flags & dns.flags.AA
+    assert len(server.shapes) == 4  # one per question length
+    long_name = '.'.join(['a' * 63] * 3) + '.bbbbbb.'
+    assert ask(server, long_name, 'A').rcode() == dns.rcode.NXDOMAIN
+
+def test_garbage():
+    server = authserver.Server(ZONE)
+    assert server.answer(b'\x00\x01') is None
+    response = ask(server, 'test.', 'NS')
+    assert server.answer(response.to_wire()) is None  # responses are dropped
+    assert server.dropped == 2
+
+def test_udp_tcp():
+    server = authserver.Server(ZONE)
+
+    async def exchange():
+        transport, tcp, port = await authserver.start(server, '127.0.0.1', 0)
+        loop = asyncio.get_running_loop()
+        query = dns.message.make_query('test.', 'NS', want_dnssec=True)
+        try:
+            udp = await loop.run_in_executor(None, dns.query.udp, query, '127.0.0.1', 2, port)
+            tcp_response = await loop.run_in_executor(None, dns.query.tcp, query, '127.0.0.1', 2, port)
+        finally:
+            transport.close()
+            tcp.close()
+            await tcp.wait_closed()
+        return udp, tcp_response
+
+    udp, tcp_response = asyncio.run(exchange())
+    assert udp.to_wire() == tcp_response.to_wire()
+    assert (server.queries, server.udp, server.tcp) == (2, 1, 1)
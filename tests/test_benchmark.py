@@ -0,0 +1,78 @@
+import dns.name
+import dns.rdatatype
+
+import benchmark
+import qlog2cache
+import zoneindex
+
+def test_synthetic_zone(tmpdir):
+    """delegations with glue are chained by NSEC in canonical order"""
+    path = str(tmpdir.join('synth.zone'))
+    benchmark.synthetic_zone(path, 50)
+    zone = zoneindex.load(path)
+    assert len(zone.ns) == 51 and len(zone.nsec) == 51
+    assert len(zone.nodes) == 51 + 100  # glue is not in NSEC chain
+    owner = dns.name.root
+    for _ in range(51):
+        owner = zone.nsec[owner][0]
+    assert owner == dns.name.root
+    assert sum(dns.rdatatype.DS in node for node in zone.nodes.values()) == 25
+
+def test_query_log(tmpdir):
+    zonefile = str(tmpdir.join('synth.zone'))
+    benchmark.synthetic_zone(zonefile, 50)
+    zone = zoneindex.load(zonefile)
+    logfile = str(tmpdir.join('queries.log'))
+    benchmark.query_log(logfile, zone, 1000)
+    with open(logfile, 'rb') as f:
+        queries = list(qlog2cache.read_queries_fast(f))
+    assert len(queries) == 1000 and queries[-1][0] == 999 // benchmark.QPS
+    existing = sum(name in zone.nodes for _, name, _ in queries)
+    assert 500 < existing < 700
+
+def test_measure(tmpdir):
+    zonefile = str(tmpdir.join('synth.zone'))
+    benchmark.synthetic_zone(zonefile, 50)
+    logfile = str(tmpdir.join('queries.log'))
+    benchmark.query_log(logfile, zoneindex.load(zonefile), 500)
+    for stage, params in [('parse', (logfile, True)), ('zone', (zonefile, 'rfc2308')),
+                          ('lookup', (zonefile, 'rfc8198', logfile))]:
+        result = benchmark.measure(stage, params, repeat=1)
+        assert result['ops'] == (1 if stage == 'zone' else 500)
+        assert result['ops_per_s'] > 0 and result['peak_rss_kb'] > 0
+        assert result['peak_alloc_bytes_per_op'] >= max(result['alloc_bytes_per_op'], 0)
+        assert 0 <= result['rss_growth_kb'] <= result['peak_rss_kb']
+
+def test_compare():
+    """slower or bigger case beyond threshold is regression"""
+    base = {'results': {'a': {'ops_per_s': 100.0, 'peak_rss_kb': 1000},
+                        'b': {'ops_per_s': 100.0, 'peak_rss_kb': 1000},
+                        'c': {'ops_per_s': 100.0, 'peak_rss_kb': 1000}}}
+    new = {'results': {'a': {'ops_per_s': 95.0, 'peak_rss_kb': 1050},
+                       'b': {'ops_per_s': 80.0, 'peak_rss_kb': 1000},
+                       'c': {'ops_per_s': 100.0, 'peak_rss_kb': 1200},
+                       'd': {'ops_per_s': 1.0, 'peak_rss_kb': 1}}}
+    lines = benchmark.compare(base, new, 0.1)
+    assert [line.split()[0] for line, _ in lines] == ['a', 'b', 'c']
+    assert [regression for _, regression in lines] == [False, True, True]
+
+def test_compare_growth():
+    """RSS growth is compared when both results have it"""
+    base = {'results': {'a': {'ops_per_s': 100.0, 'peak_rss_kb': 1000, 'rss_growth_kb': 10000},
+                        'b': {'ops_per_s': 100.0, 'peak_rss_kb': 1000},
+                        'c': {'ops_per_s': 100.0, 'peak_rss_kb': 1000, 'rss_growth_kb': 0}}}
+    new = {'results': {'a': {'ops_per_s': 100.0, 'peak_rss_kb': 1000, 'rss_growth_kb': 15000},
+                       'b': {'ops_per_s': 100.0, 'peak_rss_kb': 1050, 'rss_growth_kb': 500},
+                       'c': {'ops_per_s': 100.0, 'peak_rss_kb': 1000, 'rss_growth_kb': 0}}}
+    lines = benchmark.compare(base, new, 0.1)
+    assert [regression for _, regression in lines] == [True, False, False]
+
+def test_compare_zero_growth():
+    """few pages over 0 kB baseline are noise, growth beyond MIN_RSS_KB is not"""
+    base = {'results': {'a': {'ops_per_s': 100.0, 'peak_rss_kb': 1000, 'rss_growth_kb': 0},
+                        'b': {'ops_per_s': 100.0, 'peak_rss_kb': 1000, 'rss_growth_kb': 0}}}
+    new = {'results': {'a': {'ops_per_s': 100.0, 'peak_rss_kb': 1000, 'rss_growth_kb': 4},
+                       'b': {'ops_per_s': 100.0, 'peak_rss_kb': 1000,
+                             'rss_growth_kb': benchmark.MIN_RSS_KB}}}
+    lines = benchmark.compare(base, new, 0.1)
+    assert [regression for _, regression in lines] == [False, True]
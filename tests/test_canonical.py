@@ -0,0 +1,25 @@
+import random
+
+import dns.name
+
+import canonical
+
+def test_key_order():
+    """keys sort in the same order as dns.name.Name"""
+    rnd = random.Random(1)
+    alphabet = [b'a', b'B', b'z', b'-', b'\x00', b'\x01', b'\xff', b'0']
+    names = [dns.name.root]
+    for _ in range(500):
+        labels = [b''.join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 3)))
+                  for _ in range(rnd.randint(1, 3))]
+        names.append(dns.name.Name(labels + [b'']))
+    assert sorted(names) == sorted(names, key=canonical.key)
+    for name in names:
+        key = canonical.key(name)
+        assert canonical.to_name(key) == name
+        assert canonical.wire_length(key) == len(name.to_digestable())
+
+def test_key_case():
+    assert canonical.key(dns.name.from_text('WWW.Example.')) == canonical.key(dns.name.from_text('www.example.'))
+    assert canonical.key(dns.name.root) == b''
+    assert canonical.key(dns.name.from_text('a.b.')) == b'b\x00\x00a\x00\x00'
@@ -0,0 +1,97 @@
+import io
+import itertools
+import os.path
+
+import dns.name
+import dns.rdatatype
+import pytest
+
+import checkpoint
+import qlog2cache
+
+TESTDIR = os.path.dirname(__file__)
+ZONE = os.path.join(TESTDIR, 'test_root.zone.signed')
+N = dns.name.from_text
+
+def queries():
+    names = [N('nonexistent{}.'.format(idx % 13)) for idx in range(7)] + [N('test.'), N('unsigned.')]
+    rrtypes = [dns.rdatatype.A, dns.rdatatype.NS, dns.rdatatype.DS]
+    return [(idx * 97, name, rrtype) for idx, (name, rrtype)
+            in enumerate(itertools.islice(zip(itertools.cycle(names), itertools.cycle(rrtypes)), 300))]
+
+def resolvers():
+    bounds = {'max_entries': 5, 'max_bytes': None, 'policy': 'arc'}
+    return qlog2cache.load_policies(['rfc2308', 'rfc8198', 'rfc5155'], ZONE, bounds, reclaim=True)
+
+def test_resume(tmpdir):
+    """resumed replay ends with the same counters"""
+    full = io.StringIO()
+    qlog2cache.replay(iter(queries()), resolvers(), full)
+
+    path = str(tmpdir.join('state.ckpt'))
+    states = []
+
+    def save(state):
+        if not states:
+            checkpoint.save(path, state)
+        states.append(state.now)
+    qlog2cache.replay(iter(queries()), resolvers(), io.StringIO(), save=save)
+    assert len(states) > 2 and not os.path.exists(path + '.tmp')
+
+    start = checkpoint.load(path, ZONE)
+    assert start.now == states[0] and start.consumed == states[0] // 97 + 1
+    resumed = io.StringIO()
+    qlog2cache.replay(iter(queries()[start.consumed:]), start.resolvers, resumed, start)
+    # time spent hashing differs between runs
+    last = [row.rsplit(',', 1)[0] for row in (full.getvalue().splitlines()[-1],
+                                              resumed.getvalue().splitlines()[-1])]
+    assert last[0] == last[1]
+    assert len(resumed.getvalue().splitlines()) == len(full.getvalue().splitlines()) - 1
+
+def test_warm(tmpdir):
+    """warm start continues after checkpoint time with new input"""
+    path = str(tmpdir.join('state.ckpt'))
+    res = resolvers()
+    qlog2cache.replay(iter(queries()[:50]), res, io.StringIO(),
+                      save=lambda state: checkpoint.save(path, state))
+    start = checkpoint.warm(checkpoint.load(path, ZONE))
+    assert (start.consumed, start.shift) == (0, 3686)
+    hits = start.resolvers['rfc8198'].cache.hit
+    assert start.resolvers['rfc8198'].cache.now - start.resolvers['rfc8198'].cache.start == 3686
+    # zone tables are shared again, not copied into checkpoint
+    assert len({id(res.auth.zone) for res in start.resolvers.values()}) == 1
+
+    out = io.StringIO()
+    shifted = ((now + start.shift, name, rrtype) for now, name, rrtype in queries()[:40])
+    qlog2cache.replay(shifted, start.resolvers, out, start)
+    assert out.getvalue().splitlines()[1].startswith('7275,')
+    assert start.resolvers['rfc8198'].cache.hit > hits
+
+def test_derived_tables(tmpdir):
+    """tables derived from zone are not stored but rebuilt on load"""
+    path = str(tmpdir.join('state.ckpt'))
+    names = ['rfc8198', 'rfc5155', 'hierarchy']
+    empty = qlog2cache.load_policies(names, ZONE)
+    checkpoint.save(path, checkpoint.State(empty))
+    assert os.path.getsize(path) < 4096
+
+    res = qlog2cache.load_policies(names, ZONE)
+    qlog2cache.replay(iter(queries()[:50] + [(5000, N('www.test.'), dns.rdatatype.A)]), res,
+                      io.StringIO())
+    checkpoint.save(path, checkpoint.State(res))
+    loaded = checkpoint.load(path, ZONE).resolvers
+    assert loaded['rfc8198'].auth.nsecs == res['rfc8198'].auth.nsecs
+    assert loaded['rfc5155'].auth.chain == res['rfc5155'].auth.chain
+    assert loaded['rfc5155'].auth.owners == res['rfc5155'].auth.owners
+    assert list(loaded['hierarchy'].auth.zones) == list(res['hierarchy'].auth.zones) != []
+    assert loaded['hierarchy'].auth.created == res['hierarchy'].auth.created
+
+def test_invalid(tmpdir):
+    path = tmpdir.join('state.ckpt')
+    path.write('garbage')
+    with pytest.raises(ValueError):
+        checkpoint.load(str(path), ZONE)
+    qlog2cache.replay(iter(queries()[:50]), resolvers(), io.StringIO(),
+                      save=lambda state: checkpoint.save(str(path), state))
+    with pytest.raises(ValueError):
+        checkpoint.load(str(path), os.path.join(TESTDIR, 'test_root.zone'))
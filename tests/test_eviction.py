@@ -0,0 +1,100 @@
+import os.path
+
+import dns.name
+import dns.rdatatype
+import pytest
+
+import canonical
+import eviction
+import rfc2308
+import rfc4035
+import rfc8198
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+
+def N(name_str):
+    return dns.name.from_text(name_str)
+
+def test_lru():
+    policy = eviction.LRU(2)
+    policy.insert('a', 1)
+    policy.insert('b', 1)
+    policy.access('a')
+    assert policy.evict() == 'b'
+    assert policy.evict() == 'a'
+
+def test_lfu():
+    policy = eviction.LFU(3)
+    for key in 'abc':
+        policy.insert(key, 1)
+    policy.access('a')
+    policy.access('a')
+    policy.access('c')
+    assert policy.evict() == 'b'
+    policy.remove('c')
+    policy.insert('d', 1)
+    assert policy.evict() == 'd'
+    assert policy.evict() == 'a'
+
+@pytest.mark.parametrize('cls', [eviction.ARC, eviction.TwoQ])
+def test_scan_resistance(cls):
+    """frequently used key survives a scan of one-time keys"""
+    policy = cls(4)
+    resident = set()
+
+    def use(key):
+        if key in resident:
+            policy.access(key)
+            return
+        policy.insert(key, 1)
+        resident.add(key)
+        while len(resident) > 4:
+            resident.remove(policy.evict())
+
+    for _ in range(3):
+        use('hot')
+        for key in range(8):
+            use('hot')
+    for key in range(100):
+        use(key)
+        use('hot')
+    assert 'hot' in resident
+
+@pytest.mark.parametrize('module', [rfc2308, rfc4035])
+def test_bounded_exact(module):
+    auth = module.Authoritative(ZONE)
+    res = module.Resolver(auth, module.BoundedCache(max_entries=2))
+    res.lookup(N('nonexistent.'), 1)
+    res.lookup(N('.'), 2)
+    res.lookup(N('nonexistent.'), 1)  # hit, . NS becomes LRU
+    assert res.cache.evictions == 0
+    res.lookup(N('nonexistent2.'), 1)
+    assert res.cache.evictions == 1
+    assert N('.') not in res.cache.storage
+    res.lookup(N('nonexistent.'), 1)
+    assert (res.cache.hit, res.cache.miss) == (2, 3)
+    assert len(res.cache.storage) == res.cache.used == 2
+
+def test_bounded_bytes():
+    auth = rfc2308.Authoritative(ZONE)
+    res = rfc2308.Resolver(auth, rfc2308.BoundedCache(max_bytes=200, policy='lfu'))
+    for label in 'abcdefghij':
+        res.lookup(N(label + '.'), 1)
+    assert res.cache.used <= 200
+    assert res.cache.evictions == 10 - len(res.cache.storage)
+    assert res.cache.used == sum(rfc2308.estimate_size(name, dns.rdatatype.ANY)
+                                 for name in res.cache.storage)
+
+def test_bounded_nsec_ordering():
+    """evicted NSEC owner leaves ordering and stops proving non-existence"""
+    auth = rfc8198.Authoritative(ZONE)
+    res = rfc8198.Resolver(auth, rfc8198.BoundedCache(max_entries=1))
+    res.lookup(N('nonexistent.'), 1)  # NSEC . -> test.
+    res.lookup(N('nonexistent2.'), 1)  # synthesized from NSEC
+    assert [canonical.to_name(key) for key in res.cache.ordering] == [N('.')]
+    res.lookup(N('zzz.'), 1)  # NSEC unsigned. -> .
+    assert res.cache.evictions == 1
+    assert [canonical.to_name(key) for key in res.cache.ordering] == [N('unsigned.')]
+    res.lookup(N('nonexistent3.'), 1)
+    assert (res.cache.hit, res.cache.miss) == (1, 3)
+    assert [canonical.to_name(key) for key in res.cache.ordering] == [N('.')]
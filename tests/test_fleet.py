@@ -0,0 +1,68 @@
+import io
+import os.path
+
+import dns.name
+import dns.rdatatype
+
+import fleet
+import qlog2cache
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+N = dns.name.from_text
+A = dns.rdatatype.A
+
+LOG = """2017-09-08T00:00:00.0+02:00 'test.' type 'NS' client 192.0.2.1
+2017-09-08T00:00:00.5+02:00 'Test.' type 'NS' client 192.0.2.2
+2017-09-08T00:00:01.0+02:00 'test.' type 'NS' client 192.0.2.1
+2017-09-08T00:00:01.5+02:00 'test.' type 'NS'
+2017-09-08T01:00:00.0+02:00 'test.' type 'DS' client 192.0.2.1
+"""
+
+def test_parse_clients():
+    """client address is optional"""
+    queries = list(qlog2cache.read_queries_fast(io.BytesIO(LOG.encode('ascii')), clients=True))
+    assert [client for _, _, _, client in queries] == [b'192.0.2.1', b'192.0.2.2', b'192.0.2.1',
+                                                       None, b'192.0.2.1']
+    assert [query[:3] for query in queries] == list(qlog2cache.read_queries(io.StringIO(LOG)))
+
+def test_ring():
+    """adding instance moves only keys which go to it"""
+    keys = [str(idx).encode('ascii') for idx in range(2000)]
+    small = fleet.Ring(4)
+    big = fleet.Ring(5)
+    counts = [0] * 5
+    for key in keys:
+        idx = big.get(key)
+        counts[idx] += 1
+        assert idx == 4 or idx == small.get(key)
+    assert min(counts) > 200
+
+def test_policies():
+    for policy in fleet.POLICIES:
+        fl = fleet.load_fleet('rfc8198', ZONE, 3, policy)
+        for _ in range(4):
+            fl.set_reltime(0)
+            fl.lookup(N('test.'), dns.rdatatype.NS, b'192.0.2.1')
+        total, *instances = fl.counters()
+        assert total == (4, sum(hits for _, hits, _ in instances), fl.auth.queries)
+        if policy == 'round-robin':
+            assert [queries for queries, _, _ in instances] == [2, 1, 1]
+            assert total == (4, 1, 3)
+        elif policy != 'random':
+            assert total == (4, 3, 1)
+    fl = fleet.load_fleet('rfc2308', ZONE, 2, 'client-hash')
+    qname = fleet.load_fleet('rfc2308', ZONE, 2, 'qname-hash')
+    assert fl.pick(N('test.'), None) == qname.pick(N('test.'), None) and fl.clientless == 1
+
+def test_replay():
+    queries = qlog2cache.read_queries_fast(io.BytesIO(LOG.encode('ascii')))
+    fleets = [fleet.load_fleet('rfc2308', ZONE, 2, policy) for policy in ('round-robin', 'qname-hash')]
+    out = io.StringIO()
+    fleet.replay(queries, fleets, out)
+    header, row = [line.split(',') for line in out.getvalue().splitlines()]
+    assert header[:7] == ['time', 'round-robin.all.queries', 'round-robin.all.hit_ratio',
+                          'round-robin.all.auth', 'round-robin.0.queries',
+                          'round-robin.0.hit_ratio', 'round-robin.0.auth']
+    values = dict(zip(header, row))
+    assert values['round-robin.all.auth'] == '3' and values['qname-hash.all.auth'] == '2'
+    assert values['qname-hash.all.hit_ratio'] == '0.6000'
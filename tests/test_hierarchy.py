@@ -0,0 +1,112 @@
+import io
+import os.path
+
+import dns.name
+import dns.rdatatype
+
+import hierarchy
+import qlog2cache
+import rfc2308
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone')
+N = dns.name.from_text
+A = dns.rdatatype.A
+
+TEST_ZONE = """
+test.		5	IN	SOA	ns1.dns.nic.test. admin.test. 1 2 3 4 5
+test.		5	IN	NS	ns1.dns.nic.test.
+www.test.	5	IN	A	192.0.2.1
+sub.test.	5	IN	NS	ns.sub.test.
+ns.sub.test.	5	IN	A	192.0.2.2
+"""
+
+def resolver(tmpdir, **kwargs):
+    tmpdir.join('test.zone').write(TEST_ZONE)
+    return hierarchy.Resolver(hierarchy.Authoritative(ZONE, str(tmpdir), **kwargs))
+
+def test_referrals(tmpdir):
+    """resolution starts at the closest cut with cached NS"""
+    res = resolver(tmpdir)
+    auth = res.auth
+    assert res.lookup(N('www.test.'), A) == rfc2308.MISS
+    assert auth.by_level == [1, 1, 0]
+    assert res.lookup(N('www.test.'), A) == rfc2308.POSITIVE
+    assert res.lookup(N('mail.test.'), A) == rfc2308.MISS
+    assert auth.by_level == [1, 2, 0]
+    assert res.lookup(N('mail.test.'), A) == rfc2308.NXDOMAIN
+    # DS came with referral, otherwise it is answered by parent
+    assert res.lookup(N('test.'), dns.rdatatype.DS) == rfc2308.POSITIVE
+    assert res.lookup(N('sub.test.'), dns.rdatatype.DS) == rfc2308.MISS
+    assert res.lookup(N('sub.test.'), dns.rdatatype.DS) == rfc2308.NODATA
+    assert auth.by_level == [1, 3, 0]
+    # referral from loaded zone to synthesized one
+    res.lookup(N('x.sub.test.'), A)
+    assert auth.by_level == [1, 4, 1]
+    assert isinstance(auth.zones[N('sub.test.')], hierarchy.SyntheticZone)
+    # referral to test. expired (NS TTL 2), resolution starts at the root again
+    res.set_reltime(3)
+    res.lookup(N('ftp.test.'), A)
+    assert auth.by_level == [2, 5, 1]
+    assert auth.queries == sum(auth.by_level)
+
+def test_root_answers():
+    """names without delegation are answered by root as in flat models"""
+    res = hierarchy.Resolver(hierarchy.Authoritative(ZONE))
+    assert res.lookup(N('nonexistent.'), A) == rfc2308.MISS
+    assert res.lookup(N('nonexistent.'), A) == rfc2308.NXDOMAIN
+    assert res.lookup(N('.'), dns.rdatatype.NS) == rfc2308.MISS
+    assert res.lookup(N('.'), dns.rdatatype.NS) == rfc2308.POSITIVE
+    assert res.auth.by_level == [2, 0, 0]
+
+def test_synthetic_namespace():
+    """synthesized zones are deterministic, evicted zones come back the same"""
+    names = [N('name{}.sld{}.test.'.format(i, i % 7)) for i in range(300)]
+    big = hierarchy.Authoritative(ZONE)
+    small = hierarchy.Authoritative(ZONE, max_zones=2)
+    outcomes = []
+    for name in names:
+        outcome = big.outcome(name, A)
+        res = hierarchy.Resolver(small)
+        res.lookup(name, A)
+        assert res.lookup(name, A) == outcome
+        assert small.outcome(name, A) == outcome
+        outcomes.append(outcome)
+    assert len(small.zones) == 2 and small.evictions > 0
+    assert set(outcomes) == {rfc2308.POSITIVE, rfc2308.NXDOMAIN, rfc2308.NODATA}
+
+def test_outcome_keeps_zones(tmpdir, monkeypatch):
+    """hits do not load evicted child zone again and are not counted"""
+    res = resolver(tmpdir, max_zones=1)
+    auth = res.auth
+    res.lookup(N('www.test.'), A)
+    res.lookup(N('x.sub.test.'), A)
+    assert list(auth.zones) == [N('sub.test.')] and (auth.created, auth.evictions) == (2, 1)
+    loads = []
+    create = auth._create
+    monkeypatch.setattr(auth, '_create', lambda origin: loads.append(origin) or create(origin))
+    for _ in range(3):
+        assert res.lookup(N('www.test.'), A) == rfc2308.POSITIVE
+    assert loads == [N('test.')] and (auth.created, auth.evictions) == (2, 1)
+
+def test_load_policies_zonedir(tmpdir):
+    tmpdir.join('test.zone').write(TEST_ZONE)
+    resolvers = qlog2cache.load_policies(['rfc4035', 'hierarchy'], ZONE,
+                                         auth_options={'zonedir': str(tmpdir)})
+    res = resolvers['hierarchy']
+    assert res.auth.zonedir == str(tmpdir)
+    res.lookup(N('www.test.'), A)
+    assert isinstance(res.auth.zones[N('test.')], hierarchy.ZoneTables)
+    assert res.lookup(N('www.test.'), A) == rfc2308.POSITIVE
+
+def test_replay_levels():
+    """report has per-level auth queries, flat models ask only the root"""
+    queries = [(0, N('www.test.'), A), (1, N('www.test.'), A), (3600, N('mail.test.'), A)]
+    out = io.StringIO()
+    qlog2cache.replay(iter(queries), qlog2cache.load_policies(['rfc4035', 'hierarchy'], ZONE), out)
+    header, row = out.getvalue().splitlines()
+    fields = ['hit', 'miss', 'auth', 'auth.root', 'auth.tld', 'auth.sld']
+    assert header.split(',')[1:] == [
+        '{}.{}'.format(policy, field) for policy in ('rfc4035', 'hierarchy') for field in fields]
+    flat, hier = [int(value) for value in row.split(',')[1:7]], [int(value) for value in row.split(',')[7:]]
+    assert flat[2:] == [2, 2, 0, 0]
+    assert hier[2] == sum(hier[3:]) and hier[4] > 0
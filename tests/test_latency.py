@@ -0,0 +1,108 @@
+import csv
+import io
+import os.path
+import random
+
+import dns.name
+import pytest
+
+import latency
+import metrics
+import qlog2cache
+import rfc2308
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+N = dns.name.from_text
+
+def test_sketch_quantiles():
+    """quantiles are within relative error alpha, merge equals adding all values"""
+    rnd = random.Random(1)
+    values = [rnd.lognormvariate(3, 1) for _ in range(20000)]
+    first, second = latency.Sketch(), latency.Sketch()
+    for idx, value in enumerate(values):
+        (first if idx % 2 else second).add(value)
+    first.merge(second)
+    values.sort()
+    for q in (0.5, 0.9, 0.99, 0.999):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(first.quantile(q) - exact) <= 0.011 * exact
+    first.clear()
+    assert first.quantile(0.5) is None
+
+def test_sketch_collapse():
+    """collapsing lowest buckets keeps high quantiles"""
+    sketch = latency.Sketch(max_buckets=10)
+    for value in range(1, 1001):
+        sketch.add(value)
+    assert len(sketch.buckets) == 10
+    assert abs(sketch.quantile(0.999) - 999) <= 10
+
+def test_parse_distribution():
+    rng = random.Random(0)
+    assert latency.parse_distribution('const:5')(rng) == 5
+    assert 2 <= latency.parse_distribution('uniform:2,3')(rng) <= 3
+    with pytest.raises(ValueError):
+        latency.parse_distribution('gamma:1')
+    with pytest.raises(ValueError):
+        latency.parse_distribution('uniform:1')
+
+def test_srtt_prefers_fast_server():
+    fast, slow = N('fast.'), N('slow.')
+    model = latency.Model([fast, slow], hit=1, server_rtt={fast: 'const:10', slow: 'const:200'})
+    elapsed = [model.miss() for _ in range(1000)]
+    assert model.selected[fast] > 0.9 * len(elapsed)
+    assert model.selected[slow] > 0  # probed again after decay
+    assert set(elapsed) == {11, 201}
+
+def test_resolver_elapsed():
+    model = lambda zone: latency.Model(latency.apex_servers(zone), hit=0.5, rtt='const:20')
+    for res in qlog2cache.load_policies(['rfc2308', 'rfc8198'], ZONE, latency=model).values():
+        assert res.lookup(N('test.'), 2) == rfc2308.MISS
+        assert res.elapsed == 20.5
+        assert res.lookup(N('test.'), 2) == rfc2308.POSITIVE
+        assert res.elapsed == 0.5
+
+def test_metrics_percentiles():
+    model = lambda zone: latency.Model(latency.apex_servers(zone), hit=1, rtt='const:100')
+    resolvers = qlog2cache.load_policies(['rfc2308'], ZONE, latency=model)
+    queries = [(0, N('test.'), 2)] + [(1, N('test.'), 2)] * 99 + [(25, N('test.'), 2)]
+    out = io.StringIO()
+    metrics.replay(iter(queries), resolvers, metrics.CsvSink(out), window=10)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert [row['start'] for row in rows] == ['0', '10', '20']
+    first, empty, last = rows
+    assert float(first['p50']) == pytest.approx(1, rel=0.011)
+    assert float(first['p999']) == pytest.approx(1, rel=0.011)  # 1 miss in 100 queries
+    assert (empty['p50'], empty['p999']) == ('', '')
+    assert last['miss'] == '1'
+    assert float(last['p50']) == pytest.approx(101, rel=0.011)
+
+def test_serve_stale_timer():
+    """stale entry is served only when refresh would miss client response timer"""
+    def model(zone):
+        return latency.Model(latency.apex_servers(zone), hit=1, rtt='uniform:10,300', seed=2)
+    res = qlog2cache.load_policies(['rfc2308'], ZONE, latency=model,
+                                   options={'stale': 100, 'stale_timer': 150})['rfc2308']
+    served = refreshed = 0
+    for idx in range(200):
+        res.set_reltime(idx * 10)  # TTL of test. NS is 2 seconds, entry is always stale
+        outcome = res.lookup(N('test.'), 2)
+        if idx == 0:
+            continue
+        if outcome == rfc2308.MISS:
+            refreshed += 1
+            assert res.elapsed <= 151
+        else:
+            served += 1
+            assert res.elapsed == 150
+    assert served == res.stale_answers and served > 20 and refreshed > 20
+    assert res.cache.hit == served and res.cache.miss == refreshed + 1
+
+def test_serve_stale_without_timer():
+    """without client response timer every stale entry is served"""
+    model = lambda zone: latency.Model(latency.apex_servers(zone), hit=1, rtt='const:20')
+    res = qlog2cache.load_policies(['rfc8198'], ZONE, latency=model, options={'stale': 100})['rfc8198']
+    for idx in range(10):
+        res.set_reltime(idx * 10)
+        res.lookup(N('test.'), 2)
+    assert res.stale_answers == 9 and res.elapsed == 1
@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+import os.path
+
+import dns.name
+
+import metrics
+import qlog2cache
+import rfc2308
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+N = dns.name.from_text
+
+def test_lookup_outcomes():
+    resolvers = qlog2cache.load_policies(['rfc2308', 'rfc8198'], ZONE)
+    res = resolvers['rfc2308']
+    assert res.lookup(N('nonexistent.'), 1) == rfc2308.MISS
+    assert res.lookup(N('nonexistent.'), 2) == rfc2308.NXDOMAIN
+    assert res.lookup(N('.'), 666) == rfc2308.MISS
+    assert res.lookup(N('.'), 666) == rfc2308.NODATA
+    assert res.lookup(N('.'), 2) == rfc2308.MISS
+    assert res.lookup(N('.'), 2) == rfc2308.POSITIVE
+
+    res = resolvers['rfc8198']
+    assert res.lookup(N('.'), 666) == rfc2308.MISS
+    assert res.lookup(N('.'), 667) == rfc2308.NODATA  # matching NSEC . -> test.
+    assert res.lookup(N('nonexistent.'), 1) == rfc2308.SYNTHESIZED
+    assert res.lookup(N('.'), 2) == rfc2308.MISS
+    assert res.lookup(N('.'), 2) == rfc2308.POSITIVE
+
+def run(queries, fmt='csv', window=10, by_tld=False, names=('rfc2308', 'rfc8198')):
+    resolvers = qlog2cache.load_policies(names, ZONE)
+    out = io.StringIO()
+    metrics.replay(iter(queries), resolvers, metrics.SINKS[fmt](out), window, by_tld)
+    return resolvers, out.getvalue()
+
+QUERIES = [(0, N('nonexistent.'), 1),
+           (1, N('nonexistent.'), 1),
+           (9, N('test.'), 2),
+           (35, N('www.test.'), 1),  # windows 10-20 and 20-30 are empty
+           (40, N('test.'), 2)]
+
+def test_windows():
+    resolvers, out = run(QUERIES)
+    rows = list(csv.DictReader(io.StringIO(out)))
+    assert [(row['start'], row['end'], row['policy']) for row in rows] == [
+        (str(start), str(start + 10), policy)
+        for start in range(0, 50, 10) for policy in ('rfc2308', 'rfc8198')]
+    assert [row['queries'] for row in rows if row['policy'] == 'rfc2308'] == ['3', '0', '0', '1', '1']
+    first = rows[0]
+    assert (first['miss'], first['nxdomain'], first['auth']) == ('2', '1', '2')
+    for name, res in resolvers.items():
+        policy_rows = [row for row in rows if row['policy'] == name]
+        assert sum(int(row['hit']) for row in policy_rows) == res.cache.hit
+        assert sum(int(row['auth']) for row in policy_rows) == res.auth.queries
+        assert policy_rows[-1]['entries'] == str(res.cache.entries)
+
+def test_by_tld_json():
+    _, out = run(QUERIES, fmt='json', window=100, by_tld=True, names=['rfc2308'])
+    records = [json.loads(line) for line in out.splitlines()]
+    assert records[0]['tld'] is None and records[0]['queries'] == 5
+    tlds = {record['tld']: record for record in records[1:]}
+    assert set(tlds) == {'other', 'test.'}
+    assert tlds['other']['nxdomain'] == 1
+    assert tlds['test.']['queries'] == 3 and tlds['test.']['auth'] is None
+    for field in rfc2308.OUTCOMES:
+        assert sum(record[field] for record in records[1:]) == records[0][field]
@@ -0,0 +1,75 @@
+import io
+import os.path
+import random
+
+import dns.name
+
+import mrc
+import qlog2cache
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+
+def random_queries(count, seed=1):
+    rnd = random.Random(seed)
+    names = [dns.name.from_text(text) for text in
+             ['.', 'test.', 'unsigned.', 'a.', 'zzz.', 'nonexistent.', 'tesu.', 'u.', 'www.test.']]
+    now = 0
+    queries = []
+    for _ in range(count):
+        now += rnd.choice([0, 0, 1, 2, 3, 30])
+        queries.append((now, rnd.choice(names), rnd.choice([1, 2, 28, 43, 666])))
+    return queries
+
+def test_stack_distance():
+    """distance is weight of distinct keys used since last use, compaction keeps it"""
+    for size in (4, 1 << 16):
+        sd = mrc.StackDistance(None, size=size)
+        sd.insert('a', 1)
+        sd.insert('b', 10)
+        sd.insert('c', 100)
+        sd.access('a')
+        assert sd.last == 111
+        sd.access('a')
+        assert sd.last == 1
+        sd.access('b')
+        assert sd.last == 111
+        sd.remove('c')
+        sd.access('a')
+        assert sd.last == 11
+        sd.access('b')
+        assert sd.last == 11
+        for _ in range(10):
+            sd.access('b')
+            assert sd.last == 10
+
+def test_curve_matches_lru():
+    """predicted hits are close to bounded LRU replay"""
+    queries = random_queries(3000)
+    count, (histogram,) = mrc.distances(iter(queries), mrc.load_policies(['rfc2308'], ZONE))
+    assert count == len(queries)
+    for capacity in (1, 3, 10, 30, 100):
+        res = qlog2cache.load_policies(['rfc2308'], ZONE, {'max_entries': capacity})['rfc2308']
+        for now, qname, rrtype in queries:
+            res.set_reltime(now)
+            res.lookup(qname, rrtype)
+        predicted = sum(n for dist, n in histogram.items() if dist <= capacity)
+        assert abs(predicted - res.cache.hit) <= count // 100
+
+def test_write_curve():
+    """cumulative curve ends at unbounded cache results"""
+    queries = random_queries(2000, seed=2)
+    names = ['rfc2308', 'rfc8198']
+    count, histograms = mrc.distances(iter(queries), mrc.load_policies(names, ZONE, by_bytes=True))
+    out = io.StringIO()
+    mrc.write_curve(out, names, count, histograms)
+    lines = out.getvalue().splitlines()
+    assert lines[0] == 'capacity,rfc2308.hit_ratio,rfc2308.auth,rfc8198.hit_ratio,rfc8198.auth'
+    rows = [[float(value) for value in line.split(',')] for line in lines[1:]]
+    assert [row[0] for row in rows] == sorted(row[0] for row in rows)
+    for row in rows:
+        assert row[2] == round(count * (1 - row[1]))
+    # unbounded results at the end
+    unbounded = qlog2cache.load_policies(names, ZONE)
+    qlog2cache.replay(iter(queries), unbounded, io.StringIO())
+    assert rows[-1][2] == unbounded['rfc2308'].cache.miss
+    assert rows[-1][4] == unbounded['rfc8198'].cache.miss
@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from ordered import SortedList
+
+def test_sorted_list():
+    rnd = random.Random(1)
+    items = SortedList(load=4)
+    reference = []
+    for _ in range(2000):
+        item = rnd.randint(0, 300)
+        if item in reference and rnd.random() < 0.5:
+            items.remove(item)
+            reference.remove(item)
+        elif item not in reference:
+            items.add(item)
+            reference.append(item)
+            reference.sort()
+        assert len(items) == len(reference)
+    assert list(items) == reference
+    assert items.last() == reference[-1]
+    for item in range(-1, 302):
+        assert (item in items) == (item in reference)
+        smaller = [ref for ref in reference if ref <= item]
+        if smaller:
+            assert items.floor(item) == smaller[-1]
+        else:
+            with pytest.raises(IndexError):
+                items.floor(item)
+        larger = [ref for ref in reference if ref > item]
+        if larger:
+            assert items.higher(item) == larger[0]
+        else:
+            with pytest.raises(IndexError):
+                items.higher(item)
+
+def test_sorted_list_remove_missing():
+    items = SortedList([3, 1, 2])
+    assert list(items) == [1, 2, 3]
+    with pytest.raises(ValueError):
+        items.remove(4)
+    with pytest.raises(ValueError):
+        items.remove(0)
+    with pytest.raises(IndexError):
+        SortedList().floor(1)
+    with pytest.raises(IndexError):
+        SortedList().last()
@@ -0,0 +1,56 @@
+import io
+import os.path
+import random
+
+import dns.name
+import pytest
+
+import parallel
+import qlog2cache
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+
+def random_queries(count, seed=1):
+    rnd = random.Random(seed)
+    names = [dns.name.from_text(text) for text in
+             ['.', 'test.', 'unsigned.', 'a.', 'zzz.', 'nonexistent.', 'tesu.', 'u.', 'www.test.']]
+    now = 0
+    queries = []
+    for _ in range(count):
+        now += rnd.choice([0, 0, 1, 2, 3, 1800])
+        queries.append((now, rnd.choice(names), rnd.choice([1, 2, 28, 43, 666])))
+    return queries
+
+def test_parallel_equals_serial():
+    """sharded replay gives exactly the same output as serial replay"""
+    names = ['rfc2308', 'rfc4035', 'rfc8198']
+    queries = random_queries(3000)
+    serial = io.StringIO()
+    qlog2cache.replay(iter(queries), qlog2cache.load_policies(names, ZONE), serial)
+    assert len(serial.getvalue().splitlines()) > 10
+    for jobs in (1, 3):
+        out = io.StringIO()
+        parallel.replay(iter(queries), names, ZONE, jobs, out, batch_size=100)
+        assert out.getvalue() == serial.getvalue()
+
+def test_parallel_reclaim():
+    """live entries of all shards add up"""
+    names = ['rfc2308', 'rfc8198']
+    queries = random_queries(2000, seed=2)
+    serial = io.StringIO()
+    qlog2cache.replay(iter(queries), qlog2cache.load_policies(names, ZONE, reclaim=True), serial)
+    assert serial.getvalue().startswith('time,rfc2308.hit,rfc2308.miss,rfc2308.auth,rfc2308.live,')
+    out = io.StringIO()
+    parallel.replay(iter(queries), names, ZONE, 2, out, batch_size=100, reclaim=True)
+    assert out.getvalue() == serial.getvalue()
+
+def crash(*args):
+    raise SystemExit(3)
+
+def test_worker_crash(monkeypatch):
+    """dead worker is an error, not a hang on full or empty queues"""
+    monkeypatch.setattr(parallel, '_worker', crash)
+    monkeypatch.setattr(parallel, 'POLL', 0.1)
+    with pytest.raises(RuntimeError, match='exited with code 3'):
+        parallel.replay(iter(random_queries(1000)), ['rfc2308'], ZONE, 2, io.StringIO(),
+                        batch_size=1)
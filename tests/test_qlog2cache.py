@@ -0,0 +1,72 @@
+import io
+import os.path
+
+import dns.name
+import dns.rdatatype
+
+from qlog2cache import load_policies, read_queries, read_queries_fast, replay
+import zoneindex
+
+LOG = """2017-09-08T15:42:22.186207+02:00 'prod-t.singular.net.' type 'A'
+2017-09-08T15:42:22.5+02:00 'com.' type 'NS'
+garbage line
+2017-09-08T15:42:22.100000+02:00 'com.' type 'NS'
+2017-09-08T15:42:23.186206+02:00 'Com.' type 'AAAA'
+2017-09-08T16:42:23.186208+02:00 '.' type 'DNSKEY'
+2017-09-09T00:00:00.000001+02:00 'nonexistent.' type 'TYPE666'
+"""
+
+def test_fast_parser_equivalence():
+    """fast parser yields the same tuples as read_queries"""
+    expected = list(read_queries(io.StringIO(LOG)))
+    assert [t for t, _, _ in expected] == [0, 0, 0, 3600, 29857]
+    for chunk_size in (1, 7, 1 << 20):
+        got = list(read_queries_fast(io.BytesIO(LOG.encode('ascii')), chunk_size=chunk_size))
+        assert got == expected
+    # last line does not need to be terminated
+    got = list(read_queries_fast(io.BytesIO(LOG.rstrip('\n').encode('ascii'))))
+    assert got == expected
+
+def test_fast_parser_interning():
+    """repeated names are the same object"""
+    log = LOG.encode('ascii') * 3
+    queries = list(read_queries_fast(io.BytesIO(log)))
+    coms = [name for _, name, _ in queries if name == dns.name.from_text('com.')]
+    assert len(coms) == 9
+    assert len({id(name) for name in coms if name.labels[0] == b'com'}) == 1
+    assert queries[-1][2] == 666
+    assert queries[1][2] == dns.rdatatype.NS
+
+def test_replay_multiple_policies():
+    """one pass over the log feeds all policies"""
+    zonefile = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+    resolvers = load_policies(['rfc2308', 'rfc4035', 'rfc8198'], zonefile)
+    assert len({id(res.auth.zone) for res in resolvers.values()}) == 1
+
+    log = ["2017-09-08T00:00:00.0+02:00 'nonexistent.' type 'A'",
+           "2017-09-08T00:00:01.0+02:00 'nonexistent2.' type 'A'",
+           "2017-09-08T00:00:01.0+02:00 'test.' type 'NS'",
+           "2017-09-08T01:00:00.0+02:00 'test.' type 'DS'"]
+    out = io.StringIO()
+    replay(read_queries_fast(io.BytesIO('\n'.join(log).encode('ascii'))), resolvers, out)
+    assert out.getvalue().splitlines() == [
+        'time,rfc2308.hit,rfc2308.miss,rfc2308.auth,'
+        'rfc4035.hit,rfc4035.miss,rfc4035.auth,'
+        'rfc8198.hit,rfc8198.miss,rfc8198.auth',
+        '3600,0,4,4,0,4,4,1,3,3']
+
+def test_replay_zone_versions():
+    """zone version and inconsistent hits are reported for changing zone"""
+    testdir = os.path.dirname(__file__)
+    zone = zoneindex.versions(os.path.join(testdir, 'test_root.zone.signed'),
+                              [(3, os.path.join(testdir, 'test_root.zone.v2'))])
+    log = ["2017-09-08T00:00:00.0+02:00 'new.' type 'NS'",
+           "2017-09-08T00:00:05.0+02:00 'new.' type 'NS'",
+           "2017-09-08T01:00:00.0+02:00 'new.' type 'NS'"]
+    out = io.StringIO()
+    replay(read_queries_fast(io.BytesIO('\n'.join(log).encode('ascii'))),
+           load_policies(['rfc2308', 'rfc8198'], zone), out)
+    assert out.getvalue().splitlines() == [
+        'time,rfc2308.hit,rfc2308.miss,rfc2308.auth,rfc2308.zone.version,rfc2308.inconsistent,'
+        'rfc8198.hit,rfc8198.miss,rfc8198.auth,rfc8198.zone.version,rfc8198.inconsistent',
+        '3600,1,2,2,1,1,1,2,2,1,1']
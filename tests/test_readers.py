@@ -0,0 +1,199 @@
+import gzip
+import lzma
+import struct
+import time
+
+import dns.message
+import dns.name
+import dns.rdatatype
+
+import readers
+
+QUERIES = [(1504878142.186207, 'com.', 'NS'),
+           (1504878142.5, 'Com.', 'AAAA'),
+           (1504881743.186208, '.', 'DNSKEY'),
+           (1504908000.000001, 'nonexistent.', 'TYPE666')]
+EXPECTED = [(0, dns.name.from_text('com.'), dns.rdatatype.NS),
+            (0, dns.name.from_text('com.'), dns.rdatatype.AAAA),
+            (3601, dns.name.root, dns.rdatatype.DNSKEY),
+            (29857, dns.name.from_text('nonexistent.'), 666)]
+
+
+def query_wire(qname, rrtype):
+    return dns.message.make_query(qname, rrtype).to_wire()
+
+
+def udp4(payload, dport=53):
+    udp = struct.pack('>HHHH', 40000, dport, 8 + len(payload), 0) + payload
+    ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+                     b'\x0a\x00\x00\x01', b'\x0a\x00\x00\x02')
+    return ip + udp
+
+
+def tcp6(payload, dport=53):
+    msg = struct.pack('>H', len(payload)) + payload
+    tcp = struct.pack('>HHIIBBHHH', 40000, dport, 0, 0, 5 << 4, 0x18, 1024, 0, 0) + msg
+    ip = struct.pack('>IHBB16s16s', 6 << 28, len(tcp), 6, 64, b'\x00' * 15 + b'\x01', b'\x00' * 15 + b'\x02')
+    return ip + tcp
+
+
+def ethernet(packet):
+    ethertype = 0x0800 if packet[0] >> 4 == 4 else 0x86dd
+    return b'\x00' * 12 + struct.pack('>H', ethertype) + packet
+
+
+def frames():
+    """Ethernet frames of test queries mixed with irrelevant traffic"""
+    out = []
+    for idx, (ts, qname, rrtype) in enumerate(QUERIES):
+        wire = query_wire(qname, rrtype)
+        if idx % 2:
+            out.append((ts, ethernet(tcp6(wire))))
+        else:
+            out.append((ts, ethernet(udp4(wire))))
+        response = bytearray(wire)
+        response[2] |= 0x80
+        out.append((ts, ethernet(udp4(bytes(response)))))  # response is ignored
+        out.append((ts, ethernet(udp4(wire, dport=5353))))  # other port
+    return out
+
+
+def pcap(nanosecond=False):
+    magic = 0xa1b23c4d if nanosecond else 0xa1b2c3d4
+    out = [struct.pack('<IHHiIII', magic, 2, 4, 0, 0, 65535, readers.LINKTYPE_ETHERNET)]
+    for ts, frame in frames():
+        sec = int(ts)
+        frac = round((ts - sec) * (1e9 if nanosecond else 1e6))
+        out.append(struct.pack('<IIII', sec, frac, len(frame), len(frame)) + frame)
+    return b''.join(out)
+
+
+def pcapng_block(btype, body):
+    body += b'\x00' * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack('<II', btype, length) + body + struct.pack('<I', length)
+
+
+def pcapng():
+    out = [pcapng_block(0x0a0d0d0a, struct.pack('<IHHq', 0x1a2b3c4d, 1, 0, -1))]
+    # interface with nanosecond resolution
+    options = struct.pack('<HHB3x', 9, 1, 9) + struct.pack('<HH', 0, 0)
+    out.append(pcapng_block(1, struct.pack('<HHI', readers.LINKTYPE_ETHERNET, 0, 0) + options))
+    for ts, frame in frames():
+        ticks = round(ts * 1e6) * 1000
+        out.append(pcapng_block(6, struct.pack('<IIIII', 0, ticks >> 32, ticks & 0xffffffff,
+                                               len(frame), len(frame)) + frame))
+    return b''.join(out)
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def field(number, wiretype, value):
+    tag = varint(number << 3 | wiretype)
+    if wiretype == 0:
+        return tag + varint(value)
+    if wiretype == 5:
+        return tag + struct.pack('<I', value)
+    return tag + varint(len(value)) + value
+
+
+def dnstap():
+    content_type = b'protobuf:dnstap.Dnstap'
+    start = struct.pack('>II', 2, 1) + struct.pack('>I', len(content_type)) + content_type
+    out = [struct.pack('>II', 0, len(start)) + start]
+    addresses = [b'\xc0\x00\x02\x01', None, b'\x20\x01\x0d\xb8' + b'\x00' * 11 + b'\x01', None]
+    for (ts, qname, rrtype), address in zip(QUERIES, addresses):
+        sec = int(ts)
+        nsec = round((ts - sec) * 1e6) * 1000
+        for mtype in (readers.DNSTAP_CLIENT_QUERY, 3):  # resolver query is ignored
+            message = (field(1, 0, mtype) + field(8, 0, sec) + field(9, 5, nsec)
+                       + field(10, 2, query_wire(qname, rrtype)))
+            if address is not None:
+                message += field(4, 2, address)
+            frame = field(1, 2, b'resolver') + field(15, 0, 1) + field(14, 2, message)
+            out.append(struct.pack('>I', len(frame)) + frame)
+    out.append(struct.pack('>III', 0, 4, 3))  # stop
+    return b''.join(out)
+
+
+def qlog():
+    lines = ["garbage line"]
+    for ts, qname, rrtype in QUERIES:
+        sec = int(ts)
+        stamp = '{}.{:06d}+02:00'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(sec)),
+                                         round((ts - sec) * 1e6))
+        lines.append("{} '{}' type '{}'".format(stamp, qname, rrtype))
+    return '\n'.join(lines).encode('ascii')
+
+
+def check(tmpdir, data, fmt):
+    for suffix, compress in (('', bytes), ('.gz', gzip.compress), ('.xz', lzma.compress)):
+        path = tmpdir.join('input' + suffix)
+        path.write_binary(compress(data))
+        assert readers.detect_format(readers.open_stream(str(path))) == fmt
+        assert list(readers.open_queries(str(path))) == EXPECTED
+        assert list(readers.open_queries(str(path), fmt)) == EXPECTED
+
+
+def test_qlog(tmpdir):
+    check(tmpdir, qlog(), 'qlog')
+
+
+def test_pcap(tmpdir):
+    check(tmpdir, pcap(), 'pcap')
+    check(tmpdir, pcap(nanosecond=True), 'pcap')
+
+
+def test_pcapng(tmpdir):
+    check(tmpdir, pcapng(), 'pcapng')
+
+
+def test_dnstap(tmpdir):
+    check(tmpdir, dnstap(), 'dnstap')
+
+
+def test_clients(tmpdir):
+    """packet source and dnstap query address are client addresses"""
+    for data in (pcap(), pcapng()):
+        path = tmpdir.join('input')
+        path.write_binary(data)
+        queries = list(readers.open_queries(str(path), clients=True))
+        assert [query[:3] for query in queries] == EXPECTED
+        assert [query[3] for query in queries] == [b'10.0.0.1', b'::1', b'10.0.0.1', b'::1']
+    path = tmpdir.join('input')
+    path.write_binary(dnstap())
+    queries = list(readers.open_queries(str(path), clients=True))
+    assert [query[:3] for query in queries] == EXPECTED
+    assert [query[3] for query in queries] == [b'192.0.2.1', None, b'2001:db8::1', None]
+
+
+def test_parse_query():
+    """only well-formed queries are accepted"""
+    wire = query_wire('example.com.', 'A')
+    assert readers.parse_query(wire) == (dns.name.from_text('example.com.'), dns.rdatatype.A)
+    assert readers.parse_query(wire[:-3]) is None
+    assert readers.parse_query(wire[:12]) is None
+    response = bytearray(wire)
+    response[2] |= 0x80
+    assert readers.parse_query(bytes(response)) is None
+
+
+def test_tcp_segments():
+    """several messages in one segment are read, truncated one is skipped"""
+    wires = [query_wire('a.', 'A'), query_wire('b.', 'A')]
+    payload = b''.join(struct.pack('>H', len(wire)) + wire for wire in wires)
+    segment = tcp6(wires[0])[:60] + payload + struct.pack('>H', 100) + b'\x00' * 10
+    packet = bytearray(segment)
+    struct.pack_into('>H', packet, 4, len(packet) - 40)
+    got = list(readers._queries_from_frame(bytes(packet), readers.LINKTYPE_RAW))
+    assert [name.to_text() for name, _ in got] == ['a.', 'b.']
@@ -0,0 +1,65 @@
+import asyncio
+import io
+import os.path
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.rdatatype
+
+import authserver
+import metrics
+import replayer
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+N = dns.name.from_text
+A = dns.rdatatype.A
+
+QUERIES = [(0, N('test.'), dns.rdatatype.NS), (0, N('nonexistent.'), A),
+           (1, N('www.test.'), A), (5, N('.'), dns.rdatatype.SOA), (12, N('zzz.'), A)]
+
+def test_make_query():
+    wire, question = replayer.make_query(1234, N('www.test.'), A, dnssec=True)
+    query = dns.message.from_wire(wire)
+    assert query.id == 1234 and query.question[0].name == N('www.test.')
+    assert query.ednsflags & dns.flags.DO and query.payload == 1232
+    assert wire[12:12 + len(question)] == question
+    wire, _ = replayer.make_query(1, N('test.'), A, edns=False)
+    assert dns.message.from_wire(wire).edns < 0
+
+def replay(server, **kwargs):
+    out = io.StringIO()
+
+    async def run():
+        transport, tcp, port = await authserver.start(server, '127.0.0.1', 0)
+        try:
+            rep = replayer.Replayer(('127.0.0.1', port), metrics.CsvSink(out), **kwargs)
+            await rep.run(iter(QUERIES))
+        finally:
+            transport.close()
+            tcp.close()
+            await tcp.wait_closed()
+        return rep
+
+    rep = asyncio.run(run())
+    header, *rows = out.getvalue().splitlines()
+    return rep, [dict(zip(header.split(','), row.split(','))) for row in rows]
+
+def test_replay_windows():
+    """rcodes and latency are counted in windows of trace time"""
+    server = authserver.Server(ZONE)
+    rep, rows = replay(server, speed=100, window=5, sockets=2)
+    assert (rep.sent, rep.answered, rep.timeouts, rep.unexpected) == (5, 5, 0, 0)
+    assert server.queries == 5
+    assert [(row['start'], row['queries'], row['noerror'], row['nxdomain']) for row in rows] == [
+        ('0', '3', '2', '1'), ('5', '1', '1', '0'), ('10', '1', '0', '1')]
+    assert all(float(row['p50']) > 0 for row in rows)
+
+def test_open_loop_timeout():
+    """queries dropped by server time out, empty windows are written"""
+    server = authserver.Server(ZONE)
+    server.answer = lambda wire, limit=None: None
+    rep, rows = replay(server, speed=0, window=5, timeout=0.1)
+    assert (rep.answered, rep.timeouts) == (0, 5)
+    assert [row['timeout'] for row in rows] == ['3', '1', '1']
+    assert rows[0]['p50'] == ''
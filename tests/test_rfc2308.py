@@ -1,8 +1,11 @@
 import os.path
 
 import dns.name
+from dns.rdatatype import A, DS, MX, NS
 
-from rfc2308 import Resolver, Authoritative
+import rfc2308
+from rfc2308 import Cache, Resolver, Authoritative
+import zoneindex
 
 def N(name_str):
     return dns.name.from_text(name_str)
@@ -89,3 +92,111 @@ def test_res_noerror():
     assert res.cache.miss == 2
     assert res.cache.hit == 1
     assert res.auth.queries == 2
+
+def test_cache_reclaim():
+    """expired entries leave storage when time moves"""
+    auth = Authoritative(os.path.join(os.path.dirname(__file__), 'test_root.zone'))
+    res = Resolver(auth, Cache(reclaim=True))
+    res.lookup(N('nonexistent.'), 2)
+    res.lookup(N('.'), 2)
+    res.lookup(N('.'), 666)
+    assert res.cache.entries == 3
+
+    # time 3 > TTL 2, NXDOMAIN and NODATA are still valid
+    res.set_reltime(3)
+    assert res.cache.entries == 2
+    assert res.cache.expired == 1
+    assert res.cache.storage[N('.')].keys() == {666}
+    res.lookup(N('.'), 2)
+    assert res.cache.miss == 4
+    assert res.cache.hit == 0
+
+    # time 11 > min(SOA TTL 10, MINIMUM), NS from time 3 expired as well
+    res.set_reltime(11)
+    assert res.cache.entries == 0
+    assert not res.cache.storage
+    assert not res.cache.expiry
+
+def test_res_prefetch():
+    """popular entry is refreshed when less than given fraction of TTL remains"""
+    auth = Authoritative(os.path.join(os.path.dirname(__file__), 'test_root.zone'))
+    res = Resolver(auth, prefetch=0.5, prefetch_hits=2)
+    res.lookup(N('nonexistent.'), 2)  # NXDOMAIN TTL 10
+
+    # time 6: 4 < 5 seconds remain but entry has only 1 hit
+    res.set_reltime(6)
+    res.lookup(N('nonexistent.'), 1)
+    assert res.auth.queries == 1
+    res.set_reltime(7)
+    res.lookup(N('nonexistent.'), 1)
+    assert res.auth.queries == 2
+    assert res.prefetched == 1
+
+    # time 12: original entry would be expired
+    res.set_reltime(12)
+    res.lookup(N('nonexistent.'), 1)
+    assert res.cache.miss == 1
+    assert res.cache.hit == 3
+    assert res.auth.queries == 2
+
+def test_res_serve_stale():
+    """expired entry is answered within stale window and refreshed"""
+    auth = Authoritative(os.path.join(os.path.dirname(__file__), 'test_root.zone'))
+    res = Resolver(auth, Cache(reclaim=True), stale=5)
+    res.lookup(N('.'), 2)  # TTL 2
+    res.set_reltime(6)
+    assert res.cache.entries == 1  # kept for stale window
+    res.lookup(N('.'), 2)
+    assert (res.cache.hit, res.stale_answers, res.prefetched) == (1, 1, 1)
+    res.set_reltime(8)
+    res.lookup(N('.'), 2)
+    assert (res.cache.hit, res.stale_answers) == (2, 1)
+    res.set_reltime(14)
+    assert res.cache.entries == 0
+    res.lookup(N('.'), 2)
+    assert res.cache.miss == 2
+    assert res.auth.queries == 3
+
+def test_res_zone_versions(tmpdir):
+    """hits report what cache served and count answers contradicting new zone version"""
+    testdir = os.path.dirname(__file__)
+    nods = tmpdir.join('nods.zone')  # v2 without DS of test.
+    nods.write(''.join(line for line in open(os.path.join(testdir, 'test_root.zone.v2'))
+                       if ' DS ' not in line.replace('\t', ' ')))
+    zone = zoneindex.versions(os.path.join(testdir, 'test_root.zone.signed'), [(1, str(nods))])
+    res = Resolver(Authoritative(zone))
+    for name, rrtype in [('new.', NS), ('test.', DS), ('test.', MX)]:
+        assert res.lookup(N(name), rrtype) == rfc2308.MISS
+    res.set_reltime(1)
+    outcomes = [res.lookup(N(name), rrtype) for name, rrtype in
+                [('new.', NS), ('new.', A), ('test.', DS), ('test.', MX)]]
+    assert outcomes == [rfc2308.NXDOMAIN, rfc2308.NXDOMAIN, rfc2308.POSITIVE, rfc2308.NODATA]
+    assert res.inconsistent == 3  # new. exists, DS of test. was removed
+
+def test_res_nodata_reclaimed():
+    """kind of NODATA entries is forgotten with the entry"""
+    testdir = os.path.dirname(__file__)
+    zone = zoneindex.versions(os.path.join(testdir, 'test_root.zone.signed'),
+                              [(100, os.path.join(testdir, 'test_root.zone.v2'))])
+    res = Resolver(Authoritative(zone), Cache(reclaim=True))
+    res.lookup(N('test.'), MX)
+    res.lookup(N('test.'), NS)
+    assert res.cache.nodata == {(N('test.'), MX)}
+    res.set_reltime(50)  # past negative TTL
+    assert res.cache.entries == 0 and res.cache.nodata == set()
+    res = Resolver(Authoritative(zone), rfc2308.BoundedCache(max_entries=1))
+    res.lookup(N('test.'), MX)
+    res.lookup(N('test.'), NS)
+    assert res.cache.nodata == set()
+
+def test_footprint():
+    """footprint grows with entries and shrinks when they are removed"""
+    cache = Cache()
+    empty = cache.footprint()
+    for idx in range(50):
+        cache.put_rrtype(N('name{}.'.format(idx)), A, 10)
+    full = cache.footprint()
+    assert full > empty
+    for idx in range(25):
+        cache.remove(N('name{}.'.format(idx)), A)
+    assert empty < cache.footprint() < full
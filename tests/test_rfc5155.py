@@ -0,0 +1,200 @@
+import io
+import os.path
+import random
+
+import dns.name
+import dns.rcode
+import dns.rdatatype
+
+import canonical
+import qlog2cache
+import rfc2308
+import rfc5155
+import zoneindex
+
+TESTDIR = os.path.dirname(__file__)
+N = dns.name.from_text
+A = dns.rdatatype.A
+NSEC3 = dns.rdatatype.NSEC3
+
+# RFC 5155 appendix A: hash of name -> owner label of its NSEC3
+EXAMPLE_HASHES = {
+    'example.': '0p9mhaveqvm6t7vbl5lop2u3t2rp3tom',
+    'a.example.': '35mthgpgcu1qg68fab165klnsnk3dpvl',
+    'ns1.example.': '2t7b4g4vsa5smi47k61mv5bv1a22bojr',
+    'xx.example.': 't644ebqk9bibcna874givr6joj62mlhv',
+    '*.w.example.': 'r53bq7cc2uvmubfu5ocmm6pers9tk9en',
+}
+
+EXAMPLE_ZONE = """
+example.	3600	IN	SOA	ns1.example. bugs.example. 1 3600 300 3600000 3600
+example.	3600	IN	NS	ns1.example.
+example.	3600	IN	NSEC3PARAM	1 0 12 aabbccdd
+a.example.	3600	IN	A	192.0.2.1
+ns1.example.	3600	IN	A	192.0.2.2
+xx.example.	3600	IN	A	192.0.2.3
+0p9mhaveqvm6t7vbl5lop2u3t2rp3tom.example. 3600 IN NSEC3 1 0 12 aabbccdd 2t7b4g4vsa5smi47k61mv5bv1a22bojr NS SOA RRSIG NSEC3PARAM
+2t7b4g4vsa5smi47k61mv5bv1a22bojr.example. 3600 IN NSEC3 1 0 12 aabbccdd 35mthgpgcu1qg68fab165klnsnk3dpvl A RRSIG
+35mthgpgcu1qg68fab165klnsnk3dpvl.example. 3600 IN NSEC3 1 0 12 aabbccdd t644ebqk9bibcna874givr6joj62mlhv A RRSIG
+t644ebqk9bibcna874givr6joj62mlhv.example. 3600 IN NSEC3 1 0 12 aabbccdd 0p9mhaveqvm6t7vbl5lop2u3t2rp3tom A RRSIG
+"""
+
+def owner(label):
+    return N(label + '.example.')
+
+def example_index(tmpdir):
+    zonefile = tmpdir.join('example.zone')
+    zonefile.write(EXAMPLE_ZONE)
+    return zoneindex.load(str(zonefile), N('example.'))
+
+def test_hash():
+    """hashes match RFC 5155 appendix A"""
+    memo = rfc5155.HashMemo(12, bytes.fromhex('aabbccdd'), N('example.'))
+    for name, label in EXAMPLE_HASHES.items():
+        assert memo.owner(canonical.key(N(name))) == canonical.key(owner(label))
+    memo.owner(canonical.key(N('example.')))
+    assert (memo.lookups, memo.computed) == (6, 5)
+
+def test_memo_bound():
+    memo = rfc5155.HashMemo(0, b'', size=2)
+    keys = [canonical.key(N(name)) for name in ('a.', 'b.', 'c.', 'a.')]
+    for key in keys:
+        memo.owner(key)
+    assert memo.computed == 4 and len(memo.memo) == 2
+
+def test_ancestors():
+    key = canonical.key(N('a.b.c.'))
+    assert rfc5155.ancestors(key) == [canonical.key(N(name)) for name in ('.', 'c.', 'b.c.', 'a.b.c.')]
+
+def test_zone_tables(tmpdir):
+    """NSEC3 chain is read from zone file and kept in snapshot"""
+    index = example_index(tmpdir)
+    assert index.nsec3param == (12, bytes.fromhex('aabbccdd'))
+    assert index.nsec3[owner(EXAMPLE_HASHES['xx.example.'])][0] == owner(EXAMPLE_HASHES['example.'])
+    assert owner(EXAMPLE_HASHES['xx.example.']) not in index.nodes
+    snapfile = str(tmpdir.join('example.snap'))
+    index.save(snapfile)
+    snap = zoneindex.load(snapfile)
+    assert (snap.nsec3, snap.nsec3param) == (index.nsec3, index.nsec3param)
+    assert snap.nodes == index.nodes
+
+def test_auth_proofs(tmpdir):
+    auth = rfc5155.Authoritative(example_index(tmpdir))
+    assert auth.origin == N('example.')
+    rcode, answers = auth.query(N('b.example.'), A)
+    assert rcode == dns.rcode.NXDOMAIN
+    owners = {name for name, rrtype in answers}
+    # closest encloser example. + covering next closer and wildcard
+    assert owner(EXAMPLE_HASHES['example.']) in owners and 2 <= len(owners) <= 3
+    rcode, answers = auth.query(N('xx.example.'), dns.rdatatype.AAAA)
+    assert rcode == dns.rcode.NOERROR
+    assert list(answers) == [(owner(EXAMPLE_HASHES['xx.example.']), NSEC3)]
+
+def test_res_aggressive(tmpdir):
+    """whole chain in cache answers every nonexistent name"""
+    res = rfc5155.Resolver(rfc5155.Authoritative(example_index(tmpdir)))
+    assert res.lookup(N('b.example.'), A) == rfc2308.MISS
+    assert res.lookup(N('b.example.'), A) == rfc2308.SYNTHESIZED
+    assert res.lookup(N('xx.example.'), dns.rdatatype.AAAA) == rfc2308.MISS
+    assert res.lookup(N('xx.example.'), dns.rdatatype.MX) == rfc2308.NODATA
+    assert res.lookup(N('xx.example.'), A) == rfc2308.MISS  # type exists
+    for idx in range(50):
+        res.lookup(N('name{}.example.'.format(idx)), A)
+    assert len(res.cache.ordering) == 4
+    queries = res.auth.queries
+    for idx in range(50):
+        assert res.lookup(N('other{}.sub.example.'.format(idx)), A) == rfc2308.SYNTHESIZED
+    assert res.auth.queries == queries
+    res.set_reltime(3601)
+    assert res.lookup(N('b.example.'), A) == rfc2308.MISS
+
+def test_hashed_root_zone():
+    """zone signed with NSEC is hashed, outcomes agree with zone content"""
+    auth = rfc5155.Authoritative(os.path.join(TESTDIR, 'test_root.zone.signed'))
+    assert len(auth.chain) == 3  # ., test., unsigned.
+    res = rfc5155.Resolver(auth)
+    names = [N('nonexistent{}.'.format(idx)) for idx in range(30)] + [N('x.nonexistent0.')]
+    for name in names:
+        res.lookup(name, A)
+    assert res.auth.queries < len(names)
+    assert res.cache.miss == res.auth.queries
+    # NSEC3 of closest encloser proves NODATA at the root
+    assert res.lookup(N('.'), dns.rdatatype.TXT) == rfc2308.NODATA
+    assert res.lookup(N('.'), dns.rdatatype.NS) == rfc2308.MISS
+    assert res.cache.hasher.computed < res.cache.hasher.lookups
+
+def test_hash_parameters():
+    """iterations and salt of NSEC-signed zone come from Authoritative arguments"""
+    zonefile = os.path.join(TESTDIR, 'test_root.zone.signed')
+    default = rfc5155.Authoritative(zonefile)
+    res = qlog2cache.load_policies(['rfc8198', 'rfc5155'], zonefile,
+                                   auth_options={'iterations': 5, 'salt': b'\xab'})['rfc5155']
+    assert (res.auth.iterations, res.auth.salt) == (5, b'\xab')
+    assert (rfc5155.ITERATIONS, rfc5155.SALT) == (0, b'')
+    assert (res.cache.hasher.iterations, res.cache.hasher.salt) == (5, b'\xab')
+    assert len(res.auth.chain) == 3 and set(res.auth.chain).isdisjoint(default.chain)
+    assert res.lookup(N('nonexistent.'), A) == rfc2308.MISS
+    assert res.lookup(N('nonexistent2.'), A) == rfc2308.SYNTHESIZED
+
+def test_bounded(tmpdir):
+    cache = rfc5155.BoundedCache(max_bytes=300)
+    res = rfc5155.Resolver(rfc5155.Authoritative(example_index(tmpdir)), cache)
+    for idx in range(20):
+        res.lookup(N('name{}.example.'.format(idx)), A)
+    assert cache.used <= 300 and cache.evictions > 0
+    assert len(cache.ordering) == sum(NSEC3 in node for node in cache.storage.values())
+
+def test_report_fields():
+    """hashing cost is reported, zero for NSEC policies"""
+    zone = os.path.join(TESTDIR, 'test_root.zone.signed')
+    queries = [(0, N('a{}.'.format(idx)), A) for idx in range(10)] + [(3600, N('b.'), A)]
+    out = io.StringIO()
+    qlog2cache.replay(iter(queries), qlog2cache.load_policies(['rfc8198', 'rfc5155'], zone), out)
+    header, row = [line.split(',') for line in out.getvalue().splitlines()]
+    values = dict(zip(header, row))
+    assert values['rfc8198.nsec3.hashes'] == '0'
+    assert int(values['rfc5155.nsec3.hashes']) > 0 and int(values['rfc5155.nsec3.memo']) > 0
+
+def test_zone_versions():
+    """NSEC3 chain of hashed zone follows zone versions"""
+    newer = os.path.join(TESTDIR, 'test_root.zone.v2')
+    auth = rfc5155.Authoritative(zoneindex.versions(os.path.join(TESTDIR, 'test_root.zone.signed'),
+                                                    [(5, newer)]))
+    auth.set_reltime(5)
+    fresh = rfc5155.Authoritative(newer)
+    assert (auth.chain, auth.owners) == (fresh.chain, fresh.owners)
+    assert len(auth.hashed) == 4  # ., test., unsigned., new.
+
+def test_rehash_versions(tmpdir):
+    """chain patched by diffs equals chain of each version hashed from scratch"""
+    rand = random.Random(1)
+    records = []
+    for tld in ('a.', 'b.', 'c.', 'd.'):
+        records += ['{} 2 IN NS ns.{}'.format(tld, tld), 'ns.{} 2 IN A 192.0.2.1'.format(tld),
+                    'www.{} 2 IN A 192.0.2.2'.format(tld), 'x.y.{} 2 IN TXT "t"'.format(tld),
+                    'y.{} 2 IN MX 0 .'.format(tld), '{} 2 IN TXT "t"'.format(tld)]
+    paths = []
+    for idx in range(12):
+        path = str(tmpdir.join('v{}.zone'.format(idx)))
+        with open(path, 'w') as f:
+            f.write('. 10 IN SOA a.root-servers.net. nstld. {} 2 900 604800 86400\n'.format(idx))
+            f.write('. 2 IN NS a.root-servers.net.\n')
+            f.write('\n'.join(rand.sample(records, rand.randint(0, len(records)))) + '\n')
+        paths.append(path)
+    auth = rfc5155.Authoritative(zoneindex.versions(paths[0], list(enumerate(paths))[1:]))
+    for idx, path in enumerate(paths):
+        auth.set_reltime(idx)
+        fresh = rfc5155.Authoritative(path)
+        assert (auth.chain, auth.owners) == (fresh.chain, fresh.owners), path
+        assert auth.types == fresh.types
+
+def test_res_zone_versions():
+    """NSEC3 proofs from the old chain denying new name are inconsistent"""
+    zone = zoneindex.versions(os.path.join(TESTDIR, 'test_root.zone.signed'),
+                              [(5, os.path.join(TESTDIR, 'test_root.zone.v2'))])
+    res = rfc5155.Resolver(rfc5155.Authoritative(zone))
+    assert res.lookup(N('new.'), A) == rfc2308.MISS
+    res.set_reltime(5)
+    for rrtype in (A, dns.rdatatype.AAAA):
+        assert res.lookup(N('new.'), rrtype) == rfc2308.SYNTHESIZED
+    assert res.inconsistent == 2
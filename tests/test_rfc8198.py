@@ -3,7 +3,10 @@ import os.path
 import dns.name
 import dns.rdatatype
 
-from rfc8198 import Resolver, Authoritative
+import canonical
+import rfc2308
+from rfc8198 import Cache, NsecEntry, Resolver, Authoritative
+import zoneindex
 
 def N(name_str):
     return dns.name.from_text(name_str)
@@ -132,3 +135,89 @@ def test_res_noerror():
     assert res.cache.miss == 3
     assert res.cache.hit == 2
     assert res.auth.queries == 3
+
+def test_cache_reclaim():
+    """expired NSEC owners leave ordering"""
+    auth = Authoritative(os.path.join(os.path.dirname(__file__), 'test_root.zone.signed'))
+    res = Resolver(auth, Cache(reclaim=True))
+    res.lookup(N('test.'), dns.rdatatype.NS)
+    res.lookup(N('nonexistent.'), 1)
+    res.set_reltime(1)
+    res.lookup(N('zzz.'), 1)
+    assert [canonical.to_name(key) for key in res.cache.ordering] == [N('.'), N('test.'), N('unsigned.')]
+    assert res.cache.entries == 4
+
+    # NS + DS at test. expire, NSEC TTL is min(SOA TTL 10, MINIMUM)
+    res.set_reltime(3)
+    assert [canonical.to_name(key) for key in res.cache.ordering] == [N('.'), N('unsigned.')]
+    res.set_reltime(11)
+    assert [canonical.to_name(key) for key in res.cache.ordering] == [N('unsigned.')]
+    res.set_reltime(12)
+    assert [canonical.to_name(key) for key in res.cache.ordering] == []
+    assert res.cache.entries == 0
+    assert res.cache.expired == 4
+
+def test_res_prefetch_stale():
+    """synthesized answers refresh the NSEC they come from"""
+    auth = Authoritative(os.path.join(os.path.dirname(__file__), 'test_root.zone.signed'))
+    res = Resolver(auth, prefetch=0.5, stale=5)
+    res.lookup(N('nonexistent.'), 1)  # NSEC . -> test. TTL 10
+    res.set_reltime(6)
+    assert res.lookup(N('nonexistent2.'), 1) == rfc2308.SYNTHESIZED
+    assert res.prefetched == 1
+
+    # time 20: NSEC from time 6 is stale
+    res.set_reltime(20)
+    assert res.lookup(N('nonexistent3.'), 1) == rfc2308.SYNTHESIZED
+    assert (res.stale_answers, res.prefetched, res.cache.miss) == (1, 2, 1)
+    res.set_reltime(40)
+    assert res.lookup(N('nonexistent3.'), 1) == rfc2308.MISS
+
+def test_zone_versions():
+    """cached NSEC keeps denying name added by new zone version until it expires"""
+    testdir = os.path.dirname(__file__)
+    zone = zoneindex.versions(os.path.join(testdir, 'test_root.zone.signed'),
+                              [(5, os.path.join(testdir, 'test_root.zone.v2'))])
+    res = Resolver(Authoritative(zone))
+    res.set_reltime(0)
+    assert res.lookup(N('new.'), dns.rdatatype.NS) == rfc2308.MISS
+    assert res.lookup(N('test.'), dns.rdatatype.MX) == rfc2308.MISS
+    res.set_reltime(5)
+    assert res.auth.nsecs == [canonical.key(name) for name in zone.nsecs]
+    assert res.lookup(N('new.'), dns.rdatatype.NS) == rfc2308.SYNTHESIZED
+    assert res.inconsistent == 1
+    # new. exists now even without type A
+    assert res.lookup(N('new.'), dns.rdatatype.A) == rfc2308.SYNTHESIZED
+    assert res.inconsistent == 2
+    assert res.lookup(N('test.'), dns.rdatatype.MX) == rfc2308.NODATA
+    assert res.inconsistent == 2
+    res.set_reltime(20)
+    assert res.lookup(N('new.'), dns.rdatatype.NS) == rfc2308.MISS
+    assert res.lookup(N('new.'), dns.rdatatype.NS) == rfc2308.POSITIVE
+    assert res.lookup(N('unsigned.'), dns.rdatatype.NS) == rfc2308.MISS
+    assert res.inconsistent == 2
+
+def test_nsec_entry():
+    """type bitmask covers low and high type numbers, entries have no __dict__"""
+    types = [dns.rdatatype.A, dns.rdatatype.NS, dns.rdatatype.RRSIG, dns.rdatatype.NSEC,
+             dns.rdatatype.CAA, 65280]
+    entry = NsecEntry(10, canonical.key(N('next.')), sum(1 << rrtype for rrtype in types))
+    for rrtype in types:
+        assert entry.has_type(rrtype)
+    for rrtype in (dns.rdatatype.MX, dns.rdatatype.DS, dns.rdatatype.TXT, 65279, 65281, 65535):
+        assert not entry.has_type(rrtype)
+    assert not hasattr(entry, '__dict__')
+
+def test_footprint():
+    """footprint counts NSEC entries and ordering, shrinks after remove()"""
+    cache = Cache()
+    empty = cache.footprint()
+    names = [canonical.key(N('name{}.'.format(idx))) for idx in range(50)]
+    for name in names:
+        cache.put_rrtype(name, dns.rdatatype.NSEC,
+                         {'ttl': 10, 'next': name + b'\x00', 'types': 1 << dns.rdatatype.NS})
+    full = cache.footprint()
+    assert full > empty
+    for name in names[:25]:
+        cache.remove(name, dns.rdatatype.NSEC)
+    assert len(cache.ordering) == 25 and empty < cache.footprint() < full
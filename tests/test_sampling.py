@@ -0,0 +1,71 @@
+import collections
+import io
+import os.path
+import random
+
+import dns.name
+
+import qlog2cache
+import sampling
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+
+def random_queries(count, seed=1):
+    rnd = random.Random(seed)
+    names = [dns.name.from_text(text) for text in
+             ['.', 'test.', 'unsigned.', 'a.', 'zzz.', 'nonexistent.', 'tesu.', 'u.', 'www.test.']]
+    names += [dns.name.from_text('n{}.'.format(idx)) for idx in range(50)]
+    now = 0
+    queries = []
+    for _ in range(count):
+        now += rnd.choice([0, 0, 1, 2, 3, 1800])
+        queries.append((now, rnd.choice(names), rnd.choice([1, 2, 28, 43, 666])))
+    return queries
+
+def test_full_rate_is_exact():
+    names = ['rfc2308', 'rfc8198']
+    queries = random_queries(2000)
+    expected = io.StringIO()
+    qlog2cache.replay(iter(queries), qlog2cache.load_policies(names, ZONE), expected)
+    samplers = sampling.wrap(qlog2cache.load_policies(names, ZONE), 1.0)
+    out = io.StringIO()
+    sampling.replay(iter(queries), samplers, out)
+    assert out.getvalue().splitlines()[0] == ','.join(
+        ['time'] + ['{}.{}'.format(name, field) for name in names for field in sampling.FIELDS])
+    for got, exp in zip(out.getvalue().splitlines()[1:], expected.getvalue().splitlines()[1:]):
+        got = got.split(',')
+        exp = exp.split(',')
+        assert got[:4] + got[6:9] == exp
+        assert float(got[5]) == float(got[10]) == 0
+
+def test_sampled_partitions_are_exact():
+    """every sampled partition sees the same hits as in full replay"""
+    queries = random_queries(3000, seed=2)
+    for name in ('rfc2308', 'rfc8198'):
+        full = qlog2cache.load_policies([name], ZONE)[name]
+        sampler = sampling.Sampler(qlog2cache.load_policies([name], ZONE)[name], 0.5, seed=1)
+        hits = collections.Counter()
+        for now, qname, rrtype in queries:
+            full.set_reltime(now)
+            before = full.cache.hit
+            full.lookup(qname, rrtype)
+            hits[full.partition(qname)] += full.cache.hit - before
+            sampler.set_reltime(now)
+            sampler.lookup(qname, rrtype)
+        assert 0 < len(sampler.clusters) < len({full.partition(qname) for _, qname, _ in queries})
+        for partition, (_, cluster_hits) in sampler.clusters.items():
+            assert hits[partition] == cluster_hits
+        hit, miss, auth, ratio, ci = sampler.estimate()
+        assert hit + miss == len(queries)
+        assert 0 <= ci < 1
+
+def test_sampling_rate():
+    sampler = sampling.Sampler(None, 0.1)
+    assert sampler.estimate() is None
+    sampled = sum(sampler.is_sampled(partition) for partition in range(100000))
+    assert 9000 < sampled < 11000
+
+def test_scale_bounds():
+    assert sampling.scale_bounds({'max_entries': 1000, 'max_bytes': None, 'policy': 'lru'}, 0.01) == \
+        {'max_entries': 10, 'max_bytes': None, 'policy': 'lru'}
+    assert sampling.scale_bounds({'max_bytes': 10}, 0.01) == {'max_bytes': 1}
@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+import readers
+import tracefile
+from qlog2cache import read_queries_fast
+
+LOG = b"""2017-09-08T15:42:22.186207+02:00 'com.' type 'NS'
+2017-09-08T15:42:22.5+02:00 'Com.' type 'AAAA'
+2017-09-08T16:42:23.186208+02:00 '.' type 'DNSKEY'
+2017-09-08T16:42:23.186208+02:00 'com.' type 'A'
+2017-09-09T00:00:00.000001+02:00 'nonexistent.' type 'TYPE666'
+"""
+
+
+def test_roundtrip(tmpdir):
+    expected = list(read_queries_fast(io.BytesIO(LOG)))
+    path = str(tmpdir.join('q.trace'))
+    writer = tracefile.TraceWriter(path, flush_size=2)
+    for query in expected:
+        writer.append(*query)
+    writer.close()
+
+    trace = tracefile.Trace(path)
+    assert len(trace) == len(expected)
+    assert list(trace) == expected
+    assert len(trace.names) == 3
+    assert list(trace.name_id) == [0, 0, 1, 0, 2]
+    # names are shared objects
+    assert len({id(name) for _, name, _ in trace}) == 3
+
+    assert tracefile.is_trace(path)
+    assert list(readers.open_queries(path)) == expected
+
+
+def test_empty(tmpdir):
+    path = str(tmpdir.join('empty.trace'))
+    assert tracefile.convert([], path) == 0
+    assert list(tracefile.read_trace(path)) == []
+
+
+def test_numpy_compatible(tmpdir):
+    np = pytest.importorskip('numpy')
+    queries = list(read_queries_fast(io.BytesIO(LOG)))
+    path = tmpdir.join('q.trace')
+    tracefile.convert(queries, str(path))
+    reltime = np.load(str(path.join('reltime.npy')), mmap_mode='r')
+    rrtype = np.load(str(path.join('rrtype.npy')), mmap_mode='r')
+    assert reltime.dtype == np.uint32 and rrtype.dtype == np.uint16
+    assert reltime.tolist() == [t for t, _, _ in queries]
+    assert rrtype.tolist() == [r for _, _, r in queries]
+    assert np.load(str(path.join('name.npy'))).tolist() == [0, 0, 1, 0, 2]
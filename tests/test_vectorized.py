@@ -0,0 +1,59 @@
+import io
+import os.path
+import random
+
+import dns.name
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import qlog2cache
+import tracefile
+import vectorized
+
+ZONE = os.path.join(os.path.dirname(__file__), 'test_root.zone.signed')
+
+def random_queries(count, seed):
+    rnd = random.Random(seed)
+    names = [dns.name.from_text(text) for text in
+             ['.', 'test.', 'TEST.', 'unsigned.', 'a.', 'zzz.', 'nonexistent.', 'tesu.', 'www.test.']]
+    now = 0
+    queries = []
+    for _ in range(count):
+        now += rnd.choice([0, 0, 1, 2, 3, 9, 10, 11, 1800])
+        queries.append((now, rnd.choice(names), rnd.choice([1, 2, 2, 28, 43, 43, 666])))
+    return queries
+
+def object_hits(policy, queries):
+    res = qlog2cache.load_policies([policy], ZONE)[policy]
+    hits = []
+    for now, name, rrtype in queries:
+        res.set_reltime(now)
+        before = res.cache.hit
+        res.lookup(name, rrtype)
+        hits.append(res.cache.hit > before)
+    return hits
+
+@pytest.mark.parametrize('policy', vectorized.POLICIES)
+def test_hits_equal_resolver(policy):
+    """per-query results are identical to object-based Resolver"""
+    for seed in range(5):
+        queries = random_queries(3000, seed)
+        hits = vectorized.simulate(policy, ZONE, *vectorized.columns(queries))
+        assert hits.tolist() == object_hits(policy, queries)
+
+def test_empty():
+    assert len(vectorized.simulate('rfc4035', ZONE, *vectorized.columns([]))) == 0
+    assert vectorized.hourly([], []) == []
+
+def test_replay_from_trace(tmpdir):
+    """hourly report matches qlog2cache.replay()"""
+    queries = random_queries(5000, seed=7)
+    path = str(tmpdir.join('q.trace'))
+    tracefile.convert(queries, path)
+    expected = io.StringIO()
+    qlog2cache.replay(iter(queries), qlog2cache.load_policies(vectorized.POLICIES, ZONE), expected)
+    assert len(expected.getvalue().splitlines()) > 10
+    out = io.StringIO()
+    vectorized.replay(vectorized.POLICIES, ZONE, *vectorized.load(path), out=out)
+    assert out.getvalue() == expected.getvalue()
@@ -0,0 +1,69 @@
+import os.path
+
+import dns.name
+import dns.rdatatype
+import pytest
+
+import canonical
+import rfc8198
+import zoneindex
+
+TESTDIR = os.path.dirname(__file__)
+
+def N(name_str):
+    return dns.name.from_text(name_str)
+
+@pytest.mark.parametrize('zonefile', ['test_root.zone', 'test_root.zone.signed'])
+def test_snapshot_roundtrip(tmpdir, zonefile):
+    """snapshot holds the same tables as zone file"""
+    index = zoneindex.load(os.path.join(TESTDIR, zonefile))
+    snapfile = str(tmpdir.join('zone.snap'))
+    index.save(snapfile)
+    assert zoneindex.is_snapshot(snapfile)
+    assert not zoneindex.is_snapshot(os.path.join(TESTDIR, zonefile))
+
+    snap = zoneindex.load(snapfile)
+    assert snap.nodes == index.nodes
+    assert snap.nsec == index.nsec
+    assert snap.nsecs == index.nsecs
+    assert snap.ns == index.ns
+    assert snap.neg_ttl == index.neg_ttl
+
+def test_tables():
+    index = zoneindex.load(os.path.join(TESTDIR, 'test_root.zone.signed'))
+    assert index.nsecs == [N('.'), N('test.'), N('unsigned.')]
+    nxt, mask = index.nsec[N('test.')]
+    assert nxt == N('unsigned.')
+    assert zoneindex.mask_to_types(mask) == [dns.rdatatype.NS, dns.rdatatype.DS,
+                                             dns.rdatatype.RRSIG, dns.rdatatype.NSEC]
+    # RRSIG is stored only as covering RR type, i.e. NODATA for type RRSIG
+    assert index.nodes[N('test.')] == {dns.rdatatype.NS: 2, dns.rdatatype.DS: 2,
+                                       dns.rdatatype.NSEC: 86400}
+    assert index.ns[N('.')] == (N('a.root-servers.net.'),)
+    assert index.neg_ttl == 10
+
+def test_auth_from_snapshot(tmpdir):
+    snapfile = str(tmpdir.join('zone.snap'))
+    zoneindex.load(os.path.join(TESTDIR, 'test_root.zone.signed')).save(snapfile)
+    auth = rfc8198.Authoritative(snapfile)
+    rcode, answers = auth.query(N('nonexistent.'), 1)
+    assert rcode == dns.rcode.NXDOMAIN
+    assert list(answers) == [(N('.'), dns.rdatatype.NSEC)]
+    assert answers[(N('.'), dns.rdatatype.NSEC)]['next'] == canonical.key(N('test.'))
+    rcode, answers = auth.query(N('test.'), dns.rdatatype.NS)
+    assert set(answers) == {(N('test.'), dns.rdatatype.NS), (N('test.'), dns.rdatatype.DS)}
+
+def test_versions():
+    """applied diffs give the same tables as loading the new version"""
+    signed = os.path.join(TESTDIR, 'test_root.zone.signed')
+    newer = os.path.join(TESTDIR, 'test_root.zone.v2')
+    zone = zoneindex.versions(signed, [(100, newer), (200, signed)])
+    assert len(zone.diffs[0][1]) == 10  # unsigned. out, new. in, 3 NSEC changed
+    assert zone.advance(99, 0) == [] and zone.version == 0
+    assert zone.advance(150, 0) == [zone.diffs[0][1]]
+    v2 = zoneindex.load(newer)
+    assert (zone.nodes, zone.nsec, zone.nsecs, zone.ns) == (v2.nodes, v2.nsec, v2.nsecs, v2.ns)
+    assert zone.advance(1000, 1) == [zone.diffs[1][1]] and zone.version == 2
+    assert zone.nsecs == [N('.'), N('test.'), N('unsigned.')]
+    with pytest.raises(ValueError):
+        zoneindex.versions(signed, [(100, newer), (50, signed)])
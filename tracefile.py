@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+"""
+Columnar binary trace of queries for repeated replays.
+
+Trace is a directory with:
+- reltime.npy: uint32 relative time of each query
+- name.npy: uint32 index into name table
+- rrtype.npy: uint16 RR type
+- names.bin: deduplicated names in wire format, in order of first occurrence
+
+Columns are standard little endian .npy files, so numpy.load(mmap_mode='r')
+can use them directly. Trace itself memory-maps them without numpy and yields
+the same (reltime, name, rrtype) tuples as qlog2cache.read_queries(),
+with one dns.name.Name object per distinct name.
+
+Convert any input supported by readers module:
+    tracefile.py query.log.xz query.trace
+"""
+
+import array
+import ast
+import mmap
+import os
+import struct
+import sys
+
+import dns.name
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+_NPY_HEADER_LEN = 128  # fixed so that shape can be patched after writing
+COLUMNS = (('reltime', '<u4', 'I'), ('name', '<u4', 'I'), ('rrtype', '<u2', 'H'))
+NAMES_FILE = 'names.bin'
+
+
+def _npy_header(descr, count):
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(descr, count)
+    header = header.ljust(_NPY_HEADER_LEN - len(NPY_MAGIC) - 2 - 1) + '\n'
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def _npy_parse_header(buf):
+    """
+    Returns (descr, count, data offset) of 1-D .npy file.
+    """
+    assert bytes(buf[:len(NPY_MAGIC)]) == NPY_MAGIC, 'not a .npy version 1.0 file'
+    hlen, = struct.unpack_from('<H', buf, len(NPY_MAGIC))
+    offset = len(NPY_MAGIC) + 2
+    header = ast.literal_eval(bytes(buf[offset:offset + hlen]).decode('latin1'))
+    assert not header['fortran_order'] and len(header['shape']) == 1
+    return header['descr'], header['shape'][0], offset + hlen
+
+
+def is_trace(path):
+    return os.path.isfile(os.path.join(path, NAMES_FILE))
+
+
+class TraceWriter(object):
+    """
+    Append queries to new trace; columns are flushed every flush_size queries.
+    """
+    def __init__(self, path, flush_size=1 << 16):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.flush_size = flush_size
+        self.count = 0
+        self.name_ids = {}
+        self.files = [open(os.path.join(path, column + '.npy'), 'wb') for column, _, _ in COLUMNS]
+        for f, (_, descr, _) in zip(self.files, COLUMNS):
+            f.write(_npy_header(descr, 0))
+        self.buffers = [array.array(code) for _, _, code in COLUMNS]
+        self.names = open(os.path.join(path, NAMES_FILE), 'wb')
+
+    def append(self, reltime, name, rrtype):
+        assert 0 <= reltime < 1 << 32, 'reltime {} does not fit into uint32'.format(reltime)
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.name_ids)
+            self.names.write(name.to_wire())
+        times, ids, rrtypes = self.buffers
+        times.append(reltime)
+        ids.append(name_id)
+        rrtypes.append(rrtype)
+        self.count += 1
+        if len(times) >= self.flush_size:
+            self._flush()
+
+    def _flush(self):
+        for f, buf in zip(self.files, self.buffers):
+            if sys.byteorder != 'little':
+                buf.byteswap()
+            f.write(buf.tobytes())
+            del buf[:]
+
+    def close(self):
+        self._flush()
+        for f, (_, descr, _) in zip(self.files, COLUMNS):
+            f.seek(0)
+            f.write(_npy_header(descr, self.count))
+            f.close()
+        self.names.close()
+
+
+def convert(queries, path):
+    """
+    Write iterable of (reltime, name, rrtype) to trace directory.
+    Name equality follows dns.name, i.e. names differing in case share one entry.
+    """
+    writer = TraceWriter(path)
+    try:
+        for reltime, name, rrtype in queries:
+            writer.append(reltime, name, rrtype)
+    finally:
+        writer.close()
+    return writer.count
+
+
+def _read_names(buf):
+    names = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        labels = []
+        while True:
+            length = buf[pos]
+            labels.append(bytes(buf[pos + 1:pos + 1 + length]))
+            pos += 1 + length
+            if not length:
+                break
+        names.append(dns.name.Name(labels))
+    return names
+
+
+class Trace(object):
+    """
+    Read-only view of trace directory.
+
+    Columns are available as memoryviews (reltime, name_id, rrtype),
+    names is list of dns.name.Name indexed by name_id.
+    """
+    def __init__(self, path):
+        self._maps = []
+        columns = []
+        for column, descr, code in COLUMNS:
+            buf = self._map(os.path.join(path, column + '.npy'))
+            got_descr, count, offset = _npy_parse_header(buf)
+            assert got_descr == descr, '{}: unexpected dtype {}'.format(column, got_descr)
+            if sys.byteorder == 'little':
+                view = memoryview(buf)[offset:offset + count * struct.calcsize(code)].cast(code)
+            else:
+                view = array.array(code, buf[offset:offset + count * struct.calcsize(code)])
+                view.byteswap()
+            columns.append(view)
+        self.reltime, self.name_id, self.rrtype = columns
+        self.names = _read_names(self._map(os.path.join(path, NAMES_FILE)))
+
+    def _map(self, filename):
+        with open(filename, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(buf)
+        return buf
+
+    def __len__(self):
+        return len(self.reltime)
+
+    def __iter__(self):
+        names = self.names
+        for reltime, name_id, rrtype in zip(self.reltime, self.name_id, self.rrtype):
+            yield (reltime, names[name_id], rrtype)
+
+
+def read_trace(path):
+    """
+    Returns iterator of (reltime, name, rrtype) from trace directory.
+    """
+    return iter(Trace(path))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: {} input trace'.format(sys.argv[0]))
+    import readers
+    convert(readers.open_queries(sys.argv[1]), sys.argv[2])
@@ -0,0 +1,238 @@
+"""
+Vectorized replay of exact-match caches (rfc2308, rfc4035) without capacity limit.
+
+Result of a query depends only on earlier queries with the same cache key:
+(name, rrtype), or name alone for NXDOMAIN. Query is a miss when there was
+no store of the key in the last TTL seconds, and each miss stores the key
+again. For each query the index of the first later query of the same key
+outside of its TTL window is found with one searchsorted() call, and misses
+are the queries reachable by following these pointers from the first query
+of each key.
+
+Cache key and TTL of each distinct (name, rrtype) come from the policy's
+own Authoritative, so the results are identical to Resolver. Additional
+answers stored on a miss (DS with NS in rfc4035) refresh their key without
+being counted, they are handled by a second pass over the affected keys.
+
+Requires numpy.
+"""
+
+import array
+import importlib
+import os
+
+import dns.rcode
+import numpy as np
+
+import canonical
+import rfc2308
+import tracefile
+
+POLICIES = ('rfc2308', 'rfc4035')
+_NXDOMAIN_CODE = 1 << 16  # cache key code of NXDOMAIN, beyond RR type range
+
+
+def _chain_misses(times, keys, ttls, forced):
+    """
+    Rows are sorted by key and then by order of arrival.
+    forced rows store the key unconditionally (additional answers).
+    Returns boolean array of rows which store the key: misses + forced rows.
+    """
+    n = len(times)
+    stores = np.zeros(n, dtype=bool)
+    if not n:
+        return stores
+    start = np.ones(n, dtype=bool)
+    start[1:] = keys[1:] != keys[:-1]
+    group = np.cumsum(start) - 1
+    span = int(times.max()) + int(ttls.max()) + 1
+    if (int(group[-1]) + 1) * span >= 1 << 62:
+        raise OverflowError('too many keys for time span of trace')
+    # shift each key to its own time range so that one searchsorted covers all keys
+    shifted = group * span + times
+    nxt = np.searchsorted(shifted, shifted + ttls, side='right')
+
+    starts = np.flatnonzero(start)
+    group_end = np.append(starts[1:], n)[group]
+    valid = nxt < group_end
+    forced_pos = np.flatnonzero(forced)
+    if len(forced_pos):
+        # chain ends at forced store, which starts chain of its own
+        after = np.searchsorted(forced_pos, np.arange(n), side='right')
+        next_forced = np.append(forced_pos, n)[after]
+        valid &= nxt < next_forced
+    nxt = np.where(valid, nxt, -1)
+
+    frontier = np.flatnonzero(start | forced)
+    while len(frontier):
+        stores[frontier] = True
+        frontier = nxt[frontier]
+        frontier = frontier[frontier >= 0]
+    return stores
+
+
+def _keys(auth, names, pairs):
+    """
+    Ask authoritative once for each distinct (name id, rrtype) pair.
+
+    Returns (key code, TTL) arrays for pairs and dict of additional answers
+    pair index -> [(key code, TTL)].
+    """
+    codes = np.empty(len(pairs), dtype=np.int64)
+    ttls = np.empty(len(pairs), dtype=np.int64)
+    extras = {}
+    nxdomain = {}  # name id -> (key code, TTL), NXDOMAIN does not depend on RR type
+    for idx, pair in enumerate(pairs.tolist()):
+        name_id, rrtype = pair >> 16, pair & 0xffff
+        if name_id in nxdomain:
+            codes[idx], ttls[idx] = nxdomain[name_id]
+            continue
+        rcode, answers = auth.query(names[name_id], rrtype)
+        for (_, atype), data in answers.items():
+            if rcode == dns.rcode.NXDOMAIN:
+                codes[idx], ttls[idx] = nxdomain[name_id] = (name_id << 17 | _NXDOMAIN_CODE, data['ttl'])
+            elif atype == rrtype:
+                codes[idx], ttls[idx] = (name_id << 17 | atype, data['ttl'])
+            else:
+                extras.setdefault(idx, []).append((name_id << 17 | atype, data['ttl']))
+    return codes, ttls, extras
+
+
+def _canonical_ids(name_id, names):
+    """
+    Map name ids so that equal names (which differ only in case) share one id.
+    """
+    first = {}
+    remap = np.array([first.setdefault(canonical.key(name), idx) for idx, name in enumerate(names)],
+                     dtype=np.int64)
+    return remap[name_id] if len(remap) else np.asarray(name_id, dtype=np.int64)
+
+
+def simulate(policy, zone, reltime, name_id, rrtype, names):
+    """
+    Returns boolean array, True for queries answered from cache.
+
+    reltime, name_id and rrtype are arrays (e.g. trace columns),
+    names maps name id to dns.name.Name, zone is anything accepted by
+    rfc2308.load_zone().
+    """
+    assert policy in POLICIES, 'only exact-match caches are supported'
+    module = importlib.import_module(policy)
+    auth = module.Authoritative(rfc2308.load_zone(zone))
+    times = np.asarray(reltime, dtype=np.int64)
+    assert np.all(times[1:] >= times[:-1]), 'time must not go back'
+    name_id = _canonical_ids(name_id, names)
+
+    pairs, pair_inv = np.unique((name_id << 16) | np.asarray(rrtype, dtype=np.int64),
+                                return_inverse=True)
+    codes, pair_ttls, extras = _keys(auth, names, pairs)
+    key_codes, pair_key = np.unique(codes, return_inverse=True)
+    keys = pair_key[pair_inv]
+    ttls = pair_ttls[pair_inv]
+
+    order = np.argsort(keys, kind='stable')
+    stores = np.empty(len(times), dtype=bool)
+    stores[order] = _chain_misses(times[order], keys[order], ttls[order],
+                                  np.zeros(len(times), dtype=bool))
+    if extras:
+        _refresh(times, keys, ttls, stores, pair_inv, key_codes, pair_key, extras)
+    return ~stores
+
+
+def _refresh(times, keys, ttls, stores, pair_inv, key_codes, pair_key, extras):
+    """
+    Recompute keys refreshed by additional answers of misses, in place.
+    """
+    # flat table of additional answers sorted by pair, known keys only
+    table = sorted((pair_idx, code, ttl) for pair_idx, answers in extras.items()
+                   for code, ttl in answers)
+    ex_pair, ex_code, ex_ttl = (np.array(column, dtype=np.int64) for column in zip(*table))
+    ex_key = np.searchsorted(key_codes, ex_code)
+    known = ex_key < len(key_codes)
+    known[known] = key_codes[ex_key[known]] == ex_code[known]
+    if not known.any():
+        return  # refreshed keys are never queried
+    ex_pair, ex_key, ex_ttl = ex_pair[known], ex_key[known], ex_ttl[known]
+
+    # one forced store per miss and additional answer
+    rows = np.flatnonzero(np.isin(pair_inv, ex_pair) & stores)
+    first = np.searchsorted(ex_pair, pair_inv[rows], side='left')
+    count = np.searchsorted(ex_pair, pair_inv[rows], side='right') - first
+    f_rows = np.repeat(rows, count)
+    offsets = np.arange(len(f_rows)) - np.repeat(np.cumsum(count) - count, count)
+    f_ex = np.repeat(first, count) + offsets
+    f_keys = ex_key[f_ex]
+    f_ttls = ex_ttl[f_ex]
+    # refreshed keys must not produce additional answers themselves
+    assert not np.isin(f_keys, pair_key[ex_pair]).any(), 'chained additional answers'
+
+    q_rows = np.flatnonzero(np.isin(keys, np.unique(f_keys)))
+    rows = np.concatenate((q_rows, f_rows))
+    all_keys = np.concatenate((keys[q_rows], f_keys))
+    all_ttls = np.concatenate((ttls[q_rows], f_ttls))
+    forced = np.concatenate((np.zeros(len(q_rows), dtype=bool), np.ones(len(f_rows), dtype=bool)))
+    order = np.lexsort((rows, all_keys))
+    result = _chain_misses(times[rows][order], all_keys[order], all_ttls[order], forced[order])
+    is_query = ~forced[order]
+    stores[rows[order][is_query]] = result[is_query]
+
+
+def hourly(reltime, hits):
+    """
+    Cumulative (time, hit, miss) at each row written by qlog2cache.replay().
+    """
+    times = np.asarray(reltime, dtype=np.int64)
+    cum_hits = np.cumsum(hits)
+    rows = []
+    prevtime = 0
+    while True:
+        idx = int(np.searchsorted(times, prevtime + 3600, side='left'))
+        if idx == len(times):
+            return rows
+        now = int(times[idx])
+        hit = int(cum_hits[idx])
+        rows.append((now, hit, idx + 1 - hit))
+        prevtime = now // 3600 * 3600
+
+
+def columns(queries):
+    """
+    Build (reltime, name_id, rrtype, names) arrays from iterable of queries.
+    """
+    ids = {}
+    names = []
+    times = array.array('q')
+    name_ids = array.array('q')
+    rrtypes = array.array('q')
+    for reltime, name, rrtype in queries:
+        name_id = ids.get(name)
+        if name_id is None:
+            name_id = ids[name] = len(names)
+            names.append(name)
+        times.append(reltime)
+        name_ids.append(name_id)
+        rrtypes.append(rrtype)
+    return (np.frombuffer(times, dtype=np.int64), np.frombuffer(name_ids, dtype=np.int64),
+            np.frombuffer(rrtypes, dtype=np.int64), names)
+
+
+def load(path):
+    """
+    (reltime, name_id, rrtype, names) of trace directory, columns are memory-mapped.
+    """
+    trace = tracefile.Trace(path)
+    return tuple(np.load(os.path.join(path, column + '.npy'), mmap_mode='r')
+                 for column, _, _ in tracefile.COLUMNS) + (trace.names,)
+
+
+def replay(policies, zone, reltime, name_id, rrtype, names, out):
+    """
+    Vectorized equivalent of qlog2cache.replay() for given policies.
+    """
+    import qlog2cache
+    zone = rfc2308.load_zone(zone)
+    results = [hourly(reltime, simulate(policy, zone, reltime, name_id, rrtype, names))
+               for policy in policies]
+    report = qlog2cache.Report(out, policies, ['hit', 'miss', 'auth'])
+    for rows in zip(*results):
+        report.write(rows[0][0], [(hit, miss, miss) for _, hit, miss in rows])
@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+
+"""
+Answer tables of a zone and their binary snapshot.
+
+ZoneIndex holds everything the simulated Authoritative needs:
+- nodes: canonical owner name -> {rrtype: TTL}
+- nsec: owner -> (next owner, RR types from the bitmap as bitmask)
+- nsecs: sorted list of NSEC owners
+- ns: owner -> tuple of NS target names
+- neg_ttl: negative TTL from SOA
+- nsec3: hashed owner -> (next hashed owner, RR types as bitmask)
+- nsec3param: (iterations, salt) from NSEC3PARAM or None
+
+NSEC3 owner names are not part of the namespace, they are not in nodes.
+
+A zone can change during replay: versions() loads later versions of the
+zone and keeps only their ZoneDiff against the previous version, advance()
+applies diffs active at given time to the tables in place.
+
+Parsing a zone file with dnspython takes seconds, so the tables can be
+compiled once into a binary snapshot which later runs decode into the same
+tables without parsing the zone with dnspython:
+    zoneindex.py root.zone root.snap
+Snapshot files are recognized by their magic and can be used anywhere
+a zone file is expected.
+"""
+
+import base64
+import bisect
+import mmap
+import struct
+import sys
+
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+import dns.zone
+
+MAGIC = b'DNSSNAP1'
+_HEADER = struct.Struct('<8sII')  # magic, neg_ttl, number of names
+_FLAG_NODE = 1
+_FLAG_NSEC = 2
+TABLES = ('nodes', 'nsec', 'ns', 'nsec3')  # tables changed by ZoneDiff
+
+
+class ZoneIndex(object):
+    def __init__(self, nodes, nsec, ns, neg_ttl, nsec3=None, nsec3param=None):
+        self.nodes = nodes
+        self.nsec = nsec
+        self.ns = ns
+        self.neg_ttl = neg_ttl
+        self.nsecs = sorted(nsec)
+        self.nsec3 = nsec3 or {}
+        self.nsec3param = nsec3param
+        self.diffs = []  # (activation reltime, ZoneDiff) of later versions
+        self.version = 0  # number of diffs applied
+
+    def apply(self, diff):
+        """
+        Change tables to the next version, sorted NSEC owners are updated
+        in place instead of sorting them again.
+        """
+        for table in TABLES:
+            entries = getattr(self, table)
+            for owner in diff.deleted[table]:
+                del entries[owner]
+            entries.update(diff.added[table])
+        for owner in diff.deleted['nsec']:
+            del self.nsecs[bisect.bisect_left(self.nsecs, owner)]
+        for owner in diff.added['nsec']:
+            bisect.insort(self.nsecs, owner)
+        self.neg_ttl = diff.neg_ttl
+
+    def advance(self, reltime, version):
+        """
+        Apply diffs of versions active at reltime. Returns diffs applied
+        after given version so that tables derived from this zone can catch up.
+        """
+        while self.version < len(self.diffs) and self.diffs[self.version][0] <= reltime:
+            self.apply(self.diffs[self.version][1])
+            self.version += 1
+        return [diff for _, diff in self.diffs[version:self.version]]
+
+    @classmethod
+    def from_zone(cls, zone):
+        nodes = {}
+        nsec = {}
+        ns = {}
+        nsec3 = {}
+        for name, node in zone.nodes.items():
+            name = name.canonicalize()
+            rdataset = node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.NSEC3)
+            if rdataset is not None:
+                assert len(rdataset) == 1
+                nxt = base64.b32hexencode(rdataset[0].next).lower()
+                nsec3[name] = (dns.name.Name((nxt,) + name.labels[1:]),
+                               _bitmap_to_mask(rdataset[0].windows))
+                continue
+            rrtypes = nodes.setdefault(name, {})
+            for rdataset in node.rdatasets:
+                if rdataset.rdclass != dns.rdataclass.IN or rdataset.covers != dns.rdatatype.NONE:
+                    continue
+                rrtypes[rdataset.rdtype] = rdataset.ttl
+                if rdataset.rdtype == dns.rdatatype.NSEC:
+                    assert len(rdataset) == 1
+                    nsec[name] = (rdataset[0].next.canonicalize(),
+                                  _bitmap_to_mask(rdataset[0].windows))
+                elif rdataset.rdtype == dns.rdatatype.NS:
+                    ns[name] = tuple(rdata.target.canonicalize() for rdata in rdataset)
+
+        soa_rrs = zone[zone.origin].find_rdataset(dns.rdataclass.IN, dns.rdatatype.SOA)
+        neg_ttl = min(soa_rrs.ttl, soa_rrs[0].minimum)  # https://tools.ietf.org/html/rfc2308#section-5
+        param = zone[zone.origin].get_rdataset(dns.rdataclass.IN, dns.rdatatype.NSEC3PARAM)
+        nsec3param = (param[0].iterations, param[0].salt) if param is not None else None
+        return cls(nodes, nsec, ns, neg_ttl, nsec3, nsec3param)
+
+    @classmethod
+    def from_file(cls, zonefile, origin=dns.name.root):
+        return cls.from_zone(dns.zone.from_file(zonefile, origin=origin, relativize=False))
+
+    @classmethod
+    def from_snapshot(cls, snapfile):
+        with open(snapfile, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return cls._decode(buf)
+
+    def save(self, snapfile):
+        """
+        Write binary snapshot: header, table of names in canonical order
+        (as wire format), then per name record of flags, RR types + TTLs,
+        NSEC next index + types, NS target indexes. NSEC3 zones have
+        trailing section: iterations, salt, number of NSEC3 records and
+        per record owner and next owner in wire format + types.
+        """
+        names = set(self.nodes)
+        for nxt, _ in self.nsec.values():
+            names.add(nxt)
+        for targets in self.ns.values():
+            names.update(targets)
+        names = sorted(names)
+        index = {name: idx for idx, name in enumerate(names)}
+
+        out = [_HEADER.pack(MAGIC, self.neg_ttl, len(names))]
+        for name in names:
+            out.append(_name_wire(name))
+        for name in names:
+            flags = 0
+            if name in self.nodes:
+                flags |= _FLAG_NODE
+            if name in self.nsec:
+                flags |= _FLAG_NSEC
+            rrtypes = self.nodes.get(name, {})
+            out.append(struct.pack('<BH', flags, len(rrtypes)))
+            for rrtype, ttl in sorted(rrtypes.items()):
+                out.append(struct.pack('<HI', rrtype, ttl))
+            if name in self.nsec:
+                nxt, mask = self.nsec[name]
+                types = mask_to_types(mask)
+                out.append(struct.pack('<IH%dH' % len(types), index[nxt], len(types), *sorted(types)))
+            targets = self.ns.get(name, ())
+            out.append(struct.pack('<H%dI' % len(targets), len(targets),
+                                   *[index[target] for target in targets]))
+        if self.nsec3 or self.nsec3param:
+            iterations, salt = self.nsec3param or (0, b'')
+            out.append(struct.pack('<HB', iterations, len(salt)) + salt)
+            out.append(struct.pack('<I', len(self.nsec3)))
+            for owner, (nxt, mask) in sorted(self.nsec3.items()):
+                types = mask_to_types(mask)
+                out.extend(_name_wire(name) for name in (owner, nxt))
+                out.append(struct.pack('<H%dH' % len(types), len(types), *types))
+        with open(snapfile, 'wb') as f:
+            f.write(b''.join(out))
+
+    @classmethod
+    def _decode(cls, buf):
+        magic, neg_ttl, count = _HEADER.unpack_from(buf, 0)
+        assert magic == MAGIC, 'not a zone snapshot'
+        offset = _HEADER.size
+        names = []
+        for _ in range(count):
+            name, offset = _read_name(buf, offset)
+            names.append(name)
+
+        nodes = {}
+        nsec = {}
+        ns = {}
+        unpack_from = struct.unpack_from
+        for name in names:
+            flags, rrcount = unpack_from('<BH', buf, offset)
+            offset += 3
+            rrtypes = {}
+            for _ in range(rrcount):
+                rrtype, ttl = unpack_from('<HI', buf, offset)
+                rrtypes[rrtype] = ttl
+                offset += 6
+            if flags & _FLAG_NODE:
+                nodes[name] = rrtypes
+            if flags & _FLAG_NSEC:
+                nxt, ntypes = unpack_from('<IH', buf, offset)
+                offset += 6
+                types = unpack_from('<%dH' % ntypes, buf, offset)
+                offset += 2 * ntypes
+                nsec[name] = (names[nxt], sum(1 << rrtype for rrtype in set(types)))
+            ntargets, = unpack_from('<H', buf, offset)
+            offset += 2
+            if ntargets:
+                ns[name] = tuple(names[idx] for idx in unpack_from('<%dI' % ntargets, buf, offset))
+                offset += 4 * ntargets
+
+        nsec3 = {}
+        nsec3param = None
+        if offset < len(buf):
+            iterations, salt_len = unpack_from('<HB', buf, offset)
+            offset += 3
+            nsec3param = (iterations, bytes(buf[offset:offset + salt_len]))
+            offset += salt_len
+            nrecords, = unpack_from('<I', buf, offset)
+            offset += 4
+            for _ in range(nrecords):
+                owner, offset = _read_name(buf, offset)
+                nxt, offset = _read_name(buf, offset)
+                ntypes, = unpack_from('<H', buf, offset)
+                types = unpack_from('<%dH' % ntypes, buf, offset + 2)
+                offset += 2 + 2 * ntypes
+                nsec3[owner] = (nxt, sum(1 << rrtype for rrtype in set(types)))
+        return cls(nodes, nsec, ns, neg_ttl, nsec3, nsec3param)
+
+
+class ZoneDiff(object):
+    """
+    Change between two versions of zone tables in IXFR style: entries
+    deleted from the old version and entries added by the new one,
+    modified entry is deleted and added again. deleted and added map
+    table name from TABLES to {owner: value}.
+    """
+    def __init__(self, deleted, added, neg_ttl):
+        self.deleted = deleted
+        self.added = added
+        self.neg_ttl = neg_ttl
+
+    @classmethod
+    def between(cls, old, new):
+        deleted = {}
+        added = {}
+        for table in TABLES:
+            before = getattr(old, table)
+            after = getattr(new, table)
+            deleted[table] = {owner: value for owner, value in before.items()
+                              if after.get(owner) != value}
+            added[table] = {owner: value for owner, value in after.items()
+                            if before.get(owner) != value}
+        return cls(deleted, added, new.neg_ttl)
+
+    def __len__(self):
+        """
+        Number of entries deleted and added.
+        """
+        return sum(len(self.deleted[table]) + len(self.added[table]) for table in TABLES)
+
+
+def _name_wire(name):
+    wire = name.to_digestable()
+    return struct.pack('<B', len(wire)) + wire
+
+
+def _read_name(buf, offset):
+    """
+    Name stored by _name_wire() at offset, returns (name, offset after it).
+    """
+    length = buf[offset]
+    labels = []
+    pos = offset + 1
+    while True:
+        label_len = buf[pos]
+        labels.append(buf[pos + 1:pos + 1 + label_len])
+        pos += 1 + label_len
+        if not label_len:
+            break
+    return dns.name.Name(labels), offset + 1 + length
+
+
+def is_snapshot(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load(zonedb, origin=dns.name.root):
+    """
+    zonedb can be ZoneIndex, dns.zone.Zone, path to zone file or to snapshot,
+    origin applies to zone files
+    """
+    if isinstance(zonedb, ZoneIndex):
+        return zonedb
+    if isinstance(zonedb, dns.zone.Zone):
+        return ZoneIndex.from_zone(zonedb)
+    if is_snapshot(zonedb):
+        return ZoneIndex.from_snapshot(zonedb)
+    return ZoneIndex.from_file(zonedb, origin)
+
+
+def versions(zonedb, later, origin=dns.name.root):
+    """
+    Tables of zonedb with later versions scheduled: later is sequence of
+    (activation reltime, zonedb) in order of activation. Snapshots do not
+    keep scheduled versions.
+    """
+    zone = prev = load(zonedb, origin)
+    for activation, version in later:
+        if zone.diffs and activation < zone.diffs[-1][0]:
+            raise ValueError('zone versions must be in order of activation')
+        new = load(version, origin)
+        if new.nsec3param != zone.nsec3param:
+            raise ValueError('change of NSEC3 parameters is not supported')
+        zone.diffs.append((activation, ZoneDiff.between(prev, new)))
+        prev = new
+    return zone
+
+
+def _bitmap_to_mask(bitmap_windows):
+    """
+    Convert dnspython's list of NSEC windows to integer with bit set
+    for each RR type number present.
+    """
+    mask = 0
+    for (window, bitmap) in bitmap_windows:
+        for i in range(0, len(bitmap)):
+            byte = bitmap[i]
+            for j in range(0, 8):
+                if byte & (0x80 >> j):
+                    mask |= 1 << (window * 256 + i * 8 + j)
+    return mask
+
+
+def mask_to_types(mask):
+    """
+    List of RR type numbers set in bitmask.
+    """
+    types = []
+    while mask:
+        low_bit = mask & -mask
+        types.append(low_bit.bit_length() - 1)
+        mask ^= low_bit
+    return types
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: {} zonefile snapshot'.format(sys.argv[0]))
+    load(sys.argv[1]).save(sys.argv[2])